@@ -8,6 +8,11 @@ defaults = {
 'TUNE_POT_ADC': (int, 1),
 'MPD_HOST': (str, 'localhost'),
 'MPD_PORT': (int, 6600),
+'MPD_NUM_SERVERS': (int, 2),
+'MPD_CLIENT': (('sync','async'), 'sync'),
+'MPD_PLACEMENT': (('lru','lra','distance','pinned'), 'lru'),
+'MPD_PINS': (str, ''),
+'NOW_PLAYING': (('idle','poll'), 'idle'),
 'LOW_VOL_TOLERANCE': (int, 10),
 'TIME_FOR_POWER_OFF': (int, 10),
 'LED_HOST': (str, 'localhost'),
@@ -30,7 +35,44 @@ defaults = {
 'SPIMISO': (int, 23),
 'SPIMOSI': (int, 24),
 'SPICS': (int, 25),
+'SPI_BUS': (int, 0),
+'SPI_DEVICE': (int, 0),
+'SPI_SPEED_HZ': (int, 1000000),
+'ADC_OVERSAMPLE': (int, 1),
+'SAMPLER_MODE': (('thread','process'), 'thread'),
+'SAMPLE_RATE': (int, 50),
+'SAMPLE_BUFFER_LEN': (int, 8),
+'SAMPLE_THRESHOLD': (int, 2),
+'ADC_TRACE': (str, ''),
 'GAP_FACTOR': (float, 1.4),
+'STATION_BANK_SIZE': (int, 0),
+'STATION_BANK': (int, 0),
+'BANK_DWELL': (float, 2.0),
+'BANK_EDGE': (int, 8),
+'TUNE_SETTLE': (float, 0.3),
+'SWEEP_VELOCITY': (float, 200.0),
+'PRELOAD_HORIZON': (float, 1.0),
+'PRELOAD_COUNT': (int, 2),
+'STATE_FILE': (str, 'state.json'),
+'WATCHDOG_BUDGETS': (str, 'vol_read=50,tuner_read=50,mpd_switch=1500,preload=1500,web_update=300,dial_render=100'),
+'WATCHDOG_DEGRADE': (int, 0),
+'IDLE_AFTER': (float, 30.0),
+'SLEEP_AFTER': (float, 300.0),
+'IDLE_WAKE': (int, 8),
+'IDLE_SAMPLE_RATE': (int, 10),
+'SLEEP_SAMPLE_RATE': (int, 4),
+'IDLE_LED_FPS': (float, 2.0),
+'VOL_TAPER': (('linear','log'), 'linear'),
+'DETUNE_CURVE': (('erf','linear','none'), 'erf'),
+'MIXER_BACKEND': (('amixer','mpd','null'), 'amixer'),
+'MIXER_CONTROL': (str, 'numid=1'),
+'VOLUME_EASE_IN': (float, 1.0),
+'VOL_POT_FILTERS': (str, ''),
+'TUNE_POT_FILTERS': (str, ''),
+'POT_EMA_FAC': (float, 0.8),
+'POT_MEDIAN_LEN': (int, 5),
+'POT_HYSTERESIS': (int, 4),
+'POT_DEADBAND': (int, 2),
 'LED_POWER_PIN': (int, 17),
 'LED_DIAL_PIN': (int, 27)
 }
@@ -9,24 +9,28 @@ Turning the volume below a set tolerance for a set amount of time
 will shut down the RPi.
 """
 
-"""
-Local defines
-"""
-# Time tick for the main loop
-TICK = 0.2
-
 """
 Imports
+
+Only what's needed to start booting; the heavy modules (RPi.GPIO, mpd,
+http.server) are imported by the boot phases that use them, so they
+load in parallel with everything else.
 """
 try:
 	import fcntl, logging, os, sys, time, signal, math, queue, random, socket, sqlite3, struct
 
-	import service.led
-	import service.www
+	import service.adc
+	import service.boot
+	import service.governor
+	import service.latency
+	import service.mixer
 	import service.option_loader
 	import service.pots
-	import radio.rmpd
-	import radio.dialview
+	import service.reactor
+	import service.sampler
+	import service.trace
+	import service.watchdog
+	import radio.stations
 
 except RuntimeError as e:
 	logging.critical("[ Radio ] Error loading an import: " + str(e))
@@ -44,21 +48,10 @@ Open config database.
 """
 opt_ldr = service.option_loader.OptionLoader('config.db')
 
-try:
-	# Reset/truncate the log file
-	with open('main.log', 'w'):
-		pass
-	logging.basicConfig(level=getattr(logging, opt_ldr.fetch('LOG_LEVEL')))
-except IOError as e:
-	logging.critical("[ Radio ] Can't open log file for write: " + str(e))
-
 
 """
-Miscellaneous classes and functions
+Miscellaneous functions
 """
-class RadioCleanup(Exception):
-	pass
-
 def get_ip_address(ifname):
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         return socket.inet_ntoa(fcntl.ioctl(
@@ -68,213 +61,322 @@ def get_ip_address(ifname):
                 )[20:24])
 
 
+def boot_leds():
+	"""
+	Start the LEDs: flicker the power LED and fade up the dial.
+	The fade runs in the LED's own thread; nothing waits for it.
+	"""
+	import service.led
+
+	dial_led_queue = queue.Queue()
+	pwr_led_queue = queue.Queue()
+
+	dial_led = service.led.Led(dial_led_queue, opt_ldr.fetch('LED_DIAL_PIN'), opt_ldr)
+	pwr_led = service.led.Led(pwr_led_queue, opt_ldr.fetch('LED_POWER_PIN'), opt_ldr)
+
+	dial_led.start()
+	pwr_led.start()
+
+	logging.debug("[ Radio ] PowerLed flicker on.")
+	pwr_led_queue.put('flicker')
+
+	logging.debug("[ Radio ] DialLed fade in.")
+	dial_led_queue.put('fade_up')
+
+	return (dial_led_queue, pwr_led_queue)
+
+
+def boot_web(notify):
+	"""
+	Bind and start the web server.
+	"""
+	import service.www
+
+	web_svr_queue = queue.Queue()
+	web_svr = service.www.RadioWebServer(
+			web_svr_queue,
+			get_ip_address(opt_ldr.fetch('WEB_INTERFACE')),
+			opt_ldr.fetch('WEB_HTTP_PORT'),
+			notify)
+	web_svr.start()
+	return web_svr_queue
+
+
+def boot_mpd(boot, stations, snap, playlists, latency):
+	"""
+	Connect to every MPD server, and resume the snapshot's station
+	(if there is one) straight away.
+
+	With MPD_CLIENT 'async', the servers are driven by the asyncio
+	client (see radio.aiompd), if python-mpd2 has it. MPD_PLACEMENT and
+	MPD_PINS choose which server a stream goes on (see radio.placement).
+	"""
+	import radio.placement
+	import radio.rmpd
+	import radio.snapshot
+
+	policy = opt_ldr.fetch('MPD_PLACEMENT')
+	pins = radio.placement.parse_pins(opt_ldr.fetch('MPD_PINS'))
+
+	str_man = None
+	if opt_ldr.fetch('MPD_CLIENT') == 'async':
+		try:
+			from radio import aiompd
+			str_man = aiompd.ThreadedStreamManager(
+					opt_ldr.fetch('MPD_HOST'),
+					opt_ldr.fetch('MPD_PORT'),
+					opt_ldr.fetch('MPD_NUM_SERVERS'),
+					latency,
+					policy,
+					pins)
+		except ImportError as e:
+			logging.warning("[ Radio ] asyncio MPD client unavailable, using the blocking one: " + str(e))
+	if str_man is None:
+		str_man = radio.rmpd.StreamManager(
+				opt_ldr.fetch('MPD_HOST'),
+				opt_ldr.fetch('MPD_PORT'),
+				opt_ldr.fetch('MPD_NUM_SERVERS'),
+				latency,
+				policy = policy,
+				pins = pins)
+	str_man.set_loader(stations.stream)
+	str_man.connect()
+	boot.run('resume', radio.snapshot.resume, snap, str_man, playlists)
+	return str_man
+
+
 def main(argv):
 	"""
 	Main loop.
 
 	Setup pins, turn on LEDs, watch pots.
-	"""
 
-	do_system_shutdown = False
-	low_vol_start = -1
+	Independent parts of the startup run at the same time (see
+	service.boot); pass '--boot-profile' to print how long each took.
+
+	Station switch and MPD command timings are logged on SIGUSR1, and
+	at exit (see service.latency).
+	"""
 
 	try:
 		"""
 		Setup the radio object, and begin startup routine.
 		"""
 		logging.debug('[ Radio ] Startup begun')
+		boot = service.boot.BootTimeline()
 
-		logging.debug('[ Radio ] Starting LED service')
-		dial_led_queue = queue.Queue()
-		pwr_led_queue = queue.Queue()
+		reactor = service.reactor.Reactor()
+		latency = service.latency.LatencyRecorder()
 
-		dial_led = service.led.Led(dial_led_queue, opt_ldr.fetch('LED_DIAL_PIN'))
-		pwr_led = service.led.Led(pwr_led_queue, opt_ldr.fetch('LED_POWER_PIN'))
+		def open_stations():
+			stations = radio.stations.StationCatalogue('config.db', opt_ldr.fetch('STATION_BANK_SIZE'))
+			bank_sel = radio.stations.BankSelector(
+					stations.num_banks(),
+					opt_ldr.fetch('STATION_BANK'),
+					opt_ldr.fetch('BANK_DWELL'),
+					opt_ldr.fetch('BANK_EDGE'))
+			cfg_watch = service.option_loader.ConfigWatcher('config.db')
+			return (stations, bank_sel, cfg_watch)
 
-		dial_led.start()
-		pwr_led.start()
-
-		logging.debug("[ Radio ] PowerLed flicker on.")
-		pwr_led_queue.put('flicker')
-
-		logging.debug("[ Radio ] DialLed fade in.")
-		dial_led_queue.put('fade_up')
-		# This doesn't work, b/c dial_led is it's own thread.
-		# dial_led_queue.join()
-		while dial_led_queue.empty() == False:
-			time.sleep(TICK)
-		logging.debug('[ Radio ] Fade up done. Continuing.')
+		(stations, bank_sel, cfg_watch) = boot.run('stations', open_stations)
 
+		def open_snapshot():
+			"""
+			The last run's snapshot, if it's for these playlists.
+			Its station's bank is selected, so the knob can be checked against it.
+			"""
+			import radio.snapshot
+			snap = radio.snapshot.Snapshot.load(opt_ldr.fetch('STATE_FILE'))
+			playlists = cfg_watch.checksum('playlists')
+			if snap is None or snap.playlists != playlists:
+				return (None, playlists)
+			if snap.station >= 0:
+				bank_sel.bank = min(stations.bank_of(snap.station), bank_sel.num_banks - 1)
+			return (snap, playlists)
+
+		(snap, playlists) = boot.run('snapshot', open_snapshot)
+		bank_set = stations.bank(bank_sel.bank)
+
+		logging.debug('[ Radio ] Starting LED, WWW and MPD services')
+		boot.spawn('mpd', boot_mpd, boot, stations, snap, playlists, latency)
+		boot.spawn('leds', boot_leds)
+		boot.spawn('web', boot_web, reactor.post)
+
+		def open_adc():
+			adc = service.adc.open_adc(opt_ldr)
+			if opt_ldr.fetch('ADC_TRACE'):
+				logging.info('[ Radio ] Recording ADC trace to ' + opt_ldr.fetch('ADC_TRACE'))
+				adc = service.trace.RecordingADC(adc, opt_ldr.fetch('ADC_TRACE'))
+			logging.debug('[ Radio ] ADC backend: ' + adc.name)
+			return adc
+
+		adc = boot.run('adc', open_adc)
+
+		def open_tuner():
+			tuner_knob = service.pots.TunerPotReader(opt_ldr.fetch('TUNE_POT_ADC'), len(bank_set), adc, opt_ldr)
+			tuner_knob.set_filters(opt_ldr.fetch('TUNE_POT_FILTERS'))
+			tuner_knob.read_pot()
+			return tuner_knob
+
+		tuner_knob = boot.run('tuner', open_tuner)
+
+		str_man = boot.wait('mpd')
+
+		def open_volume():
+			mixer = service.mixer.open_mixer(opt_ldr, str_man)
+			if snap is not None and snap.volume >= 0:
+				mixer.set_volume(snap.volume)
+			vol_knob = service.pots.VolumePotReader(opt_ldr.fetch('VOL_POT_ADC'), adc, mixer, opt_ldr)
+			vol_knob.smooth_fac = 0.9
+			vol_knob.set_filters(opt_ldr.fetch('VOL_POT_FILTERS'))
+			return (mixer, vol_knob)
+
+		(mixer, vol_knob) = boot.run('volume', open_volume)
+
+		text_dial = None
 		if opt_ldr.fetch('SHOW_DIAL'):
+			from radio import dialview as DV
 			logging.debug('[ Radio ] DialView started.')
-			text_dial = radio.dialview.DialView()
+			text_dial = DV.DialView()
 
-		logging.debug('[ Radio ] Starting WWW service')
-		web_svr_queue = queue.Queue()
-		web_svr = service.www.RadioWebServer(
-				web_svr_queue,
-				get_ip_address(opt_ldr.fetch('WEB_INTERFACE')),
-				opt_ldr.fetch('WEB_HTTP_PORT'))
-		web_svr.start()
-
-		logging.debug('[ Radio ] Creating volume knob')
-		vol_knob = service.pots.VolumePotReader(opt_ldr.fetch('VOL_POT_ADC'))
-		vol_knob.smooth_fac = 0.9
-
-		logging.debug('[ Radio ] Creating tuning knob')
-		con = sqlite3.connect('config.db')
-		with con:
-			cur = con.cursor()
-			cur.execute("SELECT * FROM playlists")
-			station_set = cur.fetchall()
-		tuner_knob = service.pots.TunerPotReader(opt_ldr.fetch('TUNE_POT_ADC'), len(station_set))
-
-		logging.debug('[ Radio ] Starting MPD stream manager')
-		str_host = opt_ldr.fetch('MPD_HOST')
-		str_port = opt_ldr.fetch('MPD_PORT')
-		str_man = radio.rmpd.StreamManager(str_host, str_port, 2)
-		for st in station_set:
-			(name, playlist, random, play_func) = st[1:]
-			str_man.register_stream(str(name), str(playlist), bool(random), str(play_func))
+		from radio import controller as RC
 
-		logging.debug("[ Radio ] Main loop.")
+		(dial_led_queue, pwr_led_queue) = boot.wait('leds')
+		web_svr_queue = boot.wait('web')
 
-		while True:
-			"""
-			1.	Read the volume pot.
-				Adjust the volume cap and dial brightness
-				based on tuning distance.
-				Start a shutdown timer if the volume is set low enough.
-			"""
-			try:
-				vol_knob.read_pot()
-			except service.pots.PotChange:
+		now_playing = None
+		if opt_ldr.fetch('NOW_PLAYING') == 'idle':
+			from radio import nowplaying
+			now_playing = nowplaying.NowPlayingWatcher(
+					opt_ldr.fetch('MPD_HOST'),
+					opt_ldr.fetch('MPD_PORT'),
+					lambda: str_man.active_server)
+			now_playing.on_change(lambda record: web_svr_queue.put(['html', record.web_data(time.monotonic())]))
+
+			def first_audio(record):
 				"""
-				If the volume is low enough, start a timer
-				Otherwise, reset it.
-				If it's running, see for how long, and
-				shutdown if it's past the cutoff.
+				Mark when the radio first plays audio, as switches are timed.
 				"""
-				if (vol_knob.volume <= opt_ldr.fetch('LOW_VOL_TOLERANCE')):
-					if (low_vol_start == -1):
-						logging.info("[ Radio ] Shutdown timer started.")
-						low_vol_start = time.time()
-					else:
-						low_vol_delta = time.time() - low_vol_start
-
-						if low_vol_delta >= opt_ldr.fetch('TIME_FOR_POWER_OFF'):
-							logging.info("[ Radio ]  Volume low - Shutting down...")
-							do_system_shutdown = True
-							raise RadioCleanup
-							return 0
-							break
-				else:
-					low_vol_start = -1
-
+				if record.playing and not boot.marked('first_audio'):
+					boot.mark('first_audio', record.at)
+					reactor.post('first_audio')
+			now_playing.on_change(first_audio)
+			now_playing.start()
+
+		watchdog = service.watchdog.Watchdog(
+				service.watchdog.parse_budgets(opt_ldr.fetch('WATCHDOG_BUDGETS')),
+				opt_ldr.fetch('WATCHDOG_DEGRADE'))
+		governor = service.governor.IdleGovernor(reactor, [
+				('active', 0),
+				('idle', opt_ldr.fetch('IDLE_AFTER')),
+				('sleep', opt_ldr.fetch('SLEEP_AFTER'))])
+		radio_ctl = RC.RadioController(
+				reactor,
+				opt_ldr,
+				vol_knob,
+				tuner_knob,
+				str_man,
+				stations,
+				bank_sel,
+				cfg_watch,
+				web_svr_queue,
+				dial_led_queue,
+				text_dial,
+				opt_ldr.fetch('STATE_FILE'),
+				watchdog,
+				governor,
+				latency,
+				now_playing)
+
+		boot.run('start', radio_ctl.start)
+
+		logging.debug('[ Radio ] Starting pot sampler')
+		sampler_queue = queue.Queue()
+		if opt_ldr.fetch('SAMPLER_MODE') == 'process':
+			sampler_class = service.sampler.ProcessSampler
+		else:
+			sampler_class = service.sampler.PotSampler
+		sampler = sampler_class(
+				sampler_queue,
+				reactor.queue,
+				adc,
+				[vol_knob.pot_pin, tuner_knob.pot_pin],
+				opt_ldr.fetch('SAMPLE_RATE'),
+				opt_ldr.fetch('SAMPLE_BUFFER_LEN'),
+				opt_ldr.fetch('SAMPLE_THRESHOLD'))
+		boot.run('sampler', sampler.start)
+		watchdog.start()
+
+		def power_state(state):
 			"""
-			2.	Read the tuner knob pot.
-				Adjust the volume scaling.
-				Update the MPD server.
+			Slow the pot sampler and LED animations as the radio idles.
 			"""
-			try:
-				tuner_knob.read_pot()
-			except service.pots.PotChange as pot_notif:
-				"""
-				Update volume scaling based on tuning distance.
-				Adjust dial brightness.
-				"""
-				if tuner_knob.is_tuned():
-					try:
-						r = tuner_knob.cfg_st_radius
-						g = tuner_knob.cfg_st_gap
-						fac = opt_ldr.fetch('GAP_FACTOR')
-						num_st = len(str_man.streams)
-						d = abs(tuner_knob.tuning - tuner_knob.tuned_to())
-						vol_adj = 0.5 * (1 + math.erf((r - d)/(0.4*r)))
-					except (ArithmeticError, FloatingPointError, ZeroDivisionError) as e:
-						logging.error("[ Radio ] Math error: " + str(e))
-						vol_adj = 1.0
-				else:
-					vol_adj = 0
-
-				if vol_adj > 1:
-					vol_adj = 1
-				if vol_adj < 0:
-					vol_adj = 0
-
-				d_vol = abs(int(vol_knob.volume_cap) - int(vol_adj * vol_knob.volume))
-				if d_vol > 3:
-					vol_knob.volume_cap = vol_adj * vol_knob.volume
-					vol_knob.volumize(vol_knob.volume_cap)
-#					dial_led_queue.put(['adjust_brightness', vol_adj])
+			rates = {
+				'active': (opt_ldr.fetch('SAMPLE_RATE'), service.led.Led.frame_rate),
+				'idle': (opt_ldr.fetch('IDLE_SAMPLE_RATE'), opt_ldr.fetch('IDLE_LED_FPS')),
+				'sleep': (opt_ldr.fetch('SLEEP_SAMPLE_RATE'), opt_ldr.fetch('IDLE_LED_FPS')),
+				}
+			(sample_rate, led_fps) = rates[state]
+			sampler_queue.put(['set_rate', sample_rate])
+			pwr_led_queue.put(['set_frame_rate', led_fps])
+			dial_led_queue.put(['set_frame_rate', led_fps])
 
+		governor.on_change(power_state)
 
-				"""
-				Update the MPD server.
-				"""
-				if pot_notif.is_new_station:
-					try:
-						"""
-						Prepare backup stream.
-						If tuned to the left, pre-load the right-most station,
-						and vice-versa.
-						If tuned to the first station (L or R of it),
-						then pre-load station #2.
-						If tuned to the last station (L or R of it),
-						then pre-load station before it.
-						"""
-						station_id = tuner_knob.SID
-						str_man.activate_stream(tuner_knob.SID)
-
-						st_id_L = station_id - 1
-						if st_id_L < 0:
-							st_id_L = station_id + 1
-
-						st_id_R = station_id + 1
-						if st_id_R > len(str_man.streams):
-							st_id_L = station_id - 1
-
-						(st_L, st_R) = tuner_knob.get_closest_freqs()
-						if st_L == tuner_knob.tuned_to():
-							str_man.preload(st_id_R)
-						elif st_R == tuner_knob.tuned_to():
-							str_man.preload(st_id_R)
-
-						"""
-						Update the web server
-						"""
-						songdata = str_man.query_server('currentsong')
-						status = str_man.query_server('status')
-						senddata = dict()
-						keys = ('artist','album','title','file','elapsed','time')
-						senddata = [songdata for k in keys]
-						web_svr_queue.put(['html', senddata])
-
-					except radio.rmpd.CommandError as e:
-						logging.error("[ Radio ] mpd:Error load " + st_name + ":" + str(e))
-						pass
-					except ValueError as e:
-						logging.error("[ Radio ]  ValueError on play " + st_name + ": " + str(e))
-					except IOError as e:
-						logging.error("[ Radio ] Can't send data to web server")
-				#endif
-			#End of TunerKnob.read_pot()
+		signal.signal(signal.SIGUSR1,
+				lambda signum, frame: logging.info("[ Radio ] Latency:\n" + latency.report()))
+		boot.mark('ready')
 
+		reported = False
 
+		def boot_report():
 			"""
-			3.	Show a tuning dial if configured to do so; finish the loop with a delay.
+			Log the boot timeline, once it has first audio (or that
+			won't be known: there's no now_playing watcher, or nothing
+			started playing in time).
 			"""
-			if opt_ldr.fetch('SHOW_DIAL'):
-				text_dial.display(vol_knob, tuner_knob)
+			nonlocal reported
+			if reported:
+				return
+			reported = True
+			logging.info("[ Radio ] Boot timeline (ms):\n" + boot.report())
+			if '--boot-profile' in argv:
+				print(boot.report())
+
+		if now_playing is None:
+			boot_report()
+		else:
+			reactor.on('first_audio', boot_report)
+			reactor.call_later(nowplaying.START_TIMEOUT, boot_report)
+
+		logging.debug("[ Radio ] Main loop.")
+		try:
+			reactor.run()
+		except KeyboardInterrupt:
+			pass
 
-			time.sleep(TICK)
-		#end while
-	except (KeyboardInterrupt, RadioCleanup):
 		"""
 		Do a cleanup of services and hardware.
 		"""
 		logging.debug("[ Radio ] Cleaning up...")
 
+		logging.info("[ Radio ] Station switches: " + str(radio_ctl.sweep.activated)
+				+ ", avoided while sweeping: " + str(radio_ctl.sweep.avoided))
+		logging.info("[ Radio ] Preload hit rate: {:.0%}".format(str_man.hit_rate()))
+		radio_ctl.save_state()
+		watchdog.close()
+		logging.info("[ Radio ] Main loop phases:\n" + watchdog.report())
+		logging.info("[ Radio ] Time and CPU per power state:\n" + governor.report())
+		logging.info("[ Radio ] Latency:\n" + latency.report())
+
+		sampler_queue.put('quit')
+		sampler.join()
+		adc.close()
+		mixer.close()
+		if now_playing is not None:
+			now_playing.close()
+		str_man.close()
+		cfg_watch.close()
 		pwr_led_queue.put('quit')
 		dial_led_queue.put('quit')
 		web_svr_queue.put('quit')
@@ -282,9 +384,8 @@ def main(argv):
 #		dial_led_queue.join()
 #		web_svr_queue.join()
 
-		if do_system_shutdown:
-			play_mp3('beep.mp3')
-			os.system(SHUTDOWN_CMD)
+		if radio_ctl.do_system_shutdown:
+			os.system(opt_ldr.fetch('SHUTDOWN_CMD'))
 
 		return 0
 
@@ -296,13 +397,26 @@ def main(argv):
 	except RuntimeError as e:
 		logging.critical("[ main() ] RuntimeError: " + str(e))
 
+	return 1
+
 #End of main()
 
 
 """
 Run the program.
+
+The log is only set up here: a sampling process (see
+service.sampler.ProcessSampler) imports this module too.
 """
 if __name__ == "__main__":
+	try:
+		# Reset/truncate the log file
+		with open('main.log', 'w'):
+			pass
+		logging.basicConfig(level=getattr(logging, opt_ldr.fetch('LOG_LEVEL')))
+	except IOError as e:
+		logging.critical("[ Radio ] Can't open log file for write: " + str(e))
+
 	logging.info("[ Radio ] Calling main()")
 	status = main(sys.argv)
 	os._exit(status)
@@ -1 +1 @@
-__all__ = ['dialview', 'rmpd']
+__all__ = ['aiompd', 'controller', 'dialview', 'nowplaying', 'placement', 'rmpd', 'snapshot', 'stations', 'tuning']
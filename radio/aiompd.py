@@ -0,0 +1,456 @@
+import asyncio, logging, random, threading
+
+import mpd
+import mpd.asyncio
+
+from . import placement, rmpd
+
+"""
+asyncio MPD client.
+
+The same streams-over-servers model as radio.rmpd, on python-mpd2's
+asyncio client: one event loop drives every server at once, each over
+one persistent connection.
+
+	AsyncStreamServer      one server, with health tracking and reconnects
+	AsyncStreamManager     the StreamManager, as coroutines
+	ThreadedStreamManager  runs an AsyncStreamManager on a thread of its
+	                       own, behind the blocking StreamManager methods
+
+Preloads run as tasks on the loop, so asking for one doesn't wait for
+its 'load' (which can take a while for a large playlist); tuning away
+cancels the ones no longer wanted. The asyncio client has no command
+lists, so each server's commands go one at a time, but the servers'
+go concurrently.
+"""
+
+
+"""
+AsyncStreamServer
+
+An mpd.asyncio.MPDClient that knows its address, fails fast with
+rmpd.ServerDown while its connection is down, and reconnects in the
+background with backoff and jitter (as rmpd.StreamServer does).
+"""
+class AsyncStreamServer(mpd.asyncio.MPDClient):
+
+	rmpd_host = ''
+	rmpd_port = 0
+
+	''' False while the connection is down (and being reconnected). '''
+	up = False
+
+	play_commands = rmpd.StreamServer.play_commands
+	play_by_seek_commands = rmpd.StreamServer.play_by_seek_commands
+
+	def __init__(self, host, port, latency = None):
+		super(AsyncStreamServer, self).__init__()
+		self.rmpd_host = host
+		self.rmpd_port = port
+		self.latency = latency
+		self.oid = None
+		self.up = False
+
+		''' Connections lost, and made again. '''
+		self.failures = 0
+		self.reconnects = 0
+
+		self.reconnector = None
+		self.closing = False
+
+	def address(self):
+		return self.rmpd_host + ':' + str(self.rmpd_port)
+
+	async def command(self, name, *args):
+		"""
+		Run one MPD command. Raises rmpd.ServerDown at once if the
+		server is down, or if the connection fails (or times out).
+
+		If the caller is cancelled, the command still finishes, so the
+		connection stays in step.
+		"""
+		if not self.up:
+			raise rmpd.ServerDown(self.address() + " is down")
+		loop = asyncio.get_event_loop()
+		start = loop.time()
+		call = asyncio.ensure_future(getattr(self, name)(*args))
+		try:
+			return await asyncio.wait_for(asyncio.shield(call), rmpd.TIMEOUT)
+		except asyncio.TimeoutError:
+			self.lost("timed out")
+			raise rmpd.ServerDown(self.address() + " timed out")
+		except (mpd.ConnectionError, OSError) as e:
+			self.lost(e)
+			raise rmpd.ServerDown(self.address() + " is down: " + str(e))
+		finally:
+			if self.latency is not None:
+				self.latency.record('mpd_' + name, loop.time() - start)
+
+	async def run(self, commands):
+		"""
+		Run 'commands' ((command, args...) tuples) in order; stops at
+		the first that fails. Returns their results.
+		"""
+		results = []
+		for cmd in commands:
+			results.append(await self.command(*cmd))
+		return results
+
+	async def output_id(self):
+		if self.oid is None:
+			self.oid = (await self.command('outputs'))[0]['outputid']
+		return self.oid
+
+	async def open(self):
+		"""
+		Connect now; if that fails, keep trying in the background.
+		"""
+		try:
+			await self._open()
+			self.up = True
+		except (mpd.MPDError, OSError, asyncio.TimeoutError) as e:
+			self.lost(e)
+
+	async def _open(self):
+		await asyncio.wait_for(self.connect(self.rmpd_host, self.rmpd_port), rmpd.TIMEOUT)
+		self.oid = (await asyncio.wait_for(self.outputs(), rmpd.TIMEOUT))[0]['outputid']
+
+	def lost(self, error):
+		"""
+		The connection failed: mark the server down, and start
+		reconnecting in the background.
+		"""
+		if self.up:
+			self.failures += 1
+		self.up = False
+		self.oid = None
+		if self.reconnector is not None or self.closing:
+			return
+		logging.warning("[ StreamServer ] " + self.address() + " is down: " + str(error))
+		self.reconnector = asyncio.ensure_future(self._reconnect())
+
+	async def _reconnect(self):
+		delay = rmpd.RECONNECT_MIN
+		while not self.closing:
+			try:
+				try:
+					self.disconnect()
+				except (mpd.MPDError, OSError):
+					pass
+				await self._open()
+			except (mpd.MPDError, OSError, asyncio.TimeoutError) as e:
+				# Back off, with jitter so servers don't retry in step
+				wait = delay / 2 + random.uniform(0, delay / 2)
+				logging.debug("[ StreamServer ] " + self.address() + ": can't connect ({}); retry in {:.1f}s".format(e, wait))
+				delay = min(2 * delay, rmpd.RECONNECT_MAX)
+				await asyncio.sleep(wait)
+				continue
+
+			self.up = True
+			self.reconnector = None
+			self.reconnects += 1
+			logging.info("[ StreamServer ] " + self.address() + " is back.")
+			return
+
+	def close(self):
+		self.closing = True
+		if self.reconnector is not None:
+			self.reconnector.cancel()
+		try:
+			self.disconnect()
+		except (mpd.MPDError, OSError):
+			pass
+
+# End of class AsyncStreamServer
+
+
+"""
+AsyncStreamManager
+
+rmpd.StreamManager's bookkeeping (stream registration, server choice,
+hit counting) with its MPD work as coroutines. Use it from one event
+loop only.
+
+preload() and prefetch() start tasks and return; each server has at
+most one preload running, in 'preloads' ({server id: (stream id, task)}).
+A preload that's no longer wanted (or whose server is needed for
+something else) is cancelled, and its server forgotten, as it may be
+half-loaded.
+"""
+class AsyncStreamManager(rmpd.StreamManager):
+
+	def __init__(self, host, starting_port, num_servers, latency = None, policy = 'lru', pins = ()):
+		self.lock = threading.RLock()
+		self.pool = None
+		self.servers = [AsyncStreamServer(host, starting_port + p, latency) for p in range(0, num_servers)]
+		self.streams = {}
+		self.placement = placement.Placement(num_servers, policy, pins)
+		self.hits = 0
+		self.misses = 0
+		self.volume = None
+		self.preloads = {}
+
+
+	async def connect(self):
+		await asyncio.gather(*[svr.open() for svr in self.servers])
+
+
+	def close(self):
+		for (stream_id, task) in self.preloads.values():
+			task.cancel()
+		for svr in self.servers:
+			svr.close()
+
+
+	def _cancel_preload(self, svr_id):
+		"""
+		Stop any preload running on 'svr_id', and forget what it had.
+		"""
+		if svr_id not in self.preloads:
+			return
+		(stream_id, task) = self.preloads.pop(svr_id)
+		if not task.done():
+			task.cancel()
+			if self.stream_map.get(stream_id) == svr_id:
+				self.placement.remove(stream_id)
+			logging.debug("[ StreamManager ] : Cancelled preload of stream " + str(stream_id))
+
+
+	async def _preload_task(self, svr_id, stream_id, commands):
+		try:
+			await self.servers[svr_id].run(commands)
+		except mpd.CommandError as e:
+			logging.debug("[ StreamManager ] : Could not load playlist: " + str(e))
+			if self.stream_map.get(stream_id) == svr_id:
+				self.placement.remove(stream_id)
+
+
+	def _start_preload(self, assigned, stream_id):
+		(svr_id, commands) = assigned
+		self._cancel_preload(svr_id)
+		task = asyncio.ensure_future(self._preload_task(svr_id, stream_id, commands))
+		self.preloads[svr_id] = (stream_id, task)
+		return task
+
+
+	def preload(self, stream_id, keep = ()):
+		"""
+		Start loading 'stream_id' onto a server, in the background.
+		Returns the task, or None.
+		"""
+		if stream_id in self.stream_map:
+			return None
+		assigned = self._assign(stream_id, keep)
+		if assigned is None:
+			return None
+		return self._start_preload(assigned, stream_id)
+
+
+	def prefetch(self, stream_ids):
+		"""
+		As rmpd.StreamManager.prefetch(), but in the background;
+		preloads of streams no longer wanted are cancelled.
+		"""
+		self._forget_down()
+		spare = sum(1 for (i, svr) in enumerate(self.servers) if svr.up and i != self.active_server)
+		wanted = list(stream_ids)[:spare]
+		for (svr_id, (stream_id, task)) in list(self.preloads.items()):
+			if stream_id not in wanted:
+				self._cancel_preload(svr_id)
+		for stream_id in wanted:
+			if stream_id not in self.stream_map:
+				assigned = self._assign(stream_id, keep = wanted)
+				if assigned is not None:
+					self._start_preload(assigned, stream_id)
+
+
+	async def restore(self, stream_map):
+		self.placement.reset()
+		for (stream_id, svr_id) in stream_map.items():
+			if svr_id < 0 or svr_id >= len(self.servers) or not self.servers[svr_id].up:
+				continue
+			try:
+				status = await self.servers[svr_id].command('status')
+			except rmpd.ServerDown:
+				continue
+			if int(status.get('playlistlength', 0)) > 0:
+				self.placement.place(stream_id, svr_id)
+
+
+	async def pause(self):
+		try:
+			await self.servers[self.active_server].command('pause')
+		except rmpd.ServerDown:
+			pass
+
+
+	async def activate_stream(self, stream_id):
+		"""
+		As rmpd.StreamManager.activate_stream(). If the stream is still
+		being preloaded, that is waited for; it's only a hit if the
+		preload worked. The old server is silenced while the new one
+		starts.
+		"""
+		self._forget_down()
+		new_cmds = []
+		svr_id = self.stream_map.get(stream_id)
+		if svr_id is not None:
+			(preloading, task) = self.preloads.get(svr_id, (None, None))
+			if preloading == stream_id:
+				if not task.done():
+					# Wait for it, without being cancelled along with it
+					await asyncio.wait([task])
+				if (task.cancelled() or task.exception() is not None) and self.stream_map.get(stream_id) == svr_id:
+					self.placement.remove(stream_id)
+			if self.stream_map.get(stream_id) != svr_id:
+				# The preload failed; load it again
+				svr_id = None
+
+		if svr_id is not None:
+			self.hits += 1
+		else:
+			self.misses += 1
+			assigned = self._assign(stream_id)
+			if assigned is None:
+				raise KeyError(stream_id)
+			(svr_id, new_cmds) = assigned
+			self._cancel_preload(svr_id)
+			self.placement.place(stream_id, svr_id)
+
+		old_svr_id = self.active_server
+		old_svr = self.servers[old_svr_id]
+		svr = self.servers[svr_id]
+		stream = self.streams[stream_id]
+
+		old_cmds = []
+		if old_svr.up:
+			old_cmds = [('pause',), ('disableoutput', await old_svr.output_id())]
+		if self.volume is not None:
+			new_cmds += [('setvol', self.volume)]
+		new_cmds += [('enableoutput', await svr.output_id()), ('random', 1 if stream.random else 0)]
+		new_cmds += svr.play_commands(stream.play_func)
+
+		self.active_server = svr_id
+		self.placement.played_on(svr_id)
+		if svr_id == old_svr_id:
+			jobs = [svr.run(old_cmds + new_cmds)]
+		else:
+			jobs = [old_svr.run(old_cmds), svr.run(new_cmds)]
+		results = await asyncio.gather(*jobs, return_exceptions = True)
+		for r in results:
+			if isinstance(r, rmpd.CommandError):
+				raise r
+			if isinstance(r, mpd.CommandError):
+				raise rmpd.CommandError(str(r))
+			if isinstance(r, BaseException):
+				raise r
+		logging.debug("[ StreamManager ] : Moving servers: {old_server} ==> {new_server} with stream {streamid}".format(old_server = old_svr_id, new_server = svr_id, streamid = stream_id))
+
+
+	async def set_volume(self, percent):
+		self.volume = int(percent)
+		await self.servers[self.active_server].command('setvol', self.volume)
+
+
+	async def query_server(self, cmd):
+		"""
+		Run 'cmd' (eg. 'currentsong') on the active server; returns
+		its result, or False if it failed.
+		"""
+		try:
+			return await self.servers[self.active_server].command(cmd)
+		except (AttributeError, TypeError, mpd.MPDError):
+			return False
+
+# End of class AsyncStreamManager
+
+
+"""
+ThreadedStreamManager
+
+An AsyncStreamManager on an event loop of its own thread, behind the
+blocking methods of rmpd.StreamManager, so the rest of the radio can
+use either. Each call waits for its coroutine, but preloads carry on
+in the background after prefetch() returns.
+"""
+class ThreadedStreamManager(object):
+
+	def __init__(self, host, starting_port, num_servers, latency = None, policy = 'lru', pins = ()):
+		self.loop = asyncio.new_event_loop()
+		self.thread = threading.Thread(target = self.loop.run_forever, name = 'mpd-asyncio')
+		self.thread.daemon = True
+		self.thread.start()
+		self.manager = self.call(AsyncStreamManager, host, starting_port, num_servers, latency, policy, pins)
+
+
+	def call(self, func, *args):
+		"""
+		Run 'func(*args)' (a function or coroutine function) on the
+		loop, and return its result.
+		"""
+		async def run():
+			result = func(*args)
+			if asyncio.iscoroutine(result):
+				result = await result
+			return result
+		return asyncio.run_coroutine_threadsafe(run(), self.loop).result()
+
+
+	''' The manager's state, read on the loop. '''
+	servers = property(lambda self: list(self.manager.servers))
+	stream_map = property(lambda self: self.call(dict, self.manager.stream_map))
+	active_server = property(lambda self: self.manager.active_server)
+	hits = property(lambda self: self.manager.hits)
+	misses = property(lambda self: self.manager.misses)
+
+	def register_stream(self, *args, **kwargs):
+		return self.call(lambda: self.manager.register_stream(*args, **kwargs))
+
+	def set_loader(self, loader):
+		self.call(self.manager.set_loader, loader)
+
+	def get_stream(self, stream_id):
+		return self.call(self.manager.get_stream, stream_id)
+
+	def connect(self):
+		self.call(self.manager.connect)
+
+	def update_streams(self, streams):
+		self.call(self.manager.update_streams, streams)
+
+	def active_stream(self):
+		return self.call(self.manager.active_stream)
+
+	def retain(self, stream_ids):
+		self.call(self.manager.retain, list(stream_ids))
+
+	def hit_rate(self):
+		return self.manager.hit_rate()
+
+	def preload(self, stream_id, keep = ()):
+		self.call(self.manager.preload, stream_id, keep)
+
+	def prefetch(self, stream_ids):
+		self.call(self.manager.prefetch, list(stream_ids))
+
+	def restore(self, stream_map):
+		self.call(self.manager.restore, stream_map)
+
+	def pause(self):
+		self.call(self.manager.pause)
+
+	def activate_stream(self, stream_id):
+		self.call(self.manager.activate_stream, stream_id)
+
+	def set_volume(self, percent):
+		self.call(self.manager.set_volume, percent)
+
+	def query_server(self, cmd):
+		return self.call(self.manager.query_server, cmd)
+
+	def close(self):
+		self.call(self.manager.close)
+		self.loop.call_soon_threadsafe(self.loop.stop)
+		self.thread.join(1)
+
+# End of class ThreadedStreamManager
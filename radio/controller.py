@@ -0,0 +1,522 @@
+import logging
+
+import service.latency as LT
+import service.pots
+import service.watchdog as WD
+
+from . import rmpd, snapshot, tuning
+
+"""
+Local defines
+"""
+# How often to check config.db for changes made outside the web page
+CONFIG_POLL = 5.0
+
+# How often to redraw the text dial, if it's shown
+DIAL_REFRESH = 0.2
+
+# ...and while the radio is idle (it isn't redrawn at all when asleep)
+IDLE_DIAL_REFRESH = 2.0
+
+# How long to wait after a change before saving the state snapshot
+SNAPSHOT_DELAY = 5.0
+
+# How often to preload ahead of the knob while it sweeps
+SWEEP_PRELOAD = 0.5
+
+# Options only read at start up; check_config() can't apply changes to these
+RESTART_OPTIONS = ('MPD_HOST', 'MPD_PORT', 'MPD_NUM_SERVERS', 'MPD_CLIENT',
+		'MPD_PLACEMENT', 'MPD_PINS', 'NOW_PLAYING', 'MIXER_BACKEND', 'MIXER_CONTROL',
+		'ENABLE_SPI', 'ADC_OVERSAMPLE', 'SAMPLER_MODE', 'SAMPLE_RATE',
+		'SAMPLE_BUFFER_LEN', 'SAMPLE_THRESHOLD', 'WATCHDOG_BUDGETS', 'STATE_FILE')
+
+
+"""
+RadioController
+
+The radio's control logic, as handlers on a service.reactor.Reactor:
+
+	'pot' events         from the pot sampler
+	'config_changed'     from the web server, after a POST
+
+plus timers for the low-volume shutdown, config polling, bank paging
+and the text dial. Nothing runs unless one of those fires.
+
+If 'state_file' is given, a radio.snapshot.Snapshot is saved there
+shortly after the station or volume changes.
+
+Each step runs as a phase of 'watchdog' (a service.watchdog.Watchdog):
+vol_read, tuner_read, mpd_switch, preload, web_update and dial_render.
+While web_update or dial_render are degraded, they are skipped.
+
+Knob movements are reported to 'governor' (a service.governor.IdleGovernor),
+and the dial is redrawn less often, or not at all, as the radio idles.
+
+Every station switch is timed, from the ADC sample to MPD playing, into
+'latency' (a service.latency.LatencyRecorder). MPD playing is learnt
+from 'now_playing'; without it, switches are only timed as far as
+MPD being told to play.
+"""
+class RadioController(object):
+
+	''' Set when the radio should power off the Pi on cleanup. '''
+	do_system_shutdown = False
+
+	def __init__(self, reactor, options, vol_knob, tuner_knob, str_man, stations, bank_sel,
+				cfg_watch, web_svr_queue, dial_led_queue, text_dial = None, state_file = None,
+				watchdog = None, governor = None, latency = None, now_playing = None):
+		self.reactor = reactor
+		self.options = options
+		self.vol_knob = vol_knob
+		self.tuner_knob = tuner_knob
+		self.str_man = str_man
+		self.stations = stations
+		self.bank_sel = bank_sel
+		self.cfg_watch = cfg_watch
+		self.web_svr_queue = web_svr_queue
+		self.dial_led_queue = dial_led_queue
+		self.text_dial = text_dial
+		self.state_file = state_file
+		''' A nowplaying.NowPlayingWatcher (it updates the web page), or None to ask MPD after each switch. '''
+		self.now_playing = now_playing
+
+		if watchdog is None:
+			watchdog = WD.Watchdog({})
+		self.watchdog = watchdog
+
+		if latency is None:
+			latency = LT.LatencyRecorder(reactor.clock)
+		self.latency = latency
+		''' The SwitchTrace of the station being tuned to, and of the one starting up. '''
+		self.trace = None
+		self.play_trace = None
+
+		self.bank_set = stations.bank(bank_sel.bank)
+
+		self.sweep = tuning.SweepCoalescer(
+				options.fetch('TUNE_SETTLE'),
+				options.fetch('SWEEP_VELOCITY'))
+		self.predictor = tuning.PreloadPredictor(options.fetch('PRELOAD_HORIZON'))
+		self.preload_count = options.fetch('PRELOAD_COUNT')
+		''' When the sweep may next preload ahead of the knob. '''
+		self.sweep_preload_at = 0
+
+		self.shutdown_timer = None
+		self.bank_timer = None
+		self.settle_timer = None
+		self.save_timer = None
+		self.dial_timer = None
+
+		reactor.on('pot', self.on_pot)
+		if now_playing is not None:
+			# Records come in the watcher's thread
+			now_playing.on_change(lambda record: reactor.post('now_playing', record))
+			reactor.on('now_playing', self.on_now_playing)
+		reactor.on('config_changed', self.check_config)
+		reactor.call_every(CONFIG_POLL, self.check_config)
+
+		self.governor = governor
+		''' {channel: pot value} at the last governor touch. '''
+		self.touched = {}
+		if governor is not None:
+			governor.on_change(self.set_power_state)
+		else:
+			self.set_power_state('active')
+
+
+	def set_power_state(self, state):
+		"""
+		Redraw the dial at the rate for the governor's state.
+		"""
+		if self.text_dial is None:
+			return
+		if self.dial_timer is not None:
+			self.dial_timer.cancel()
+			self.dial_timer = None
+		interval = {'active': DIAL_REFRESH, 'idle': IDLE_DIAL_REFRESH}.get(state)
+		if interval is not None:
+			self.dial_timer = self.reactor.call_every(interval, self.show_dial)
+
+
+	def on_pot(self, channel, pot_read, sample_time):
+		"""
+		A pot moved; feed it through its knob.
+		"""
+		self.touch(channel, pot_read)
+		if channel == self.vol_knob.pot_pin:
+			with self.watchdog.phase('vol_read'):
+				event = service.pots.feed_pot(self.vol_knob, pot_read)
+				if event is not None:
+					self.on_volume(event)
+					self.state_changed()
+		elif channel == self.tuner_knob.pot_pin:
+			with self.watchdog.phase('tuner_read'):
+				filter_time = self.reactor.clock()
+				event = service.pots.feed_pot(self.tuner_knob, pot_read)
+				if event is not None:
+					if event.is_new_station:
+						self.trace = LT.SwitchTrace(
+								self.stations.station_id(self.bank_sel.bank, self.tuner_knob.SID),
+								sample = sample_time,
+								filter = filter_time,
+								tuner = self.reactor.clock())
+					self.on_tuning(event)
+				self.check_bank()
+
+
+	def touch(self, channel, pot_read):
+		"""
+		Tell the governor about the knob moving, if it moved at least
+		IDLE_WAKE ticks from where it was last time; smaller changes are
+		ADC noise, and would keep the radio awake forever.
+		"""
+		if self.governor is None:
+			return
+		last = self.touched.get(channel)
+		if last is None or abs(pot_read - last) >= self.options.fetch('IDLE_WAKE'):
+			self.touched[channel] = pot_read
+			self.governor.touch()
+
+
+	def on_volume(self, event):
+		"""
+		Re-cap the new volume for the tuning.
+		If the volume is low enough, start a shutdown timer.
+		Otherwise, cancel it.
+		"""
+		self.cap_volume(True)
+		if (self.vol_knob.volume <= self.options.fetch('LOW_VOL_TOLERANCE')):
+			if self.shutdown_timer is None:
+				logging.info("[ Radio ] Shutdown timer started.")
+				self.shutdown_timer = self.reactor.call_later(
+						self.options.fetch('TIME_FOR_POWER_OFF'), self.power_off)
+		elif self.shutdown_timer is not None:
+			logging.info("[ Radio ] Shutdown timer cancelled.")
+			self.shutdown_timer.cancel()
+			self.shutdown_timer = None
+
+
+	def power_off(self):
+		logging.info("[ Radio ]  Volume low - Shutting down...")
+		self.do_system_shutdown = True
+		self.reactor.stop()
+
+
+	def start(self):
+		"""
+		Play whatever the tuner is on now, without waiting for it
+		to settle. Returns the station id, or None.
+
+		If a station was resumed from a snapshot and the knob is still
+		on it, it's left playing; otherwise the snapshot is dropped.
+		The volume eases in to the knob's over VOLUME_EASE_IN seconds,
+		from the snapshot's (or from silence).
+		"""
+		tuner_knob = self.tuner_knob
+		self.cap_volume(True, self.options.fetch('VOLUME_EASE_IN'))
+		resumed = self.str_man.active_stream()
+		if tuner_knob.SID == -1:
+			if resumed is not None:
+				logging.info("[ Radio ] Tuner is between stations; dropping snapshot.")
+				self.str_man.pause()
+			return None
+
+		station_id = self.stations.station_id(self.bank_sel.bank, tuner_knob.SID)
+		self.predictor.update(tuner_knob.tuning, self.reactor.clock())
+		self.sweep.reset(station_id)
+		if station_id == resumed:
+			self.preload_next(station_id)
+		else:
+			if resumed is not None:
+				logging.info("[ Radio ] Tuner moved since the last run; dropping snapshot.")
+			self.change_station(station_id)
+		return station_id
+
+
+	def state_changed(self):
+		"""
+		Save a snapshot soon; changes in the meantime share one save.
+		"""
+		if self.state_file is None or self.save_timer is not None:
+			return
+		self.save_timer = self.reactor.call_later(SNAPSHOT_DELAY, self.save_state)
+
+
+	def save_state(self):
+		if self.save_timer is not None:
+			self.save_timer.cancel()
+			self.save_timer = None
+		if self.state_file is None:
+			return
+
+		active_id = self.str_man.active_stream()
+		snapshot.Snapshot(
+				-1 if active_id is None else active_id,
+				self.vol_knob.percent(self.vol_knob.get_volume()),
+				self.str_man.stream_map,
+				self.cfg_watch.checksum('playlists')).save(self.state_file)
+
+
+	def on_tuning(self, event):
+		"""
+		Update volume scaling based on tuning distance,
+		and switch stations once the tuning settles on a new one.
+		"""
+		self.cap_volume()
+
+		tuner_knob = self.tuner_knob
+		now = self.reactor.clock()
+		if tuner_knob.SID == -1:
+			station_id = -1
+		else:
+			station_id = self.stations.station_id(self.bank_sel.bank, tuner_knob.SID)
+		self.predictor.update(tuner_knob.tuning, now)
+		self.settled(self.sweep.update(tuner_knob.tuning, station_id, now))
+		if self.sweep.state != self.sweep.IDLE:
+			self.preload_ahead(now)
+
+
+	def preload_ahead(self, now):
+		"""
+		Preload the stations a sweeping knob is heading for, at most
+		every SWEEP_PRELOAD seconds. By the time the sweep settles, the
+		predictor's velocity has died away, so this is the only chance
+		to rank by the direction of travel.
+		"""
+		if now < self.sweep_preload_at:
+			return
+		self.sweep_preload_at = now + SWEEP_PRELOAD
+		active_id = self.str_man.active_stream()
+		try:
+			with self.watchdog.phase('preload'):
+				self.preload_next(-1 if active_id is None else active_id)
+		except rmpd.CommandError as e:
+			logging.debug("[ Radio ] Sweep preload failed: " + str(e))
+
+
+	def cap_volume(self, force = False, ramp = 0):
+		"""
+		Cap the volume by how far the tuning is from a station, and set
+		it (gliding there over 'ramp' seconds, if given); unless 'force',
+		only if the cap moved by more than 3.
+		"""
+		vol_knob = self.vol_knob
+
+		vol_adj = self.tuner_knob.attenuation() / 100.0
+
+		d_vol = abs(int(vol_knob.volume_cap) - int(vol_adj * vol_knob.volume))
+		if force or d_vol > 3:
+			vol_knob.volume_cap = vol_adj * vol_knob.volume
+			vol_knob.volumize(vol_knob.volume_cap, ramp)
+#			self.dial_led_queue.put(['adjust_brightness', vol_adj])
+
+
+	def settled(self, station_id):
+		"""
+		Play 'station_id' if the sweep has settled on it; otherwise
+		make sure the sweep is checked again when it might have.
+		"""
+		if station_id is not None:
+			self.change_station(station_id)
+
+		if self.settle_timer is not None:
+			self.settle_timer.cancel()
+			self.settle_timer = None
+
+		deadline = self.sweep.deadline()
+		if deadline is not None:
+			self.settle_timer = self.reactor.call_at(deadline, self._settle_due)
+
+
+	def _settle_due(self):
+		self.settle_timer = None
+		self.settled(self.sweep.poll(self.reactor.clock()))
+
+
+	def change_station(self, station_id):
+		"""
+		Update the MPD server.
+
+		Then preload the stations most likely to be tuned next
+		onto the spare servers.
+		"""
+		watchdog = self.watchdog
+
+		trace = self.trace
+		if trace is None or trace.station != station_id:
+			trace = LT.SwitchTrace(station_id)
+		self.trace = None
+
+		try:
+			trace.mark('issue', self.reactor.clock())
+			with watchdog.phase('mpd_switch'):
+				self.str_man.activate_stream(station_id)
+			self.wait_for_play(trace)
+			self.state_changed()
+			with watchdog.phase('preload'):
+				self.preload_next(station_id)
+
+			if self.now_playing is None and not watchdog.degraded('web_update'):
+				with watchdog.phase('web_update'):
+					self.update_web()
+
+		except rmpd.CommandError as e:
+			logging.error("[ Radio ] mpd:Error load " + str(station_id) + ":" + str(e))
+		except ValueError as e:
+			logging.error("[ Radio ]  ValueError on play " + str(station_id) + ": " + str(e))
+		except IOError as e:
+			logging.error("[ Radio ] Can't send data to web server")
+
+
+	def wait_for_play(self, trace):
+		"""
+		Record when the switch in 'trace' starts playing, which
+		on_now_playing() learns. A later switch replaces it.
+		"""
+		if self.now_playing is None:
+			self.latency.finish(trace)
+		else:
+			self.play_trace = trace
+
+
+	def on_now_playing(self, record):
+		"""
+		The now_playing watcher has a new record.
+		"""
+		trace = self.play_trace
+		if trace is None or not record.playing or record.at < trace.issue:
+			return
+		if record.server != self.str_man.active_server:
+			return
+		trace.mark('play', record.at)
+		self.latency.finish(trace)
+		self.play_trace = None
+
+
+	def update_web(self):
+		"""
+		Update the web server, asking MPD what's playing
+		(when there's no now_playing watcher to do it).
+		"""
+		str_man = self.str_man
+		songdata = str_man.query_server('currentsong') or {}
+		status = str_man.query_server('status') or {}
+		keys = ('artist','album','title','file','elapsed','time')
+		senddata = dict((k, v) for (k, v) in dict(songdata, **status).items() if k in keys)
+		# MPD sends numbers as strings, eg. '12.345'
+		senddata['elapsed'] = int(float(senddata.get('elapsed', 0)))
+		self.web_svr_queue.put(['html', senddata])
+
+
+	def preload_next(self, station_id):
+		"""
+		Keep the predicted next stations (in this bank) preloaded, up to
+		PRELOAD_COUNT of them; any other spare servers keep what they
+		had, as the placement policy allows.
+		"""
+		bank = self.bank_sel.bank
+		slots = self.predictor.rank(self.tuner_knob.freq_list,
+					min(len(self.str_man.servers) - 1, self.preload_count),
+					station_id - self.stations.station_id(bank, 0),
+					self.reactor.clock())
+		self.str_man.prefetch(self.stations.station_id(bank, s) for s in slots)
+		logging.debug("[ Radio ] Preload hit rate: {:.0%} ({} hits, {} misses)".format(
+				self.str_man.hit_rate(), self.str_man.hits, self.str_man.misses))
+
+
+	def check_bank(self):
+		"""
+		Page to another bank of stations if the tuner is held at
+		either end of the dial.
+		"""
+		new_bank = self.bank_sel.update(self.tuner_knob.tuning, self.reactor.clock())
+		if new_bank is not None:
+			self.bank_set = self.stations.bank(new_bank)
+			self.tuner_knob.set_stations(len(self.bank_set))
+			self.tuner_knob.retune()
+			self.str_man.retain(self.stations.station_id(new_bank, slot) for slot in range(len(self.bank_set)))
+			self.dial_led_queue.put('blink')
+
+		# While the knob sits in an end zone, come back when the dwell is up
+		if self.bank_sel.in_zone() and (self.bank_timer is None or self.bank_timer.cancelled):
+			self.bank_timer = self.reactor.call_later(self.bank_sel.dwell, self._bank_dwell_done)
+
+
+	def _bank_dwell_done(self):
+		self.bank_timer = None
+		self.check_bank()
+
+
+	def check_config(self):
+		"""
+		Pick up changes to config.db (eg. from the web page)
+		without a restart. The dial and streams are rebuilt,
+		but whatever is playing keeps playing. Changes to the
+		RESTART_OPTIONS are logged, and wait for a restart.
+		"""
+		changed = self.cfg_watch.changes()
+		if not changed:
+			return
+
+		opt_ldr = self.options
+		stations = self.stations
+		bank_sel = self.bank_sel
+		tuner_knob = self.tuner_knob
+
+		if 'options' in changed:
+			logging.info("[ Radio ] Options changed; reloading.")
+			before = dict((name, opt_ldr.fetch(name)) for name in RESTART_OPTIONS)
+			for ldr in set((opt_ldr, self.vol_knob.options, tuner_knob.options)):
+				ldr.reload()
+			stale = [name for name in RESTART_OPTIONS if opt_ldr.fetch(name) != before[name]]
+			if stale:
+				logging.warning("[ Radio ] Restart to apply " + ', '.join(stale))
+			self.vol_knob.set_taper(opt_ldr.fetch('VOL_TAPER'))
+			self.vol_knob.set_filters(opt_ldr.fetch('VOL_POT_FILTERS'))
+			tuner_knob.set_filters(opt_ldr.fetch('TUNE_POT_FILTERS'))
+			stations.bank_size = opt_ldr.fetch('STATION_BANK_SIZE')
+			self.sweep.settle = opt_ldr.fetch('TUNE_SETTLE')
+			self.sweep.max_velocity = opt_ldr.fetch('SWEEP_VELOCITY')
+			self.predictor.horizon = opt_ldr.fetch('PRELOAD_HORIZON')
+			self.preload_count = opt_ldr.fetch('PRELOAD_COUNT')
+
+		logging.info("[ Radio ] Rebuilding dial for " + ', '.join(changed))
+		stations.invalidate()
+		bank_sel.num_banks = stations.num_banks()
+		bank_sel.bank = min(bank_sel.bank, bank_sel.num_banks - 1)
+		self.bank_set = stations.bank(bank_sel.bank)
+
+		first_id = stations.station_id(bank_sel.bank, 0)
+		self.str_man.update_streams(dict(
+				(first_id + slot, stations.stream(first_id + slot))
+				for slot in range(len(self.bank_set))))
+		tuner_knob.set_stations(len(self.bank_set))
+
+		active_id = self.str_man.active_stream()
+		if active_id is not None and stations.bank_of(active_id) == bank_sel.bank:
+			active_slot = active_id - first_id
+		else:
+			active_slot = -1
+			active_id = -1
+		self.sweep.reset(active_id)
+
+		event = tuner_knob.refresh(active_slot)
+		if event is not None:
+			self.on_tuning(event)
+
+		if 'options' in changed:
+			# A new taper or DETUNE_CURVE (the dial was rebuilt with it) changes the volume
+			self.cap_volume(True)
+
+
+	def show_dial(self):
+		"""
+		Show a tuning dial.
+		"""
+		if self.watchdog.degraded('dial_render'):
+			return
+		with self.watchdog.phase('dial_render'):
+			record = None if self.now_playing is None else self.now_playing.record
+			self.text_dial.display(self.vol_knob, self.tuner_knob, record)
+
+# End of class RadioController
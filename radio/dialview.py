@@ -8,10 +8,11 @@ class DialView:
 	def __init__(self):
 		pass
 
-	def display(self, Volume, Tuner):
+	def display(self, Volume, Tuner, now_playing = None):
 		"""
 		Prints out a view of the radio dial and tuning,
-		as well as volume/volume_cap and any other message
+		as well as volume/volume_cap and any other message,
+		and the title from a nowplaying.NowPlaying record
 		"""
 		destr = "SetVol[%s] LimVol[%s] " % ( \
 					int(round(Volume.volume / 10.24)), \
@@ -46,6 +47,8 @@ class DialView:
 			fr_list.append(fr)
 		dial_string = ' '.join(str(x) for x in fr_list)
 		debug_string = destr + '[' + dial_string + ' ] '
+		if now_playing is not None and now_playing.title():
+			debug_string += now_playing.title() + ' '
 		sys.stdout.write(debug_string + "\r")
 		sys.stdout.flush()
 
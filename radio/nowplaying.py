@@ -0,0 +1,236 @@
+import logging, random, socket, threading, time
+
+import mpd
+
+from . import rmpd
+
+"""
+Now playing.
+
+What the active MPD server is playing, kept up to date from MPD's
+'idle' command instead of by asking: a NowPlayingWatcher holds its own
+connection to the active server, idling on SUBSYSTEMS, and only sends
+commands (one command list: currentsong and status) when MPD says
+something changed. Each change makes a new NowPlaying record with the
+next version number, so the web page and the dial can read the latest
+one whenever they like, at no cost to MPD.
+"""
+
+''' The MPD subsystems whose changes are watched. A switch always
+pauses the old server and disables its output, so the watcher of the
+old server is woken, and moves to the new one. 'mixer' is left out:
+the volume isn't shown, and every step of the knob would wake us. '''
+SUBSYSTEMS = ('player', 'playlist', 'output')
+
+''' A server told to play says so before it has any audio (the stream
+is still connecting), and MPD doesn't always send another 'player'
+event when the audio starts. Meanwhile the watcher asks again instead
+of idling, waiting START_POLL seconds at first and twice as long each
+time after, up to START_POLL_MAX, for at most START_TIMEOUT seconds. '''
+START_POLL = 0.05
+START_POLL_MAX = 1.0
+START_TIMEOUT = 10.0
+
+
+"""
+NowPlaying
+
+One version of what's playing: the server, its 'currentsong' and
+'status' replies, and when (monotonic time) they were fetched, so the
+elapsed time can be worked out later without asking again. Records
+aren't changed once made.
+"""
+class NowPlaying(object):
+	__slots__ = ('version', 'server', 'song', 'status', 'at')
+
+	def __init__(self, version = 0, server = None, song = None, status = None, at = 0.0):
+		self.version = version
+		self.server = server
+		self.song = dict(song or {})
+		self.status = dict(status or {})
+		self.at = at
+
+	@property
+	def state(self):
+		return self.status.get('state', 'stop')
+
+	@property
+	def playing(self):
+		"""
+		True once the server is playing audio, not just trying to.
+		"""
+		return self.state == 'play' and 'audio' in self.status
+
+	def elapsed(self, now):
+		"""
+		Seconds into the song at 'now' (a monotonic time).
+		"""
+		base = float(self.status.get('elapsed', 0))
+		if self.state == 'play':
+			base += max(0.0, now - self.at)
+		return base
+
+	def title(self):
+		"""
+		The song title, or the stream's name, or ''.
+		"""
+		return self.song.get('title') or self.song.get('name') or ''
+
+	def web_data(self, now):
+		"""
+		The record as RadioWebServer.html() takes it.
+		"""
+		data = dict((k, self.song[k]) for k in ('artist', 'album', 'title', 'file') if k in self.song)
+		if 'time' in self.status:
+			data['time'] = self.status['time']
+		data['elapsed'] = int(self.elapsed(now))
+		return data
+
+# End of class NowPlaying
+
+
+"""
+NowPlayingWatcher
+
+Watches the server 'active()' returns (a server id; its port is
+'starting_port' plus the id, as for rmpd.StreamManager) in a thread
+of its own, checking which that is each time MPD wakes it.
+
+'record' is always the latest NowPlaying. Functions registered with
+on_change() are called with each new one, in the watcher's thread;
+wait() blocks until there's a newer one than a version you have.
+A record is only made when something in it has changed, so the first
+with 'playing' set after a switch is when the new station started.
+
+If the server can't be reached, it's retried with the same backoff as
+rmpd.StreamServer; the record says nothing is playing meanwhile.
+"""
+class NowPlayingWatcher(object):
+
+	def __init__(self, host, starting_port, active, clock = time.monotonic):
+		self.host = host
+		self.starting_port = starting_port
+		self.active = active
+		self.clock = clock
+
+		self.record = NowPlaying()
+		self.listeners = []
+		self.cond = threading.Condition()
+		self.closing = threading.Event()
+
+		''' The idling connection, so close() can break it off. '''
+		self.client = None
+
+		self.thread = threading.Thread(target = self.run, name = 'mpd-idle')
+		self.thread.daemon = True
+
+
+	def start(self):
+		self.thread.start()
+
+
+	def on_change(self, func):
+		self.listeners.append(func)
+
+
+	def wait(self, version, timeout = None):
+		"""
+		Wait until there's a record newer than 'version', or 'timeout'
+		seconds. Returns the latest record either way.
+		"""
+		with self.cond:
+			self.cond.wait_for(lambda: self.record.version != version or self.closing.is_set(), timeout)
+			return self.record
+
+
+	def close(self):
+		self.closing.set()
+		client = self.client
+		if client is not None:
+			# Shutting the socket down ends the idle the thread is blocked in
+			try:
+				sock = socket.fromfd(client.fileno(), socket.AF_INET, socket.SOCK_STREAM)
+				sock.shutdown(socket.SHUT_RDWR)
+				sock.close()
+			except (mpd.MPDError, OSError):
+				pass
+		self.thread.join(1)
+		with self.cond:
+			self.cond.notify_all()
+
+
+	def _publish(self, server, song = None, status = None):
+		with self.cond:
+			record = NowPlaying(self.record.version + 1, server, song, status, self.clock())
+			self.record = record
+			self.cond.notify_all()
+		for func in self.listeners:
+			try:
+				func(record)
+			except Exception as e:
+				logging.error("[ NowPlaying ] Listener failed: " + str(e))
+
+
+	def _fetch(self, client, server):
+		client.command_list_ok_begin()
+		client.currentsong()
+		client.status()
+		(song, status) = client.command_list_end()
+		record = self.record
+		if server != record.server or song != record.song or status != record.status:
+			self._publish(server, song, status)
+
+
+	def _watch(self, client, server):
+		"""
+		Idle on 'server' until it's no longer the active one.
+		"""
+		self._fetch(client, server)
+		starting = None
+		while not self.closing.is_set():
+			record = self.record
+			if record.state != 'play' or record.playing:
+				starting = None
+			elif starting is None:
+				starting = self.clock()
+				delay = START_POLL
+
+			if starting is not None and self.clock() - starting < START_TIMEOUT:
+				self.closing.wait(delay)
+				delay = min(START_POLL_MAX, delay * 2)
+			else:
+				changed = client.idle(*SUBSYSTEMS)
+				logging.debug("[ NowPlaying ] Changed: " + ', '.join(changed))
+			if self.closing.is_set() or self.active() != server:
+				return
+			self._fetch(client, server)
+
+
+	def run(self):
+		delay = rmpd.RECONNECT_MIN
+		while not self.closing.is_set():
+			server = self.active()
+			client = mpd.MPDClient()
+			client.timeout = rmpd.TIMEOUT
+			client.idletimeout = None
+			try:
+				client.connect(self.host, self.starting_port + server)
+				self.client = client
+				delay = rmpd.RECONNECT_MIN
+				self._watch(client, server)
+			except (mpd.MPDError, OSError) as e:
+				if self.closing.is_set():
+					break
+				logging.debug("[ NowPlaying ] Lost server " + str(server) + ": " + str(e))
+				if self.record.server is not None:
+					self._publish(None)
+				self.closing.wait(random.uniform(delay / 2, delay))
+				delay = min(rmpd.RECONNECT_MAX, delay * 2)
+			finally:
+				self.client = None
+				try:
+					client.disconnect()
+				except (mpd.MPDError, OSError):
+					pass
+
+# End of class NowPlayingWatcher
@@ -0,0 +1,187 @@
+import logging
+
+"""
+Server placement.
+
+Which stream is loaded on which MPD server, indexed both ways, and
+which server to give up when another stream needs one. A policy picks
+the server to evict from those that may be (up, not playing, not
+holding a stream that's wanted):
+
+	lru       the one used longest ago (loaded or played)
+	lra       the one played longest ago; preloads that were never
+	          played go first
+	distance  the one whose stream is furthest along the dial from the
+	          station playing (station ids are in dial order)
+	pinned    as lru, but favourites ('pinned' stream ids) go last
+
+A server with nothing on it is always taken first, lowest id first;
+ties between servers go the same way, so placement doesn't depend on
+dict or set order.
+"""
+
+
+def lru(placement, svr_ids):
+	return min(svr_ids, key = lambda s: (placement.used[s], s))
+
+
+def lra(placement, svr_ids):
+	return min(svr_ids, key = lambda s: (placement.played[s], placement.used[s], s))
+
+
+def distance(placement, svr_ids):
+	tuned = placement.tuned
+	if tuned is None:
+		return lru(placement, svr_ids)
+	return min(svr_ids, key = lambda s: (-abs(placement.stream_of[s] - tuned), placement.used[s], s))
+
+
+def pinned(placement, svr_ids):
+	return min(svr_ids, key = lambda s: (placement.stream_of[s] in placement.pinned, placement.used[s], s))
+
+
+def parse_pins(spec):
+	"""
+	Parse 'id,id,...' (eg. the MPD_PINS option) into a list of stream ids.
+	"""
+	pins = []
+	for item in str(spec).split(','):
+		if not item.strip():
+			continue
+		try:
+			pins.append(int(item))
+		except ValueError:
+			logging.error("[ Placement ] Bad pin: " + item)
+	return pins
+
+
+''' Policies by name; each returns the server to evict from 'svr_ids'. '''
+POLICIES = {
+	'lru': lru,
+	'lra': lra,
+	'distance': distance,
+	'pinned': pinned,
+	}
+
+
+"""
+Placement
+
+'server_of' ({stream id: server id}) and 'stream_of' (a list, by server
+id, of stream id or None) are kept in step by place() and remove(), so
+either way round is one lookup. Don't change them directly.
+
+Use is counted in ticks, not time: each place() or played_on() is the
+next tick.
+"""
+class Placement(object):
+
+	def __init__(self, num_servers, policy = 'lru', pins = ()):
+		self.server_of = {}
+		self.stream_of = [None] * num_servers
+
+		''' Tick each server was last loaded or played, and last played. '''
+		self.used = [0] * num_servers
+		self.played = [0] * num_servers
+		self.tick = 0
+
+		''' The stream last played, for the 'distance' policy. '''
+		self.tuned = None
+		self.pinned = set(pins)
+
+		self.policy = None
+		self.set_policy(policy)
+
+
+	def set_policy(self, name, pins = None):
+		"""
+		Raises ValueError for a policy that isn't in POLICIES.
+		"""
+		if name not in POLICIES:
+			raise ValueError("Unknown placement policy: " + str(name))
+		self.policy = name
+		self._choose = POLICIES[name]
+		if pins is not None:
+			self.pinned = set(pins)
+
+
+	def __contains__(self, stream_id):
+		return stream_id in self.server_of
+
+
+	def __len__(self):
+		return len(self.server_of)
+
+
+	def get(self, stream_id, default = None):
+		return self.server_of.get(stream_id, default)
+
+
+	def place(self, stream_id, svr_id):
+		"""
+		Put 'stream_id' on 'svr_id', moving it from any other server.
+		Returns the stream that was on 'svr_id' (and is now on none),
+		or None.
+		"""
+		old_svr_id = self.server_of.get(stream_id)
+		if old_svr_id is not None:
+			self.stream_of[old_svr_id] = None
+		evicted = self.stream_of[svr_id]
+		if evicted is not None and evicted != stream_id:
+			del self.server_of[evicted]
+		else:
+			evicted = None
+		self.stream_of[svr_id] = stream_id
+		self.server_of[stream_id] = svr_id
+		self.tick += 1
+		self.used[svr_id] = self.tick
+		return evicted
+
+
+	def remove(self, stream_id):
+		svr_id = self.server_of.pop(stream_id, None)
+		if svr_id is not None:
+			self.stream_of[svr_id] = None
+		return svr_id
+
+
+	def reset(self, server_of = None):
+		"""
+		Replace the whole map ({stream id: server id}). Use counts stay
+		with their servers.
+		"""
+		self.server_of = {}
+		self.stream_of = [None] * len(self.stream_of)
+		for (stream_id, svr_id) in (server_of or {}).items():
+			self.server_of[stream_id] = svr_id
+			self.stream_of[svr_id] = stream_id
+
+
+	def played_on(self, svr_id):
+		"""
+		The stream on 'svr_id' has started playing.
+		"""
+		self.tick += 1
+		self.used[svr_id] = self.tick
+		self.played[svr_id] = self.tick
+		self.tuned = self.stream_of[svr_id]
+
+
+	def choose(self, svr_ids):
+		"""
+		The server to use from 'svr_ids' (in id order): an empty one,
+		or else the one the policy gives up. None if 'svr_ids' is empty.
+		"""
+		loaded = []
+		for svr_id in svr_ids:
+			if self.stream_of[svr_id] is None:
+				logging.debug("[ Placement ] Found an UNASSIGNED server (#" + str(svr_id) + ")")
+				return svr_id
+			loaded.append(svr_id)
+		if not loaded:
+			return None
+		svr_id = self._choose(self, loaded)
+		logging.debug("[ Placement ] Evicting stream " + str(self.stream_of[svr_id]) + " from server #" + str(svr_id) + " (" + self.policy + ")")
+		return svr_id
+
+# End of class Placement
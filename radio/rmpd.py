@@ -1,4 +1,18 @@
-import mpd, logging, time
+import mpd, concurrent.futures, functools, logging, random, threading, time
+
+from . import placement
+
+''' The commands a StreamServer checks (and times). '''
+COMMANDS = ('clear', 'currentsong', 'disableoutput', 'enableoutput', 'load',
+		'outputs', 'pause', 'play', 'random', 'seekcur', 'setvol', 'status')
+
+''' Socket timeout for connecting and for commands, in seconds. '''
+TIMEOUT = 5.0
+
+''' Reconnection backoff, in seconds: the first wait, and the longest. '''
+RECONNECT_MIN = 0.5
+RECONNECT_MAX = 30.0
+
 
 """
 CommandError
@@ -9,52 +23,212 @@ class CommandError(mpd.CommandError):
 	pass
 
 
+"""
+ServerDown
+
+Raised straight away for commands to a server whose connection is
+down. It's a CommandError, so anything that copes with a failed
+command copes with this too.
+"""
+class ServerDown(CommandError):
+	pass
+
+
+def locked(func):
+	"""
+	Run a StreamManager method holding the manager's lock, so servers
+	can be shared with other threads (eg. a mixer).
+	"""
+	@functools.wraps(func)
+	def wrapper(self, *args, **kwargs):
+		with self.lock:
+			return func(self, *args, **kwargs)
+	return wrapper
+
+
 """
 StreamServer
 
 This extends the mpd.MPDClient class.
 
-Adds a 'ready' method that ensures that the client is still connected.
+Adds 'batch' to send several commands in one round trip, and keeps
+track of the connection's health from the commands themselves: a
+connection error marks the server down, and a background thread
+reconnects it, backing off (with jitter) while it keeps failing.
+Commands to a server that's down fail straight away with ServerDown,
+so one dead MPD can't hold up the others.
+
+With a 'latency' recorder (a service.latency.LatencyRecorder), the
+round trip of each of COMMANDS is recorded as 'mpd_<command>', and of
+each batch as 'mpd_batch'.
 """
 class StreamServer(mpd.MPDClient):
 
 	rmpd_host = ''
 	rmpd_port = 0
 
-	def __init__(self, host, port):
+	''' False while the connection is down (and being reconnected). '''
+	up = False
+
+	def __init__(self, host, port, latency = None):
 		self.rmpd_host = host
 		self.rmpd_port = port
+		self.oid = None
+		self.up = False
+
+		''' Connections lost, and made again. '''
+		self.failures = 0
+		self.reconnects = 0
+
+		self.health_lock = threading.Lock()
+		self.reconnector = None
+		self.closing = threading.Event()
 
 		super(StreamServer, self).__init__()
+		self.timeout = TIMEOUT
+
+		''' {command: method}, without the health check or timing. '''
+		self.raw = {}
+		for cmd in COMMANDS:
+			self.raw[cmd] = getattr(self, cmd)
+			func = self.raw[cmd]
+			if latency is not None:
+				func = latency.timed('mpd_' + cmd, func)
+			setattr(self, cmd, self.guarded(func))
+
+		batch = self.batch
+		if latency is not None:
+			batch = latency.timed('mpd_batch', batch)
+		self.batch = self.guarded(batch)
+
+	def address(self):
+		return self.rmpd_host + ':' + str(self.rmpd_port)
+
+	def guarded(self, func):
+		"""
+		Wrap 'func' to fail fast while the server is down, and to mark
+		it down if the connection fails.
+		"""
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			if not self.up:
+				raise ServerDown(self.address() + " is down")
+			try:
+				return func(*args, **kwargs)
+			except (mpd.ConnectionError, OSError) as e:
+				self.lost(e)
+				raise ServerDown(self.address() + " is down: " + str(e))
+		return wrapper
+
+	def open(self):
+		"""
+		Connect now; if that fails, keep trying in the background.
+		"""
+		try:
+			self._open()
+			self.up = True
+		except (mpd.MPDError, OSError) as e:
+			self.lost(e)
+
+	def _open(self):
+		self.connect(self.rmpd_host, self.rmpd_port)
+		self.oid = self.raw['outputs']()[0]['outputid']
+
+	def lost(self, error):
+		"""
+		The connection failed: mark the server down, and start
+		reconnecting in the background.
+		"""
+		with self.health_lock:
+			if self.up:
+				self.failures += 1
+			self.up = False
+			self.oid = None
+			if self.reconnector is not None or self.closing.is_set():
+				return
+			logging.warning("[ StreamServer ] " + self.address() + " is down: " + str(error))
+			self.reconnector = threading.Thread(target = self._reconnect,
+					name = 'mpd-reconnect-' + str(self.rmpd_port))
+			self.reconnector.daemon = True
+			self.reconnector.start()
+
+	def _reconnect(self):
+		delay = RECONNECT_MIN
+		while not self.closing.is_set():
+			try:
+				try:
+					self.disconnect()
+				except (mpd.MPDError, OSError):
+					pass
+				self._open()
+			except (mpd.MPDError, OSError) as e:
+				# Back off, with jitter so servers don't retry in step
+				wait = delay / 2 + random.uniform(0, delay / 2)
+				logging.debug("[ StreamServer ] " + self.address() + ": can't connect ({}); retry in {:.1f}s".format(e, wait))
+				delay = min(2 * delay, RECONNECT_MAX)
+				self.closing.wait(wait)
+				continue
+
+			with self.health_lock:
+				self.up = True
+				self.reconnector = None
+				self.reconnects += 1
+			logging.info("[ StreamServer ] " + self.address() + " is back.")
+			return
+
+	def close(self):
+		"""
+		Stop reconnecting.
+		"""
+		self.closing.set()
 
 	def output_id(self):
-		self.ready()
-		return self.outputs()[0]['outputid']
+		"""
+		The id of the server's (first) output; asked for once per connection.
+		"""
+		if self.oid is None:
+			self.oid = self.outputs()[0]['outputid']
+		return self.oid
+
+	def batch(self, commands):
+		"""
+		Send 'commands', a list of (command, args...) tuples, as one
+		command list, and return their results.
+
+		MPD stops at the first command that fails, and CommandError
+		is raised.
+		"""
+		self.command_list_ok_begin()
+		for cmd in commands:
+			func = self.raw.get(cmd[0]) or getattr(self, cmd[0])
+			func(*cmd[1:])
+		return self.command_list_end()
 
 	def ready(self):
 		'''
-		Ensures that the client is still connected.
-		Call this before executing other client commands.
+		Raises ServerDown if the server is down. It costs no round
+		trip: the connection's health is kept from the commands.
 		'''
-		while True:
-			try:
-				status = self.status()
-				break
-			except mpd.ConnectionError:
-				try:
-					logging.info(self.__class__.__name__ + "> mpd: Lost connection - reconnect.")
-					self.connect(self.rmpd_host, self.rmpd_port)
-					time.sleep(1)
-				except TypeError:
-					logging.error(self.__class__.__name__ + "> mpd: Still can't connect.")
-					sys.exit(0)
+		if not self.up:
+			raise ServerDown(self.address() + " is down")
 
 	def play_by_seek(self):
-		import time
+		self.batch(self.play_by_seek_commands())
+
+	def play_by_seek_commands(self):
 		cur_hour = time.localtime()[3] - 6
 		cur_time = time.localtime()[4]*60
-		self.play(cur_hour)
-		self.seekcur(cur_time)
+		return [('play', cur_hour), ('seekcur', cur_time)]
+
+	def play_commands(self, play_func = None):
+		"""
+		The commands that start a stream playing: those of
+		'<play_func>_commands' if the server has it, or just 'play'.
+		"""
+		func = getattr(type(self), str(play_func) + '_commands', None)
+		if callable(func):
+			return func(self)
+		return [('play',)]
 	
 # End of class StreamServer
 
@@ -87,119 +261,370 @@ and a set of servers, and manages the switching between
 the streams, spread across the servers.
 
 Either streams of servers can be larger.
+
+Activations are counted as hits (the stream was already preloaded on
+a server) or misses (it had to be loaded cold); see hit_rate().
+
+Each server's part of a switch or preload goes as one command list
+(see StreamServer.batch), and with 'parallel' the servers are sent
+theirs at the same time, so a switch costs one round trip per server,
+overlapped.
+
+Streams are keyed by id. Streams that haven't been registered are
+built on demand by 'loader' (a function of the stream id that returns
+a Stream or None), so large catalogues can be loaded lazily.
+
+Which stream is on which server is kept in a placement.Placement;
+'policy' names the one that picks a server to reuse, and 'pins' are
+the favourite stream ids for the 'pinned' policy. 'stream_map' is its
+{stream id: server id}, to read only.
+
+The volume given to set_volume() is kept, and set on each server as
+it's switched to, in the same command list, so a switch can't undo it.
+
+'latency' is passed on to each StreamServer.
 """
 class StreamManager():
 	servers = []
 	active_server = 0
 
-	streams = []
-	stream_map = {}
+	streams = {}
+
+	loader = None
+
+	hits = 0
+	misses = 0
 
-	def __init__(self, host, starting_port, num_servers):
+	volume = None
+
+	def __init__(self, host, starting_port, num_servers, latency = None, parallel = True, policy = 'lru', pins = ()):
+		self.lock = threading.RLock()
+		self.pool = None
+		if parallel and num_servers > 1:
+			self.pool = concurrent.futures.ThreadPoolExecutor(num_servers - 1)
+		self.servers = []
+		self.streams = {}
+		self.placement = placement.Placement(num_servers, policy, pins)
+		self.hits = 0
+		self.misses = 0
+		self.volume = None
 		for p in range(0, num_servers):
-			self.servers.append(StreamServer(host, starting_port + p))
-
-	def register_stream(self, name, playlist, random = False, play_func = None):
-		self.streams.append(Stream(name, playlist, random, play_func))
-
-	def find_server(self):
-		# Priority: unassigned server, then inactive, then active
-		assigned_svrs = dict((v,k) for k,v in iter(self.stream_map.items()))
-		unassigned_svrs = set(range(0, len(self.servers))) - set(assigned_svrs.keys())
-		inactive_svrs = set(range(0, len(self.servers))) - set([self.active_server])
-
-		if len(unassigned_svrs) > 0:
-			svr_id = list(unassigned_svrs)[0]
-			logging.debug("[ StreamManager ] : Found an UNASSIGNED server (#" + str(svr_id) + ")")
-		elif len(inactive_svrs) > 0:
-			svr_id = list(inactive_svrs)[0]
-			logging.debug("[ StreamManager ] : Found an INACTIVE server (#" + str(svr_id) + ")")
-		else:
+			self.servers.append(StreamServer(host, starting_port + p, latency))
+
+	@property
+	def stream_map(self):
+		return self.placement.server_of
+
+	def register_stream(self, name, playlist, random = False, play_func = None, stream_id = None):
+		if stream_id is None:
+			stream_id = len(self.streams)
+		self.streams[stream_id] = Stream(name, playlist, random, play_func)
+		return stream_id
+
+	@locked
+	def connect(self):
+		"""
+		Connect every server. Any that can't be reached are left
+		reconnecting in the background.
+		"""
+		for svr in self.servers:
+			svr.open()
+
+	def close(self):
+		for svr in self.servers:
+			svr.close()
+		if self.pool is not None:
+			self.pool.shutdown()
+
+	def run_batches(self, batches):
+		"""
+		Send each server its batch ({server id: [commands]}), all at
+		once if there's a pool. Returns {server id: results}; raises the
+		first error once every server has finished.
+		"""
+		items = [(svr_id, cmds) for (svr_id, cmds) in batches.items() if cmds]
+		if self.pool is None or len(items) < 2:
+			return dict((svr_id, self.servers[svr_id].batch(cmds)) for (svr_id, cmds) in items)
+
+		futures = [(svr_id, self.pool.submit(self.servers[svr_id].batch, cmds)) for (svr_id, cmds) in items[1:]]
+		(svr_id, cmds) = items[0]
+		results = {}
+		error = None
+		try:
+			results[svr_id] = self.servers[svr_id].batch(cmds)
+		except Exception as e:
+			error = e
+		for (svr_id, future) in futures:
+			try:
+				results[svr_id] = future.result()
+			except Exception as e:
+				error = error or e
+		if error is not None:
+			raise error
+		return results
+
+	def set_loader(self, loader):
+		self.loader = loader
+
+	def get_stream(self, stream_id):
+		"""
+		Returns a Stream by id, using the loader if it isn't registered.
+		Raises KeyError if there is no such stream.
+		"""
+		try:
+			return self.streams[stream_id]
+		except KeyError:
+			if self.loader is None:
+				raise
+			stream = self.loader(stream_id)
+			if stream is None:
+				raise
+			self.streams[stream_id] = stream
+			return stream
+
+	@locked
+	def update_streams(self, streams):
+		"""
+		Replace the registered streams with 'streams' ({id: Stream}),
+		eg. after the playlists table has changed.
+
+		Servers keep their assignment if their stream's playlist is still
+		there (even under a new id); servers whose playlist has gone are
+		freed. Nothing is stopped, so the active server keeps playing.
+		"""
+		by_playlist = dict((s.playlist, stream_id) for (stream_id, s) in streams.items())
+
+		new_map = {}
+		for (old_id, svr_id) in self.stream_map.items():
+			old = self.streams.get(old_id)
+			if old is None:
+				continue
+			new_id = by_playlist.get(old.playlist)
+			if new_id is not None:
+				new_map[new_id] = svr_id
+			else:
+				logging.debug("[ StreamManager ] : Stream " + str(old_id) + " removed; freeing server " + str(svr_id))
+
+		self.streams = dict(streams)
+		self.placement.reset(new_map)
+
+
+	def active_stream(self):
+		"""
+		The id of the stream on the active server, or None.
+		"""
+		return self.placement.stream_of[self.active_server]
+
+
+	@locked
+	def retain(self, stream_ids):
+		"""
+		Forget streams that aren't in 'stream_ids' and aren't loaded
+		on a server; they will be rebuilt by the loader if needed again.
+		"""
+		keep = set(stream_ids) | set(self.stream_map.keys())
+		for stream_id in list(self.streams.keys()):
+			if stream_id not in keep:
+				del self.streams[stream_id]
+
+	def hit_rate(self):
+		"""
+		The fraction of activations served from a preloaded server.
+		"""
+		total = self.hits + self.misses
+		if total == 0:
+			return 0.0
+		return self.hits / total
+
+
+	def find_server(self, keep = ()):
+		# Priority: unassigned server, then inactive (the placement
+		# policy picks which), then active. Servers holding a stream in
+		# 'keep', or down, are left alone.
+		place = self.placement
+		held = set(place.get(k) for k in keep)
+		svr_id = place.choose([i for (i, svr) in enumerate(self.servers)
+				if svr.up and i not in held and (i != self.active_server or place.stream_of[i] is None)])
+		if svr_id is None:
 			svr_id = self.active_server
 			logging.debug("[ StreamManager ] : Found an IN-USE server (#" + str(svr_id) + ")")
-
 		return svr_id
 
 
-	def preload(self, stream_id):
+	def _assign(self, stream_id, keep = ()):
+		"""
+		Give 'stream_id' a server (see find_server()).
+		Returns (server id, the commands that load it there), or None
+		if there is no such stream.
+		"""
+		try:
+			stream = self.get_stream(stream_id)
+		except KeyError:
+			logging.debug("[ StreamManager ] : Stream " + str(stream_id) + " does not exist.")
+			return None
+
+		svr_id = self.find_server(keep)
+		self.placement.place(stream_id, svr_id)
+		logging.debug("[ StreamManager ] : Putting stream {streamid} on {server}".format(streamid = stream_id, server = svr_id))
+		return (svr_id, [('clear',), ('load', stream.playlist)])
+
+
+	def _forget_down(self):
+		"""
+		Forget the streams on servers that are down; whatever they had
+		loaded may be gone by the time they're back.
+		"""
+		for (svr_id, svr) in enumerate(self.servers):
+			stream_id = self.placement.stream_of[svr_id]
+			if stream_id is not None and not svr.up:
+				self.placement.remove(stream_id)
+
+
+	def _load(self, batches):
+		"""
+		Run the load 'batches' ({server id: [commands]}). If any fails,
+		the streams placed on those servers are all forgotten, as which
+		of them loaded isn't known; they're loaded again when wanted.
+		"""
+		try:
+			self.run_batches(batches)
+		except mpd.CommandError as e:
+			logging.debug("[ StreamManager ] : Could not load playlist: " + str(e))
+			for svr_id in batches:
+				stream_id = self.placement.stream_of[svr_id]
+				if stream_id is not None:
+					self.placement.remove(stream_id)
+
+
+	@locked
+	def preload(self, stream_id, keep = ()):
 		if stream_id in self.stream_map:
 			logging.debug("[ StreamManager ] : Stream " + str(stream_id) + " already loaded on server " + str(self.stream_map[stream_id]))
 			return
 
-		try:
-			stream = self.streams[stream_id]
-		except IndexError:
-			logging.debug("[ StreamManager ] : Stream " + str(stream_id) + " does not exist.")
+		assigned = self._assign(stream_id, keep)
+		if assigned is None:
 			return False
+		self._load(dict([assigned]))
+
+
+	@locked
+	def restore(self, stream_map):
+		"""
+		Adopt a saved stream map (eg. from a snapshot), for servers that
+		still have a playlist loaded, so those streams needn't be reloaded.
+		"""
+		self.placement.reset()
+		for (stream_id, svr_id) in stream_map.items():
+			if svr_id < 0 or svr_id >= len(self.servers) or not self.servers[svr_id].up:
+				continue
+			try:
+				if int(self.servers[svr_id].status().get('playlistlength', 0)) > 0:
+					self.placement.place(stream_id, svr_id)
+			except ServerDown:
+				pass
 
-		svr_id = self.find_server()
-		# Unassign this server
-		try:
-			assigned_servers = dict((svr_id,stream_id) for stream_id,svr_id in self.stream_map.items())
-			old_stream_id = assigned_servers[svr_id]
-			self.stream_map.pop(old_stream_id)
-		except (KeyError, IndexError):
-			pass
-
-		self.stream_map[stream_id] = svr_id
 
-		svr = self.servers[svr_id]
-		stream = self.streams[stream_id]
-		svr.ready()
-		svr.clear()
+	@locked
+	def pause(self):
+		"""
+		Pause the active server, if it's up.
+		"""
 		try:
-			svr.load(stream.playlist)
-			logging.debug("[ StreamManager ] : Putting stream {streamid} on {server}".format(streamid = stream_id, server = svr_id))
-		except mpd.CommandError:
-			logging.debug("[ StreamManager ] : Could not load playlist '" + str(stream.playlist) + "'")
+			self.servers[self.active_server].pause()
+		except ServerDown:
+			pass
 
 
+	@locked
+	def prefetch(self, stream_ids):
+		"""
+		Preload 'stream_ids' (most wanted first) onto the servers other
+		than the active one (that are up), without evicting each other.
+		"""
+		self._forget_down()
+		spare = sum(1 for (i, svr) in enumerate(self.servers) if svr.up and i != self.active_server)
+		wanted = list(stream_ids)[:spare]
+		batches = {}
+		for stream_id in wanted:
+			if stream_id not in self.stream_map:
+				assigned = self._assign(stream_id, keep = wanted)
+				if assigned is not None:
+					batches[assigned[0]] = assigned[1]
+		self._load(batches)
+
+
+	@locked
 	def activate_stream(self, stream_id):
-		if stream_id not in self.stream_map:
-			self.preload(stream_id)
+		"""
+		Switch to 'stream_id': the old server is paused and silenced
+		while the new one is (loaded, if it's a miss and) started, each
+		in one batch. Raises KeyError for an unknown stream, and
+		ServerDown if the stream can only go on a server that's down.
+		"""
+		self._forget_down()
+		new_cmds = []
+		if stream_id in self.stream_map:
+			self.hits += 1
+		else:
+			self.misses += 1
+			assigned = self._assign(stream_id)
+			if assigned is None:
+				raise KeyError(stream_id)
+			new_cmds = assigned[1]
 
 		svr_id = self.stream_map[stream_id]
-#		if svr_id == self.active_server:
-#			return
-
 		old_svr_id = self.active_server
 		old_svr = self.servers[old_svr_id]
-		old_svr.ready()
-		old_svr.pause()
-		old_svr.disableoutput(old_svr.output_id())
-
 		svr = self.servers[svr_id]
-		svr.ready()
-		svr.enableoutput(svr.output_id())
-
 		stream = self.streams[stream_id]
 
-		if stream.random:
-			svr.random(1)
-		else:
-			svr.random(0)
+		old_cmds = []
+		if old_svr.up:
+			old_cmds = [('pause',), ('disableoutput', old_svr.output_id())]
+		if self.volume is not None:
+			new_cmds += [('setvol', self.volume)]
+		new_cmds += [('enableoutput', svr.output_id()), ('random', 1 if stream.random else 0)]
+		new_cmds += svr.play_commands(stream.play_func)
 
-		try:
-			call = getattr(svr, stream.play_func)
-			if callable(call):
-				call()
-			else:
-				svr.play()
-		except IndexError:
-			svr.play()
-		except AttributeError:
-			svr.play()
+		if svr_id == old_svr_id:
+			batches = {svr_id: old_cmds + new_cmds}
+		else:
+			batches = {old_svr_id: old_cmds, svr_id: new_cmds}
 
 		self.active_server = svr_id
+		self.placement.played_on(svr_id)
+		try:
+			self.run_batches(batches)
+		except mpd.CommandError as e:
+			# Its playlist may not have loaded; don't count on it next time
+			self.placement.remove(stream_id)
+			if isinstance(e, CommandError):
+				raise
+			raise CommandError(str(e))
 		logging.debug("[ StreamManager ] : Moving servers: {old_server} ==> {new_server} with stream {streamid}".format(old_server = old_svr_id, new_server = svr_id, streamid = stream_id))
 
 
+	@locked
+	def set_volume(self, percent):
+		"""
+		Set the volume on the active server, and on the others as
+		they're switched to. Raises ServerDown if the active server is
+		down; the volume is still kept.
+		"""
+		self.volume = int(percent)
+		self.servers[self.active_server].setvol(self.volume)
+
+
+	@locked
 	def query_server(self, cmd):
+		"""
+		Run 'cmd' (eg. 'currentsong') on the active server; returns
+		its result, or False if it failed.
+		"""
 		try:
-			act_svr = self.servers[self.active_server]
-			call = getattr(act_svr, cmd)
-			return act_svr.call()
-		except (AttributeError, TypeError):
+			return getattr(self.servers[self.active_server], cmd)()
+		except (AttributeError, TypeError, mpd.MPDError):
 			return False
 
 #End of class StreamManager
@@ -0,0 +1,85 @@
+import json, logging, os
+
+"""
+Snapshot
+
+A small record of what the radio was doing, saved as JSON so the next
+boot can pick up where this one left off:
+
+	station      catalogue id of the station playing (-1 for none)
+	volume       the volume knob's last value
+	stream_map   which server each loaded stream is on
+	playlists    checksum of the playlists table (see ConfigWatcher)
+
+A snapshot is only good for the same playlists; if the table has
+changed since it was saved, the station ids may mean something else.
+"""
+class Snapshot(object):
+
+	def __init__(self, station = -1, volume = -1, stream_map = None, playlists = 0):
+		self.station = station
+		self.volume = volume
+		self.stream_map = dict(stream_map or {})
+		self.playlists = playlists
+
+
+	@classmethod
+	def load(cls, path):
+		"""
+		Returns the Snapshot saved at 'path', or None if there isn't a usable one.
+		"""
+		try:
+			with open(path) as f:
+				data = json.load(f)
+			return cls(int(data['station']),
+					int(data['volume']),
+					dict((int(k), int(v)) for (k, v) in data['stream_map'].items()),
+					int(data['playlists']))
+		except (IOError, ValueError, KeyError, TypeError, AttributeError) as e:
+			logging.debug("[ Snapshot ] No snapshot at " + str(path) + ": " + str(e))
+			return None
+
+
+	def save(self, path):
+		"""
+		Write the snapshot; a crash mid-write leaves the old one in place.
+		"""
+		data = {
+			'station': self.station,
+			'volume': self.volume,
+			'stream_map': dict((str(k), v) for (k, v) in self.stream_map.items()),
+			'playlists': self.playlists,
+		}
+		tmp = path + '.tmp'
+		try:
+			with open(tmp, 'w') as f:
+				json.dump(data, f)
+			os.replace(tmp, path)
+		except (IOError, OSError) as e:
+			logging.error("[ Snapshot ] Can't save " + str(path) + ": " + str(e))
+
+# End of class Snapshot
+
+
+def resume(snapshot, str_man, playlists):
+	"""
+	Start playing the snapshot's station, reusing whatever the servers
+	still have loaded. 'playlists' is the current playlists checksum.
+	Returns the station id, or None if the snapshot doesn't apply.
+	"""
+	if snapshot is None or snapshot.station < 0:
+		return None
+	if snapshot.playlists != playlists:
+		logging.info("[ Snapshot ] Playlists changed since the last run; not resuming.")
+		return None
+
+	from . import rmpd
+
+	str_man.restore(snapshot.stream_map)
+	try:
+		str_man.activate_stream(snapshot.station)
+	except (KeyError, rmpd.CommandError) as e:
+		logging.info("[ Snapshot ] Can't resume station " + str(snapshot.station) + ": " + str(e))
+		return None
+	logging.info("[ Snapshot ] Resumed station " + str(snapshot.station))
+	return snapshot.station
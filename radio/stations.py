@@ -0,0 +1,171 @@
+import collections, logging, sqlite3
+
+"""
+StationCatalogue
+
+The stations (rows of the 'playlists' table), split into banks of
+'bank_size' stations. The dial tunes within one bank at a time.
+
+A station id is its position in the whole catalogue (ordered by the
+table's id column), so bank b holds ids b*bank_size .. (b+1)*bank_size-1.
+
+Banks are read from the database only when needed, and only a few are
+kept in memory, so startup time and memory don't grow with the number
+of stations. A bank_size of 0 puts every station into one bank.
+"""
+class StationCatalogue(object):
+
+	''' How many banks to keep loaded. '''
+	cache_size = 3
+
+	def __init__(self, db_name, bank_size = 0):
+		self.db_name = db_name
+		self.bank_size = bank_size
+		self._banks = collections.OrderedDict()
+		self._count = None
+
+
+	def _query(self, sql, args = ()):
+		conn = sqlite3.connect(self.db_name)
+		with conn:
+			cur = conn.cursor()
+			cur.execute(sql, args)
+			return cur.fetchall()
+
+
+	def count(self):
+		"""
+		The number of stations in the whole catalogue.
+		"""
+		if self._count is None:
+			self._count = self._query("SELECT COUNT(*) FROM playlists")[0][0]
+		return self._count
+
+
+	def size(self):
+		"""
+		Stations per bank.
+		"""
+		if self.bank_size > 0:
+			return self.bank_size
+		return max(1, self.count())
+
+
+	def num_banks(self):
+		return max(1, -(-self.count() // self.size()))
+
+
+	def bank(self, bank_id):
+		"""
+		Returns the playlist rows in bank 'bank_id'.
+		"""
+		try:
+			rows = self._banks.pop(bank_id)
+		except KeyError:
+			logging.debug("[ Stations ] Loading bank " + str(bank_id))
+			rows = self._query("SELECT * FROM playlists ORDER BY id LIMIT ? OFFSET ?",
+						(self.size(), bank_id * self.size()))
+		self._banks[bank_id] = rows
+		while len(self._banks) > self.cache_size:
+			self._banks.popitem(last = False)
+		return rows
+
+
+	def station_id(self, bank_id, slot):
+		"""
+		The catalogue id of station 'slot' within bank 'bank_id'.
+		"""
+		return bank_id * self.size() + slot
+
+
+	def bank_of(self, station_id):
+		return station_id // self.size()
+
+
+	def stream(self, station_id):
+		"""
+		Build the rmpd.Stream for a station id, or None if there isn't one.
+		Use this as a StreamManager loader.
+		"""
+		from . import rmpd
+
+		if station_id < 0:
+			return None
+		rows = self.bank(self.bank_of(station_id))
+		try:
+			row = rows[station_id % self.size()]
+		except IndexError:
+			return None
+		(name, playlist, random, play_func) = row[1:]
+		return rmpd.Stream(str(name), str(playlist), bool(random), str(play_func))
+
+
+	def invalidate(self):
+		"""
+		Forget anything loaded, eg. after the table has changed.
+		"""
+		self._banks.clear()
+		self._count = None
+
+# End of class StationCatalogue
+
+
+"""
+BankSelector
+
+Turns a gesture on the tuning knob into a bank change: holding the
+knob against either end of the dial (within 'edge' ticks) for 'dwell'
+seconds moves one bank down (left end) or up (right end).
+
+The knob has to leave the end zone before it can page again.
+"""
+class BankSelector(object):
+
+	def __init__(self, num_banks, bank = 0, dwell = 2.0, edge = 8):
+		self.num_banks = num_banks
+		self.bank = max(0, min(bank, num_banks - 1))
+		self.dwell = dwell
+		self.edge = edge
+
+		self._zone = 0
+		self._since = 0
+		self._armed = True
+
+
+	def in_zone(self):
+		"""
+		True while the knob is in an end zone and could still page.
+		"""
+		return self._zone != 0 and self._armed
+
+
+	def update(self, tuning, now):
+		"""
+		Call regularly with the tuning and a monotonic time.
+		Returns the new bank id when the bank changes, else None.
+		"""
+		if tuning <= self.edge:
+			zone = -1
+		elif tuning >= 1023 - self.edge:
+			zone = 1
+		else:
+			zone = 0
+
+		if zone != self._zone:
+			self._zone = zone
+			self._since = now
+			self._armed = True
+			return None
+
+		if zone == 0 or not self._armed or now - self._since < self.dwell:
+			return None
+
+		self._armed = False
+		new_bank = self.bank + zone
+		if new_bank < 0 or new_bank >= self.num_banks:
+			return None
+		self.bank = new_bank
+		logging.info("[ Stations ] Bank " + str(self.bank + 1) + " of " + str(self.num_banks))
+		return self.bank
+
+# End of class BankSelector
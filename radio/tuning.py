@@ -0,0 +1,212 @@
+import logging, math
+
+"""
+SweepCoalescer
+
+Decides when a tuned station should actually be played.
+
+Turning the knob across the dial passes through several stations, and
+switching MPD to each one on the way (clear, load, play, and a couple
+of queries) is wasted work for stations nobody listens to. Instead, a
+station is only activated once the tuning has stayed inside it for
+'settle' seconds, and the knob isn't moving faster than 'max_velocity'
+(ticks per second).
+
+	IDLE       nothing to do; the active station (if any) is tuned
+	SWEEPING   the knob is between stations, or moving too fast
+	SETTLING   tuned to a new station; waiting out the settle time
+
+Feed it every tuner reading with update(); when that returns None but
+deadline() doesn't, call poll() at that time, since a knob that stops
+moving doesn't produce any more readings.
+
+A settle time of 0 activates every station as soon as it's tuned.
+"""
+class SweepCoalescer(object):
+
+	IDLE = 'idle'
+	SWEEPING = 'sweeping'
+	SETTLING = 'settling'
+
+	''' How much of each new velocity measurement to take. '''
+	velocity_fac = 0.5
+
+	def __init__(self, settle = 0.3, max_velocity = 200.0):
+		self.settle = settle
+		self.max_velocity = max_velocity
+
+		self.state = self.IDLE
+		self.active = -1
+		self.velocity = 0.0
+
+		''' Counters: stations tuned, stations played, and switches skipped. '''
+		self.passed = 0
+		self.activated = 0
+		self.avoided = 0
+
+		self._candidate = -1
+		self._since = 0
+		self._last_tuning = None
+		self._last_time = 0
+
+
+	def reset(self, active = -1):
+		"""
+		Forget any sweep in progress; 'active' is the station now playing.
+		"""
+		self.state = self.IDLE
+		self.active = active
+		self.velocity = 0.0
+		self._candidate = -1
+		self._last_tuning = None
+
+
+	def _measure(self, tuning, now):
+		if self._last_tuning is not None:
+			dt = now - self._last_time
+			if dt > 0:
+				inst = abs(tuning - self._last_tuning) / dt
+				self.velocity += self.velocity_fac * (inst - self.velocity)
+		self._last_tuning = tuning
+		self._last_time = now
+
+
+	def _abandon(self):
+		if self._candidate != -1:
+			self.avoided += 1
+			self._candidate = -1
+
+
+	def update(self, tuning, station_id, now):
+		"""
+		Call with each tuning, the station it's in (or -1) and a monotonic time.
+		Returns the station id to play now, or None.
+		"""
+		self._measure(tuning, now)
+
+		if station_id != self._candidate:
+			self._abandon()
+			if station_id == -1 or station_id == self.active:
+				self.state = self.SWEEPING if station_id == -1 else self.IDLE
+				return None
+			self.passed += 1
+			self._candidate = station_id
+			self._since = now
+			self.state = self.SETTLING
+
+		return self.poll(now)
+
+
+	def deadline(self):
+		"""
+		When poll() should next be called, or None if it needn't be.
+		"""
+		if self._candidate == -1:
+			return None
+		if self.velocity > self.max_velocity:
+			return max(self._since, self._last_time) + self.settle
+		return self._since + self.settle
+
+
+	def poll(self, now):
+		"""
+		Returns the station id to play if it has settled, else None.
+		"""
+		deadline = self.deadline()
+		if deadline is None:
+			return None
+
+		# Compare against deadline() itself, so a timer set for it always fires
+		if now < deadline:
+			self.state = self.SWEEPING if self.velocity > self.max_velocity else self.SETTLING
+			return None
+
+		station_id = self._candidate
+		self._candidate = -1
+		self.active = station_id
+		self.activated += 1
+		self.state = self.IDLE
+		logging.debug("[ Tuning ] Settled on " + str(station_id) + "; "
+				+ str(self.activated) + " switches, " + str(self.avoided) + " avoided")
+		return station_id
+
+# End of class SweepCoalescer
+
+
+"""
+PreloadPredictor
+
+Guesses which stations are likely to be tuned next, so they can be
+preloaded on spare MPD servers.
+
+It keeps a signed velocity of the knob (ticks per second, smoothed),
+projects the tuning 'horizon' seconds ahead, and ranks stations by how
+close their frequency is to that point. A knob at rest ranks the
+nearest stations on either side; a knob on the move ranks the stations
+ahead of it, further ahead the faster it's going.
+
+A knob at rest isn't read as a change, so update() isn't called; the
+velocity dies away on its own instead, 'rest_time' being its time
+constant, so a sweep that has stopped doesn't still push the target on.
+"""
+class PreloadPredictor(object):
+
+	''' How much of each new velocity measurement to take. '''
+	velocity_fac = 0.5
+
+	''' Seconds for the velocity to fall by a factor of e with the knob at rest. '''
+	rest_time = 0.15
+
+	def __init__(self, horizon = 1.0):
+		self.horizon = horizon
+
+		self.tuning = -1
+		self.velocity = 0.0
+
+		self._last_time = 0
+
+
+	def velocity_at(self, now):
+		"""
+		The velocity at 'now', decayed since the last update.
+		"""
+		rest = now - self._last_time
+		if rest <= 0:
+			return self.velocity
+		return self.velocity * math.exp(-rest / self.rest_time)
+
+
+	def update(self, tuning, now):
+		"""
+		Call with each tuning and a monotonic time.
+		"""
+		if self.tuning >= 0:
+			dt = now - self._last_time
+			if dt > 0:
+				inst = (tuning - self.tuning) / dt
+				velocity = self.velocity_at(now)
+				self.velocity = velocity + self.velocity_fac * (inst - velocity)
+		self.tuning = tuning
+		self._last_time = now
+
+
+	def target(self, now = None):
+		"""
+		Where the tuning is expected to be 'horizon' seconds after
+		'now' (the last update if it's None).
+		"""
+		velocity = self.velocity if now is None else self.velocity_at(now)
+		return self.tuning + velocity * self.horizon
+
+
+	def rank(self, freq_list, count, exclude = -1, now = None):
+		"""
+		Returns up to 'count' station slots (indexes into 'freq_list'),
+		most likely first, leaving out 'exclude'. 'now' is as for target().
+		"""
+		target = self.target(now)
+		slots = [s for s in range(len(freq_list)) if s != exclude]
+		slots.sort(key = lambda s: abs(freq_list[s] - target))
+		return slots[:count]
+
+# End of class PreloadPredictor
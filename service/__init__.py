@@ -1 +1 @@
-__all__ = ['service', 'config_defaults', 'option_loader', 'pots', 'led', 'www']
+__all__ = ['service', 'config_defaults', 'option_loader', 'adc', 'boot', 'dial', 'filters', 'governor', 'latency', 'mixer', 'pots', 'reactor', 'ringbuffer', 'sampler', 'sim', 'trace', 'watchdog', 'led', 'www']
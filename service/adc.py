@@ -0,0 +1,208 @@
+import logging
+
+"""
+ADC backends for the MCP3008.
+
+Each backend reads a list of channels in one go and returns a list of
+10-bit values (0 - 1023) in the same order:
+
+	adc.read_channels([vol_ch, tune_ch])
+
+A single backend instance is meant to be shared by every PotReader, so
+that both knobs are sampled together instead of one after the other.
+
+A backend pickles as its settings, so a process started with 'spawn'
+or 'forkserver' (see service.sampler.ProcessSampler) opens its own.
+"""
+
+
+"""
+BitBangADC
+
+Talks to the MCP3008 by toggling GPIO pins from python.
+From adafruit.com, with the pin lookups and GPIO calls bound once.
+"""
+class BitBangADC(object):
+
+	name = 'bitbang'
+
+	def __init__(self, clockpin, mosipin, misopin, cspin, oversample = 1):
+		import RPi.GPIO as GPIO
+
+		GPIO.setwarnings(False)
+		GPIO.setmode(GPIO.BCM)
+
+		GPIO.setup(mosipin, GPIO.OUT)
+		GPIO.setup(misopin, GPIO.IN)
+		GPIO.setup(clockpin, GPIO.OUT)
+		GPIO.setup(cspin, GPIO.OUT)
+
+		self.gpio = GPIO
+		self.clockpin = clockpin
+		self.mosipin = mosipin
+		self.misopin = misopin
+		self.cspin = cspin
+		self.oversample = max(1, int(oversample))
+
+
+	def __reduce__(self):
+		return (BitBangADC, (self.clockpin, self.mosipin, self.misopin, self.cspin, self.oversample))
+
+
+	def _read_one(self, adcnum):
+		"""
+		Reads a single conversion from channel 'adcnum'.
+		"""
+		output = self.gpio.output
+		inp = self.gpio.input
+		clk = self.clockpin
+		mosi = self.mosipin
+		miso = self.misopin
+		cs = self.cspin
+
+		output(cs, True)
+
+		output(clk, False)  # start clock low
+		output(cs, False)   # bring CS low
+
+		commandout = adcnum
+		commandout |= 0x18  # start bit + single-ended bit
+		commandout <<= 3    # we only need to send 5 bits here
+		for i in range(5):
+			output(mosi, bool(commandout & 0x80))
+			commandout <<= 1
+			output(clk, True)
+			output(clk, False)
+
+		adcout = 0
+		# read in one empty bit, one null bit and 10 ADC bits
+		for i in range(12):
+			output(clk, True)
+			output(clk, False)
+			adcout <<= 1
+			if inp(miso):
+				adcout |= 0x1
+
+		output(cs, True)
+
+		return adcout >> 1  # first bit is 'null' so drop it
+
+
+	def read_channels(self, channels):
+		"""
+		Reads each channel in 'channels', averaging 'oversample' conversions.
+		"""
+		n = self.oversample
+		vals = []
+		for ch in channels:
+			if (ch > 7) or (ch < 0):
+				vals.append(-1)
+				continue
+			total = 0
+			for i in range(n):
+				total += self._read_one(ch)
+			vals.append(total // n)
+		return vals
+
+
+	def read(self, channel):
+		return self.read_channels((channel,))[0]
+
+
+	def close(self):
+		pass
+
+# End of class BitBangADC
+
+
+"""
+SpiADC
+
+Uses the kernel SPI driver (spidev) to talk to the MCP3008.
+
+Each conversion (channels x oversample) is its own 3-byte xfer2()
+call: xfer2() holds chip-select low for its whole buffer, and the
+MCP3008 needs it raised between conversions. The frames are built
+once per channel.
+"""
+class SpiADC(object):
+
+	name = 'spi'
+
+	def __init__(self, bus = 0, device = 0, speed_hz = 1000000, oversample = 1):
+		import spidev
+
+		self.spi = spidev.SpiDev()
+		self.spi.open(bus, device)
+		self.spi.max_speed_hz = speed_hz
+		self.spi.mode = 0
+
+		self.bus = bus
+		self.device = device
+		self.speed_hz = speed_hz
+		self.oversample = max(1, int(oversample))
+
+		''' The transmit frame for each channel. '''
+		self._frames = [(1, (8 + ch) << 4, 0) for ch in range(8)]
+
+
+	def __reduce__(self):
+		return (SpiADC, (self.bus, self.device, self.speed_hz, self.oversample))
+
+
+	def read_channels(self, channels):
+		"""
+		Reads each channel in 'channels', one conversion per transfer.
+		"""
+		channels = tuple(channels)
+		for ch in channels:
+			if (ch > 7) or (ch < 0):
+				raise ValueError("MCP3008 channel out of range: " + str(ch))
+
+		xfer2 = self.spi.xfer2
+		n = self.oversample
+		vals = []
+		for ch in channels:
+			frame = self._frames[ch]
+			total = 0
+			for i in range(n):
+				# xfer2 overwrites the list it is given, so pass a new one.
+				rx = xfer2(list(frame))
+				total += ((rx[1] & 3) << 8) + rx[2]
+			vals.append(total // n)
+		return vals
+
+
+	def read(self, channel):
+		return self.read_channels((channel,))[0]
+
+
+	def close(self):
+		self.spi.close()
+
+# End of class SpiADC
+
+
+def open_adc(options):
+	"""
+	Returns an ADC backend configured by an OptionLoader.
+
+	If ENABLE_SPI is set, the spidev backend is tried first; any failure
+	(no module, no /dev/spidev*) falls back to bit-banging.
+	"""
+	oversample = options.fetch('ADC_OVERSAMPLE')
+
+	if options.fetch('ENABLE_SPI'):
+		try:
+			return SpiADC(options.fetch('SPI_BUS'),
+						options.fetch('SPI_DEVICE'),
+						options.fetch('SPI_SPEED_HZ'),
+						oversample)
+		except (ImportError, IOError, OSError) as e:
+			logging.warning("[ ADC ] SPI unavailable, falling back to bit-bang: " + str(e))
+
+	return BitBangADC(options.fetch('SPICLK'),
+					options.fetch('SPIMOSI'),
+					options.fetch('SPIMISO'),
+					options.fetch('SPICS'),
+					oversample)
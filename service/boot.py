@@ -0,0 +1,137 @@
+import logging, threading, time
+
+"""
+Boot timeline.
+
+Startup is split into named phases. Phases that don't depend on each
+other are started with spawn() and run in their own threads, while
+run() does a phase on the caller's thread; wait() joins a spawned phase
+and hands back its result. Every phase is timed, and mark() records
+milestones (eg. first audio), so report() can show where boot time
+goes:
+
+	boot = BootTimeline()
+	boot.spawn('web', start_web)
+	adc = boot.run('adc', open_adc)
+	web = boot.wait('web')
+	boot.mark('first_audio')
+	print(boot.report())
+"""
+
+"""
+Phase
+
+One timed step of the boot.
+"""
+class Phase(object):
+	__slots__ = ('name', 'start', 'end', 'result', 'error', 'thread')
+
+	def __init__(self, name):
+		self.name = name
+		self.start = None
+		self.end = None
+		self.result = None
+		self.error = None
+		self.thread = None
+
+# End of class Phase
+
+
+"""
+BootTimeline
+"""
+class BootTimeline(object):
+
+	def __init__(self, clock = time.monotonic):
+		self.clock = clock
+		self.t0 = clock()
+		self.phases = []
+		self.marks = []
+		self._by_name = {}
+
+
+	def _new_phase(self, name):
+		phase = Phase(name)
+		self.phases.append(phase)
+		self._by_name[name] = phase
+		return phase
+
+
+	def _do(self, phase, func, args):
+		phase.start = self.clock() - self.t0
+		try:
+			phase.result = func(*args)
+		except BaseException as e:
+			phase.error = e
+		phase.end = self.clock() - self.t0
+		logging.debug("[ Boot ] {} done in {:.0f} ms".format(phase.name, 1000 * (phase.end - phase.start)))
+
+
+	def run(self, name, func, *args):
+		"""
+		Run a phase now, on this thread.
+		"""
+		phase = self._new_phase(name)
+		self._do(phase, func, args)
+		if phase.error is not None:
+			raise phase.error
+		return phase.result
+
+
+	def spawn(self, name, func, *args):
+		"""
+		Start a phase in the background.
+		"""
+		phase = self._new_phase(name)
+		phase.thread = threading.Thread(target = self._do, args = (phase, func, args), name = 'boot-' + name)
+		phase.thread.daemon = True
+		phase.thread.start()
+
+
+	def wait(self, name):
+		"""
+		Wait for a spawned phase; returns its result, or raises its exception.
+		"""
+		phase = self._by_name[name]
+		if phase.thread is not None:
+			phase.thread.join()
+		if phase.error is not None:
+			raise phase.error
+		return phase.result
+
+
+	def mark(self, name, at = None):
+		"""
+		Record milestone 'name' now, or at 'at' (a time of the clock).
+		Safe to call from any thread.
+		"""
+		if at is None:
+			at = self.clock()
+		self.marks.append((name, at - self.t0))
+
+
+	def marked(self, name):
+		return any(n == name for (n, t) in self.marks)
+
+
+	def report(self, width = 40):
+		"""
+		A text timeline of the phases and marks, in ms since the timeline began.
+		"""
+		ends = [p.end for p in self.phases if p.end is not None] + [t for (n, t) in self.marks]
+		total = max(ends) if ends else 0
+		scale = width / total if total > 0 else 0
+
+		lines = ["{:<14} {:>7} {:>7} {:>7}".format('phase', 'start', 'end', 'ms')]
+		for p in self.phases:
+			if p.end is None:
+				lines.append("{:<14} {:>7.0f} {:>7} {:>7}".format(p.name, 1000 * p.start, '...', ''))
+				continue
+			bar = ' ' * int(p.start * scale) + '#' * max(1, int((p.end - p.start) * scale))
+			lines.append("{:<14} {:>7.0f} {:>7.0f} {:>7.0f} |{}".format(
+					p.name, 1000 * p.start, 1000 * p.end, 1000 * (p.end - p.start), bar))
+		for (name, t) in self.marks:
+			lines.append("{:<14} {:>7} {:>7.0f} {:>7} |{}^".format(name, '', 1000 * t, '', ' ' * int(t * scale)))
+		return '\n'.join(lines)
+
+# End of class BootTimeline
@@ -0,0 +1,224 @@
+import math
+
+from array import array
+
+"""
+Dial geometry.
+
+We setup our dial with each station's tuning in an interval of radius
+'radius', separated by a gap of size 'gap'.
+
+For three stations, the dial will be separated as:
+	.5g r1r g r2r g r3r .5g,
+where g marks an untuned gap, and r is a tuned radius.
+So then
+	num_gaps = num_st,
+	num_radii = 2 * num_st.
+
+The gaps will be of length
+	len_gaps = GAP_FACTOR * len_radii.
+
+We solve then
+	(max_pot - min_pot) = num_gaps * len_gaps + num_radii * len_radii
+	(max_pot - min_pot) = num_st * len_radii * GAP_FACTOR + num_st * len_radii * 2
+	len_radii = (max_pot - min_pot) / (num_st * (GAP_FACTOR + 2))
+
+We then calculate our dial frequencies as starting at .5g + r, and
+increasing by two radii and a gap:
+	.5g r1
+	.5g r1r g r2
+	.5g r1r g r2r g r3
+"""
+
+''' Number of pot ticks. '''
+POT_TICKS = 1024
+
+''' Volume tapers: pot position (0 - 1) to loudness (0 - 1). '''
+TAPERS = {
+	'linear': lambda x: x,
+	'log': lambda x: (10 ** (2 * x) - 1) / 99.,
+}
+
+''' Detuning curves: distance / tuning radius (0 - 1) to loudness (0 - 1). '''
+DETUNE_CURVES = {
+	'erf': lambda x: 0.5 * (1 + math.erf((1 - x) / 0.4)),
+	'linear': lambda x: 1 - x,
+	'none': lambda x: 1,
+}
+
+
+"""
+DialGeometry
+
+The station layout for a given number of stations and GAP_FACTOR,
+compiled into tables indexed by pot value (0 - 1023):
+
+	left[t]      nearest station frequency to the left (0 if none)
+	right[t]     nearest station frequency to the right (1023 if none)
+	station[t]   id of the station tuned to at t, or -1
+	distance[t]  distance from t to the nearest station frequency
+	attenuation[t]  volume percentage let through at t, by the
+	             detuning curve (0 when no station is tuned)
+
+Build these with geometry() so identical layouts are shared.
+"""
+class DialGeometry(object):
+
+	def __init__(self, num_stations, gap_factor, cutoff_bottom = 0, cutoff_top = 1023, detune_curve = 'erf'):
+		self.num_stations = num_stations
+		self.gap_factor = gap_factor
+		self.detune_curve = detune_curve
+		self.cutoff_bottom = cutoff_bottom
+		self.cutoff_top = cutoff_top
+
+		self.freq_list = []
+		if num_stations > 0:
+			self.radius = (cutoff_top - cutoff_bottom) / (num_stations * (gap_factor + 2))
+		else:
+			self.radius = 0
+		self.gap = self.radius * gap_factor
+
+		for t in range(0, num_stations, 1):
+			fr = cutoff_bottom + (0.5 * self.gap + self.radius) + \
+						t * (2 * self.radius + self.gap)
+			self.freq_list.append(int(fr))
+
+		self.left = array('h', [0]) * POT_TICKS
+		self.right = array('h', [0]) * POT_TICKS
+		self.station = array('h', [-1]) * POT_TICKS
+		self.distance = array('H', [0]) * POT_TICKS
+		self.attenuation = array('B', [0]) * POT_TICKS
+
+		self._compile()
+
+
+	def _compile(self):
+		"""
+		Fill the lookup tables with a single left-to-right sweep.
+		"""
+		freqs = self.freq_list
+		n = len(freqs)
+		idx = 0  # index of the first frequency >= t
+
+		for t in range(POT_TICKS):
+			while idx < n and freqs[idx] < t:
+				idx += 1
+
+			st_L = freqs[idx - 1] if idx > 0 else 0
+			st_R = freqs[idx] if idx < n else 1023
+			self.left[t] = st_L
+			self.right[t] = st_R
+
+			dist_L = t - st_L
+			dist_R = st_R - t
+
+			near = []
+			if idx > 0:
+				near.append(dist_L)
+			if idx < n:
+				near.append(dist_R)
+			self.distance[t] = min(near) if near else 0
+
+			if dist_L == dist_R:
+				continue
+			dist_closest = min(dist_L, dist_R)
+			if dist_closest > self.radius:
+				continue
+			if (dist_closest == dist_L) and (st_L != 0):
+				self.station[t] = idx - 1
+			elif (dist_closest == dist_R) and (st_R != 1023):
+				self.station[t] = idx
+			else:
+				continue
+
+			curve = DETUNE_CURVES[self.detune_curve]
+			self.attenuation[t] = to_percent(curve(dist_closest / self.radius))
+
+
+	def edges(self):
+		"""
+		Return the pot values where each station's tuning radius
+		starts and ends.
+		"""
+		edges = []
+		for fr in self.freq_list:
+			edges.append(int(math.ceil(fr - self.radius)))
+			edges.append(int(math.floor(fr + self.radius)) + 1)
+		return edges
+
+
+	def closest_freqs(self, tuning):
+		"""
+		Return the two station frequencies closest to 'tuning'.
+		"""
+		t = clamp(tuning)
+		return (self.left[t], self.right[t])
+
+
+	def station_at(self, tuning):
+		"""
+		Return the station id tuned to at 'tuning', or -1.
+		"""
+		return self.station[clamp(tuning)]
+
+
+	def tuned_to(self, tuning):
+		"""
+		Return the frequency of the station tuned to at 'tuning', or -1.
+		"""
+		sid = self.station[clamp(tuning)]
+		if sid == -1:
+			return -1
+		return self.freq_list[sid]
+
+# End of class DialGeometry
+
+
+def to_percent(x):
+	"""
+	Convert a 0 - 1 loudness to a whole percentage.
+	"""
+	return max(0, min(100, int(round(100 * x))))
+
+
+def volume_table(taper = 'linear'):
+	"""
+	Returns a table mapping pot value (0 - 1023) to mixer percentage.
+	"""
+	try:
+		return _volume_tables[taper]
+	except KeyError:
+		curve = TAPERS[taper]
+		table = array('B', [to_percent(curve(t / (POT_TICKS - 1.))) for t in range(POT_TICKS)])
+		_volume_tables[taper] = table
+		return table
+
+_volume_tables = {}
+
+
+def clamp(tuning):
+	"""
+	Clamp a pot value into the table range.
+	"""
+	if tuning < 0:
+		return 0
+	if tuning >= POT_TICKS:
+		return POT_TICKS - 1
+	return int(tuning)
+
+
+_cache = {}
+
+def geometry(num_stations, gap_factor, cutoff_bottom = 0, cutoff_top = 1023, detune_curve = 'erf'):
+	"""
+	Returns the DialGeometry for these settings, building it only if
+	the station count, gap factor or detuning curve has changed.
+	"""
+	key = (num_stations, gap_factor, cutoff_bottom, cutoff_top, detune_curve)
+	try:
+		return _cache[key]
+	except KeyError:
+		dial = DialGeometry(num_stations, gap_factor, cutoff_bottom, cutoff_top, detune_curve)
+		_cache.clear()
+		_cache[key] = dial
+		return dial
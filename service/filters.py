@@ -0,0 +1,224 @@
+import bisect
+
+from .ringbuffer import RingBuffer
+
+"""
+Pot filters.
+
+Each filter takes one raw pot value at a time and returns a filtered
+value:
+
+	val = flt.process(raw)
+
+Filters keep their history in preallocated buffers. Build a chain from a comma-separated
+spec with build_chain(), eg. 'median,ema,deadband'.
+"""
+
+
+"""
+EMAFilter
+
+Single-pole smoothing (exponential moving average).
+fac = 1 ignores old values, fac = 0 ignores new ones.
+"""
+class EMAFilter(object):
+
+	name = 'ema'
+
+	def __init__(self, fac = 0.8):
+		self.fac = fac
+		self.value = None
+
+	def reset(self):
+		self.value = None
+
+	def process(self, val):
+		if self.value is None:
+			self.value = float(val)
+		else:
+			self.value = self.fac * val + (1 - self.fac) * self.value
+		return int(self.value)
+
+# End of class EMAFilter
+
+
+"""
+MedianFilter
+
+Moving median over the last 'size' samples; removes single-sample spikes.
+The window is also kept sorted, so each sample is one insertion and one
+removal (by bisection) instead of a sort.
+"""
+class MedianFilter(object):
+
+	name = 'median'
+
+	def __init__(self, size = 5):
+		self.buf = RingBuffer(size)
+		self.window = []
+
+	def reset(self):
+		self.buf = RingBuffer(self.buf.size)
+		self.window = []
+
+	def process(self, val):
+		window = self.window
+		old = self.buf.push(val)
+		if old is not None:
+			del window[bisect.bisect_left(window, old)]
+		bisect.insort(window, val)
+		return window[len(window) // 2]
+
+# End of class MedianFilter
+
+
+"""
+HysteresisFilter
+
+Schmitt-style hysteresis.
+
+With 'edges' set (eg. the station edges on the tuning dial), the output
+will not cross an edge until the input has gone 'width' ticks past it;
+until then it is held on the near side of the edge.
+
+Without edges, the output only reverses direction once the input has
+moved 'width' ticks back.
+"""
+class HysteresisFilter(object):
+
+	name = 'hysteresis'
+
+	def __init__(self, width = 4, edges = ()):
+		self.width = width
+		self.set_edges(edges)
+		self.value = None
+		self.rising = True
+
+	def reset(self):
+		self.value = None
+		self.rising = True
+
+	def set_edges(self, edges):
+		self.edges = sorted(edges)
+
+	def process(self, val):
+		last = self.value
+		if last is None:
+			self.value = val
+			return val
+
+		if self.edges:
+			out = val
+			if val > last:
+				# First edge crossed on the way up
+				i = bisect.bisect_right(self.edges, last)
+				if i < len(self.edges):
+					e = self.edges[i]
+					if e <= val < e + self.width:
+						out = e - 1
+			elif val < last:
+				# First edge crossed on the way down
+				i = bisect.bisect_right(self.edges, last) - 1
+				if i >= 0:
+					e = self.edges[i]
+					if e - self.width < val < e:
+						out = e
+		else:
+			out = last
+			if self.rising:
+				if val > last:
+					out = val
+				elif last - val >= self.width:
+					out = val
+					self.rising = False
+			else:
+				if val < last:
+					out = val
+				elif val - last >= self.width:
+					out = val
+					self.rising = True
+
+		self.value = out
+		return out
+
+# End of class HysteresisFilter
+
+
+"""
+DeadbandFilter
+
+Ignores any change smaller than 'width' ticks.
+"""
+class DeadbandFilter(object):
+
+	name = 'deadband'
+
+	def __init__(self, width = 2):
+		self.width = width
+		self.value = None
+
+	def reset(self):
+		self.value = None
+
+	def process(self, val):
+		if self.value is None or abs(val - self.value) >= self.width:
+			self.value = val
+		return self.value
+
+# End of class DeadbandFilter
+
+
+"""
+FilterChain
+
+Runs a value through a list of filters, in order.
+"""
+class FilterChain(object):
+
+	def __init__(self, filters):
+		self.filters = list(filters)
+
+	def reset(self):
+		for flt in self.filters:
+			flt.reset()
+
+	def set_edges(self, edges):
+		"""
+		Pass dial edges on to any hysteresis filters.
+		"""
+		for flt in self.filters:
+			if isinstance(flt, HysteresisFilter):
+				flt.set_edges(edges)
+
+	def process(self, val):
+		for flt in self.filters:
+			val = flt.process(val)
+		return val
+
+	def __len__(self):
+		return len(self.filters)
+
+# End of class FilterChain
+
+
+def build_filter(name, options):
+	"""
+	Build one filter by name, with parameters from an OptionLoader.
+	"""
+	if name == 'ema':
+		return EMAFilter(options.fetch('POT_EMA_FAC'))
+	elif name == 'median':
+		return MedianFilter(options.fetch('POT_MEDIAN_LEN'))
+	elif name == 'hysteresis':
+		return HysteresisFilter(options.fetch('POT_HYSTERESIS'))
+	elif name == 'deadband':
+		return DeadbandFilter(options.fetch('POT_DEADBAND'))
+	raise ValueError("Unknown pot filter: " + str(name))
+
+
+def build_chain(spec, options):
+	"""
+	Build a FilterChain from a comma-separated list of filter names.
+	"""
+	names = [n.strip() for n in str(spec).split(',') if n.strip()]
+	return FilterChain([build_filter(n, options) for n in names])
@@ -0,0 +1,115 @@
+import logging, time
+
+"""
+IdleGovernor
+
+Steps the radio down through power states while nobody touches it,
+and snaps back to 'active' on the first knob movement.
+
+'levels' is a list of (state, seconds idle), in order, eg.
+
+	[('active', 0), ('idle', 30), ('sleep', 300)]
+
+Call touch() for every significant input. Functions registered with
+on_change() are called with the new state (and once, straight away,
+with the current one), so each part of the radio can set its own
+rates: sample slower, animate LEDs less often, stop redrawing the dial.
+
+Time spent in each state, and the process CPU time used in it, are
+kept for report().
+
+Runs on a service.reactor.Reactor: the only timer is one re-armed at
+the next step-down, so touch() is cheap enough to call on every event.
+"""
+class IdleGovernor(object):
+
+	def __init__(self, reactor, levels, cpu_clock = time.process_time):
+		self.reactor = reactor
+		self.levels = list(levels)
+		self.cpu_clock = cpu_clock
+
+		self.level = 0
+		self.state = self.levels[0][0]
+		self.listeners = []
+
+		''' {state: seconds} spent in each state, wall and CPU. '''
+		self.wall = dict((name, 0.0) for (name, after) in self.levels)
+		self.cpu = dict((name, 0.0) for (name, after) in self.levels)
+
+		self._last_touch = reactor.clock()
+		self._entered = self._last_touch
+		self._entered_cpu = cpu_clock()
+		self._timer = None
+		self._arm()
+
+
+	def on_change(self, func):
+		self.listeners.append(func)
+		func(self.state)
+
+
+	def _arm(self):
+		"""
+		Set the timer for the next step down, if there is one.
+		"""
+		self._timer = None
+		if self.level + 1 < len(self.levels):
+			when = self._last_touch + self.levels[self.level + 1][1]
+			self._timer = self.reactor.call_at(when, self._step_down)
+
+
+	def _account(self):
+		now = self.reactor.clock()
+		cpu = self.cpu_clock()
+		self.wall[self.state] += now - self._entered
+		self.cpu[self.state] += cpu - self._entered_cpu
+		self._entered = now
+		self._entered_cpu = cpu
+
+
+	def _set_level(self, level):
+		self._account()
+		self.level = level
+		self.state = self.levels[level][0]
+		logging.debug("[ Governor ] State: " + self.state)
+		for func in self.listeners:
+			func(self.state)
+
+
+	def _step_down(self):
+		# The timer may be stale if there was input since it was set.
+		# (Compare as _arm() does, or rounding can re-arm it for now.)
+		now = self.reactor.clock()
+		level = self.level
+		while level + 1 < len(self.levels) and now >= self._last_touch + self.levels[level + 1][1]:
+			level += 1
+		if level != self.level:
+			self._set_level(level)
+		self._arm()
+
+
+	def touch(self):
+		"""
+		There was input; go back to the first state.
+		"""
+		self._last_touch = self.reactor.clock()
+		if self.level != 0:
+			if self._timer is not None:
+				self._timer.cancel()
+			self._set_level(0)
+			self._arm()
+
+
+	def report(self):
+		"""
+		Time and CPU use per state.
+		"""
+		self._account()
+		lines = ["{:<8} {:>10} {:>10} {:>7}".format('state', 'wall s', 'cpu s', 'cpu %')]
+		for (name, after) in self.levels:
+			wall = self.wall[name]
+			lines.append("{:<8} {:>10.1f} {:>10.2f} {:>6.1f}%".format(
+					name, wall, self.cpu[name], 100 * self.cpu[name] / wall if wall > 0 else 0))
+		return '\n'.join(lines)
+
+# End of class IdleGovernor
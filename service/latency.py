@@ -0,0 +1,167 @@
+import bisect, functools, threading, time
+
+"""
+Latency instrumentation.
+
+Timings go into fixed-size histograms, by name, so recording costs the
+same after a week as after a minute and nothing grows:
+
+	latency.record('mpd_status', 0.0021)
+	latency.histogram('mpd_status').percentile(0.95)
+
+A station switch is followed from the knob to the speaker with a
+SwitchTrace, and its stages are recorded when audio starts:
+
+	sample_to_filter  ADC sample taken -> handed to the tuner's filters
+	                  (the sampler's threshold, and queueing)
+	filter_to_tuner   -> the filters pass it, and the tuner decides it's
+	                  on a new station
+	tuner_to_issue    -> activate_stream() is issued (sweep settling)
+	issue_to_play     -> MPD reports 'play' with an audio format
+	knob_to_audio     the whole thing
+
+MPD commands are recorded as 'mpd_<command>' (see radio.rmpd).
+"""
+
+''' Bucket upper bounds, in seconds; one more bucket holds the rest. '''
+BOUNDS = (0.001, 0.002, 0.003, 0.005, 0.007, 0.01, 0.015, 0.02, 0.03, 0.05, 0.07,
+		0.1, 0.15, 0.2, 0.3, 0.5, 0.7, 1.0, 1.5, 2.0, 3.0, 5.0, 7.0, 10.0)
+
+''' Stages of a SwitchTrace, in order. '''
+STAGES = ('sample', 'filter', 'tuner', 'issue', 'play')
+
+
+"""
+Histogram
+
+Counts of timings per bucket of BOUNDS, plus the count, total and
+worst. Percentiles are a bucket's upper bound (the worst, for the
+last bucket).
+"""
+class Histogram(object):
+	__slots__ = ('counts', 'count', 'total', 'worst')
+
+	def __init__(self):
+		self.counts = [0] * (len(BOUNDS) + 1)
+		self.count = 0
+		self.total = 0.0
+		self.worst = 0.0
+
+	def add(self, secs):
+		self.counts[bisect.bisect_left(BOUNDS, secs)] += 1
+		self.count += 1
+		self.total += secs
+		if secs > self.worst:
+			self.worst = secs
+
+	def mean(self):
+		return self.total / self.count if self.count else 0.0
+
+	def percentile(self, p):
+		if not self.count:
+			return 0.0
+		rank = p * self.count
+		seen = 0
+		for (i, n) in enumerate(self.counts):
+			seen += n
+			if n and seen >= rank:
+				return min(BOUNDS[i], self.worst) if i < len(BOUNDS) else self.worst
+		return self.worst
+
+# End of class Histogram
+
+
+"""
+SwitchTrace
+
+When each stage of one station switch happened (see STAGES), in
+monotonic time. Stages that weren't seen (eg. a switch made by
+start(), with no knob movement) are None.
+"""
+class SwitchTrace(object):
+	__slots__ = ('station',) + STAGES
+
+	def __init__(self, station, **marks):
+		self.station = station
+		for stage in STAGES:
+			setattr(self, stage, marks.get(stage))
+
+	def mark(self, stage, when):
+		setattr(self, stage, when)
+
+# End of class SwitchTrace
+
+
+"""
+LatencyRecorder
+
+Named histograms, safe to record into from any thread.
+'clock' is used by timed().
+"""
+class LatencyRecorder(object):
+
+	def __init__(self, clock = time.monotonic):
+		self.clock = clock
+		self.lock = threading.Lock()
+		self._hists = {}
+
+
+	def record(self, name, secs):
+		with self.lock:
+			hist = self._hists.get(name)
+			if hist is None:
+				hist = self._hists[name] = Histogram()
+			hist.add(secs)
+
+
+	def timed(self, name, func):
+		"""
+		Returns 'func' wrapped to record each call's time under 'name'.
+		"""
+		clock = self.clock
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			start = clock()
+			try:
+				return func(*args, **kwargs)
+			finally:
+				self.record(name, clock() - start)
+		return wrapper
+
+
+	def histogram(self, name):
+		"""
+		The Histogram for 'name', or None if nothing was recorded.
+		"""
+		return self._hists.get(name)
+
+
+	def names(self):
+		return sorted(self._hists.keys())
+
+
+	def finish(self, trace):
+		"""
+		Record the stages of a finished SwitchTrace.
+		"""
+		marks = [(stage, getattr(trace, stage)) for stage in STAGES]
+		marks = [m for m in marks if m[1] is not None]
+		for ((a, t0), (b, t1)) in zip(marks, marks[1:]):
+			self.record(a + '_to_' + b, t1 - t0)
+		if trace.sample is not None and trace.play is not None:
+			self.record('knob_to_audio', trace.play - trace.sample)
+
+
+	def report(self):
+		lines = ["{:<18} {:>6} {:>8} {:>8} {:>8} {:>8} {:>8}".format(
+				'timing', 'count', 'mean ms', 'p50', 'p95', 'p99', 'worst')]
+		with self.lock:
+			for name in sorted(self._hists.keys()):
+				h = self._hists[name]
+				lines.append("{:<18} {:>6} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f}".format(
+						name, h.count, 1000 * h.mean(),
+						1000 * h.percentile(0.5), 1000 * h.percentile(0.95),
+						1000 * h.percentile(0.99), 1000 * h.worst))
+		return '\n'.join(lines)
+
+# End of class LatencyRecorder
@@ -35,14 +35,20 @@ class Led(service.Service):
 	''' OptionsLoader instance '''
 	options = None
 
-	def __init__(self, queue, pin):
+	''' Frames per second for ongoing animations (eg. flicker). '''
+	frame_rate = 10.0
+
+	def __init__(self, queue, pin, options = None):
 		"""
 		Setup GPIO for this pin.
+		'options' is an OptionLoader; one is opened if it's omitted.
 		"""
 		self.pin = pin
 		GPIO.setup(self.pin, GPIO.OUT)
 
-		self.options = OL.OptionLoader('config.db')
+		if options is None:
+			options = OL.OptionLoader('config.db')
+		self.options = options
 
 		super().__init__(queue)
 
@@ -147,7 +153,15 @@ class Led(service.Service):
 			else:
 				dc = 100
 			self.pwm.ChangeDutyCycle(dc)
-			time.sleep(0.1)
+			time.sleep(1.0 / self.frame_rate)
+
+
+	def set_frame_rate(self, fps):
+		"""
+		Change how often ongoing animations update (eg. when idle).
+		"""
+		if fps > 0:
+			self.frame_rate = float(fps)
 
 
 	def blink(self):
@@ -0,0 +1,259 @@
+import abc, logging, random, subprocess, threading, time
+
+"""
+Volume mixers.
+
+A Mixer sets the output volume (as a percentage) through a persistent
+handle. Requests are handed to a worker thread and coalesced: if several
+arrive while one is being applied, only the last is sent. A request
+that fails is tried again, backing off, until it works or a newer one
+replaces it.
+
+	mixer.set_volume(40)
+	mixer.ramp(80, 0.5)     # glide to 80% over half a second
+"""
+
+''' Seconds between steps of a volume ramp. '''
+RAMP_STEP = 0.02
+
+''' Retry backoff for a volume that couldn't be set, in seconds: the
+first wait, and the longest. '''
+RETRY_MIN = 0.5
+RETRY_MAX = 30.0
+
+
+"""
+Mixer
+
+Base class; subclasses implement _apply(percent).
+"""
+class Mixer(abc.ABC):
+
+	name = 'mixer'
+
+	def __init__(self):
+		self.volume = -1
+
+		''' Counters: requests made, and requests actually applied. '''
+		self.requested = 0
+		self.applied = 0
+
+		self._cond = threading.Condition()
+		self._pending = None
+		self._ramp = None
+		self._quit = False
+
+		self._thread = threading.Thread(target = self._run)
+		self._thread.daemon = True
+		self._thread.start()
+
+
+	def set_volume(self, percent):
+		"""
+		Set the volume; the latest request wins, and a ramp in
+		progress is dropped.
+		"""
+		percent = max(0, min(100, int(percent)))
+		with self._cond:
+			self.requested += 1
+			self._pending = percent
+			self._ramp = None
+			self._cond.notify()
+
+
+	def ramp(self, percent, duration, start = None):
+		"""
+		Glide to 'percent' over 'duration' seconds, from 'start' (by
+		default the volume last asked for, or silence if that isn't
+		known). A later set_volume() or ramp() replaces it.
+		"""
+		percent = max(0, min(100, int(percent)))
+		if duration <= 0:
+			self.set_volume(percent)
+			return
+		with self._cond:
+			if start is None:
+				start = self._pending if self._pending is not None else max(0, self.volume)
+			self.requested += 1
+			self._pending = None
+			self._ramp = (start, percent, time.monotonic(), duration)
+			self._cond.notify()
+
+
+	def _next_value(self):
+		"""
+		Returns the next volume to apply, and how long to wait after it
+		(None if there's nothing more to do). Called with the condition held.
+		"""
+		if self._pending is not None:
+			val = self._pending
+			self._pending = None
+			return (val, None)
+
+		(start, end, t0, duration) = self._ramp
+		frac = (time.monotonic() - t0) / duration
+		if frac >= 1:
+			self._ramp = None
+			return (end, None)
+		return (int(round(start + (end - start) * frac)), RAMP_STEP)
+
+
+	def _run(self):
+		retry = RETRY_MIN
+		while True:
+			with self._cond:
+				while not self._quit and self._pending is None and self._ramp is None:
+					self._cond.wait()
+				if self._quit:
+					return
+				(val, wait) = self._next_value()
+
+			if val != self.volume:
+				try:
+					self._apply(val)
+					self.volume = val
+					self.applied += 1
+					retry = RETRY_MIN
+				except Exception as e:
+					msg = "[ Mixer ] " + self.name + ": can't set volume: " + str(e)
+					if retry == RETRY_MIN:
+						logging.error(msg)
+					else:
+						logging.debug(msg)
+					retry = min(RETRY_MAX, retry * 2)
+					if self._ramp is None:
+						# Try again later, unless a newer request (or close()) comes first
+						with self._cond:
+							if self._pending is None:
+								self._pending = val
+								self._cond.wait(random.uniform(retry / 4, retry / 2))
+						continue
+
+			if wait:
+				with self._cond:
+					# A newer request (or close()) ends the step early
+					if self._pending is None and not self._quit:
+						self._cond.wait(wait)
+
+
+	@abc.abstractmethod
+	def _apply(self, percent):
+		"""
+		Set the hardware's volume to 'percent' (0 - 100) now. Raises
+		any exception if it can't.
+		"""
+
+
+	def close(self):
+		with self._cond:
+			self._quit = True
+			self._cond.notify()
+		self._thread.join(1)
+
+# End of class Mixer
+
+
+"""
+NullMixer
+
+Remembers the volume but doesn't touch any hardware.
+For simulation, replays and benchmarks.
+"""
+class NullMixer(Mixer):
+
+	name = 'null'
+
+	def _apply(self, percent):
+		pass
+
+# End of class NullMixer
+
+
+"""
+AmixerMixer
+
+Keeps one 'amixer -s' process running and feeds it commands on stdin,
+instead of starting a shell for every change.
+"""
+class AmixerMixer(Mixer):
+
+	name = 'amixer'
+
+	def __init__(self, control = 'numid=1', sudo = True):
+		self.control = control
+		self.cmd = ['amixer', '-q', '-s']
+		if sudo:
+			self.cmd = ['sudo'] + self.cmd
+		self.proc = None
+		super().__init__()
+
+
+	def _open(self):
+		self.proc = subprocess.Popen(self.cmd,
+					stdin = subprocess.PIPE,
+					stdout = subprocess.DEVNULL,
+					universal_newlines = True)
+
+
+	def _apply(self, percent):
+		line = "cset {} {}%\n".format(self.control, percent)
+		for attempt in range(2):
+			if self.proc is None or self.proc.poll() is not None:
+				self._open()
+			try:
+				self.proc.stdin.write(line)
+				self.proc.stdin.flush()
+				return
+			except (BrokenPipeError, OSError):
+				self.proc = None
+		raise IOError("amixer is not accepting commands")
+
+
+	def close(self):
+		super().close()
+		if self.proc is not None:
+			try:
+				self.proc.stdin.close()
+				self.proc.wait(1)
+			except (OSError, subprocess.TimeoutExpired):
+				self.proc.kill()
+			self.proc = None
+
+# End of class AmixerMixer
+
+
+"""
+MPDMixer
+
+Sets the volume with 'setvol' on the StreamManager's active server,
+over its existing connection. The StreamManager keeps it, and sets it
+on each server it switches to.
+"""
+class MPDMixer(Mixer):
+
+	name = 'mpd'
+
+	def __init__(self, stream_manager):
+		self.str_man = stream_manager
+		super().__init__()
+
+
+	def _apply(self, percent):
+		self.str_man.set_volume(percent)
+
+# End of class MPDMixer
+
+
+def open_mixer(options, stream_manager = None):
+	"""
+	Returns the Mixer named by the MIXER_BACKEND option.
+	The 'mpd' backend needs a stream manager.
+	"""
+	backend = options.fetch('MIXER_BACKEND')
+	if backend == 'null':
+		return NullMixer()
+	elif backend == 'mpd':
+		if stream_manager is None:
+			raise ValueError("The mpd mixer needs a StreamManager")
+		return MPDMixer(stream_manager)
+	return AmixerMixer(options.fetch('MIXER_CONTROL'))
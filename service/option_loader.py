@@ -1,4 +1,4 @@
-import sqlite3
+import sqlite3, zlib
 from . import config_defaults
 
 """
@@ -14,7 +14,14 @@ class OptionLoader(object):
 	def __init__(self, db_name):
 		self._config = {}
 		self._db_name = db_name
+		self.reload()
 
+
+	def reload(self):
+		"""
+		(Re-)read every option from the database.
+		"""
+		config = {}
 		try:
 			conn = sqlite3.connect(self._db_name)
 			with conn:
@@ -42,10 +49,12 @@ class OptionLoader(object):
 					else:
 						opt_val = str(opt_val_u)
 
-					self._config[opt_name] = opt_val
+					config[opt_name] = opt_val
 		except sqlite3.OperationalError:
 			raise
 
+		self._config = config
+
 
 	def option_exists(self, opt_name):
 		"""
@@ -77,11 +86,12 @@ class OptionLoader(object):
 	def fetch(self, opt_name):
 		"""
 		Look up an option by name.
+		Options missing from the database fall back to their default.
 		"""
 		try:
 			return self._config[opt_name]
 		except KeyError:
-			return ''
+			return self.default(opt_name)
 
 
 	def val_type_ok(self, opt_name, opt_value):
@@ -132,3 +142,58 @@ class OptionLoader(object):
 
 #End of OptionLoader class
 
+
+"""
+ConfigWatcher
+
+Notices changes to the config database made by other connections
+(eg. the web server), without re-reading it on every check.
+
+SQLite bumps 'PRAGMA data_version' whenever another connection commits;
+only then are the watched tables checksummed to see which changed.
+"""
+class ConfigWatcher(object):
+
+	tables = ('options', 'playlists')
+
+	def __init__(self, db_name):
+		self._conn = sqlite3.connect(db_name, check_same_thread = False)
+		self._version = self._data_version()
+		self._sums = dict((t, self.checksum(t)) for t in self.tables)
+
+
+	def _data_version(self):
+		return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+
+	def checksum(self, table):
+		"""
+		A checksum of a table's contents (stable between runs).
+		"""
+		rows = self._conn.execute("SELECT * FROM " + table).fetchall()
+		return zlib.crc32(repr(rows).encode('UTF-8'))
+
+
+	def changes(self):
+		"""
+		Returns the set of watched tables changed since the last call.
+		"""
+		version = self._data_version()
+		if version == self._version:
+			return set()
+		self._version = version
+
+		changed = set()
+		for t in self.tables:
+			s = self.checksum(t)
+			if s != self._sums[t]:
+				self._sums[t] = s
+				changed.add(t)
+		return changed
+
+
+	def close(self):
+		self._conn.close()
+
+#End of ConfigWatcher class
+
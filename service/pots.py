@@ -1,16 +1,36 @@
-import RPi.GPIO as GPIO
-import os, math
+import math
 from . import option_loader as OL
+from . import adc as ADC
+from . import dial
+from . import filters as FLT
+from . import mixer as MX
+
+"""
+PotEvent
+
+Returned by PotReader.read_pot() (and passed to callbacks)
+when a pot value has changed.
+"""
+class PotEvent(object):
+	__slots__ = ('reader', 'value', 'is_new_station')
+
+	def __init__(self, reader, value, is_new_station = False):
+		self.reader = reader
+		self.value = value
+		self.is_new_station = is_new_station
+
 
 """
 PotChange
 
-PotReader classes can raise this.
+PotReader classes raise this instead of returning a PotEvent
+when their 'raise_changes' flag is set.
 Catch it to act on a changed pot value.
 """
 class PotChange(Exception):
-	def __init__(self, is_new_station = False):
+	def __init__(self, is_new_station = False, event = None):
 		self.is_new_station = is_new_station
+		self.event = event
 
 
 
@@ -20,7 +40,8 @@ PotReader
 A general hardware class that reads from a pot and updates an internal
 variable with its value.
 
-The function 'self.update()' stores the pot value last read.
+The function 'self.update()' stores the pot value last read, and
+returns a PotEvent if it changed (or None if it didn't).
 
 Instances of this class can override 'self.update()' to do more
 with the read value.
@@ -45,138 +66,126 @@ class PotReader(object):
 	"""
 	smooth_fac = 0.8
 
-	''' Use a SPI interface instead of the ADC. '''
-	use_spi = False
+	''' A service.filters.FilterChain; if empty, smooth_fac is used instead. '''
+	filters = None
 
-	''' The SPI device object. '''
-	spi = False
+	''' The ADC backend (see service.adc), shared between readers. '''
+	adc = None
 
 	''' OptionLoader instance '''
 	options = None
 
-	def __init__(self, pin):
+	''' Set to True to raise PotChange instead of returning events (old API). '''
+	raise_changes = False
+
+	''' Functions called with each PotEvent. '''
+	callbacks = None
+
+	def __init__(self, pin, adc = None, options = None):
 		"""
 		Sets the pin to use.
+
+		Pass the same 'adc' to every reader so the hardware is only
+		setup once; if it's omitted, one is opened from config.db.
+		Likewise 'options', an OptionLoader.
 		"""
-		GPIO.setwarnings(False)
+		if options is None:
+			options = OL.OptionLoader('config.db')
+		self.options = options
 
-		GPIO.setmode(GPIO.BCM)
+		if adc is None:
+			adc = ADC.open_adc(self.options)
+		self.adc = adc
 
-		self.options = OL.OptionLoader('config.db')
+		self.pot_pin = pin
+		self.callbacks = []
 
-		GPIO.setup(self.options.fetch('SPIMOSI'), GPIO.OUT)
-		GPIO.setup(self.options.fetch('SPIMISO'), GPIO.IN)
-		GPIO.setup(self.options.fetch('SPICLK'), GPIO.OUT)
-		GPIO.setup(self.options.fetch('SPICS'), GPIO.OUT)
+	def add_callback(self, func):
+		"""
+		Call 'func(event)' for every PotEvent this reader produces.
+		"""
+		self.callbacks.append(func)
 
-		self.pot_pin = pin
 
-		# We don't use SPI, so we'll just deprecate this.
-		#
-		# if self.options.fetch('ENABLE_SPI'):
-		#	self.enable_spi()
+	def remove_callback(self, func):
+		try:
+			self.callbacks.remove(func)
+		except ValueError:
+			pass
+
+
+	def set_filters(self, spec):
+		"""
+		Filter read values through a chain built from 'spec',
+		eg. 'median,ema' (see service.filters).
+		"""
+		self.filters = FLT.build_chain(spec, self.options)
+
 
 	def update(self, pot_val):
 		"""
 		Store the pot value.
 		"""
+		if pot_val == self.last_read:
+			return None
 		self.last_read = pot_val
-		raise PotChange
+		return PotEvent(self, pot_val)
 
 
 	def enable_spi(self):
 		"""
-		Use a SPI interface instead of the ADC.
-		If this fails, it will fallback to the ADC.
+		Use a SPI interface instead of bit-banging the ADC.
+		If this fails, the current backend is kept.
 		"""
 		try:
-			import spidev
-			self.spi = spidev.SpiDev()
-			self.use_spi = True
+			self.adc = ADC.SpiADC(self.options.fetch('SPI_BUS'),
+						self.options.fetch('SPI_DEVICE'),
+						self.options.fetch('SPI_SPEED_HZ'),
+						self.options.fetch('ADC_OVERSAMPLE'))
 			return True
-		except:
-			self.disable_spi()
+		except (ImportError, IOError, OSError):
 			return False
 
 
 	def disable_spi(self):
 		"""
-		Turns off the SPI hooks.
+		Go back to bit-banging the ADC.
 		"""
-		self.spi = False
-		self.use_spi = False
+		self.adc = ADC.BitBangADC(self.options.fetch('SPICLK'),
+					self.options.fetch('SPIMOSI'),
+					self.options.fetch('SPIMISO'),
+					self.options.fetch('SPICS'),
+					self.options.fetch('ADC_OVERSAMPLE'))
 
 
-	def _readadc(self, adcnum, clockpin, mosipin, misopin, cspin):
-		"""
-		Reads SPI data from the MCP3008 chip, 8 possible ADC's (0 - 7)
-		From adafruit.com
+	def read_pot(self, pot_read = None):
 		"""
-		if ((adcnum > 7) or (adcnum < 0)):
-			return -1
-		GPIO.output(cspin, True)
-
-		GPIO.output(clockpin, False)  # start clock low
-		GPIO.output(cspin, False)     # bring CS low
-
-		commandout = adcnum
-		commandout |= 0x18  # start bit + single-ended bit
-		commandout <<= 3    # we only need to send 5 bits here
-		for i in range(5):
-			if (commandout & 0x80):
-				GPIO.output(mosipin, True)
-			else:
-				GPIO.output(mosipin, False)
-			commandout <<= 1
-			GPIO.output(clockpin, True)
-			GPIO.output(clockpin, False)
-
-		adcout = 0
-		# read in one empty bit, one null bit and 10 ADC bits
-		for i in range(12):
-			GPIO.output(clockpin, True)
-			GPIO.output(clockpin, False)
-			adcout <<= 1
-			if (GPIO.input(misopin)):
-				adcout |= 0x1
-
-		GPIO.output(cspin, True)
-		
-		adcout >>= 1       # first bit is 'null' so drop it
-
-		return adcout
+		Reads a pot value from a pot and calculate a smoothed average.
 
+		If 'pot_read' is given, it is used as the raw value instead of
+		reading the ADC (see read_pots()).
 
-	def _readspi(self, channel):
-		"""
-		Reads SPI data over the SPI bus,
-		and not through the MCP3008 chip.
+		Returns a PotEvent if the reader changed, otherwise None.
 		"""
-		adc = self.spi.xfer2([1,(8+channel)<<4,0])
-		data = ((adc[1]&3) << 8) + adc[2]
-		return data
-
+		if pot_read is None:
+			pot_read = self.adc.read(self.pot_pin)
 
-	def read_pot(self):
-		"""
-		Reads a pot value from a pot and calculate a smoothed average.
-		"""
-		if self.use_spi:
-			print("USING SPI")
-			pot_read = self._readspi(self.pot_pin)
+		if self.filters:
+			smoothed_read = self.filters.process(pot_read)
 		else:
-			pot_read = self._readadc(self.pot_pin, self.options.fetch('SPICLK'), self.options.fetch('SPIMOSI'), self.options.fetch('SPIMISO'), self.options.fetch('SPICS'))
+			smoothed_read = int(self.smooth_fac * pot_read + (1 - self.smooth_fac) * self.last_read)
+		event = self.update(smoothed_read)
+		self.last_read = smoothed_read
 
-#		if len(self.buffer_vals) > self.buffer_len:
-#			self.buffer_vals.pop(0)
-#		self.buffer_vals.append(pot_read)
-#		avg_read = reduce(lambda x, y: x + y, self.buffer_vals) / len(self.buffer_vals)
-#		self.update(avg_read)
-#		return avg_read
+		if event is None:
+			return None
 
-		smoothed_read = int(self.smooth_fac * pot_read + (1 - self.smooth_fac) * self.last_read)
-		self.update(smoothed_read)
-		return smoothed_read
+		for func in self.callbacks:
+			func(event)
+
+		if self.raise_changes:
+			raise PotChange(event.is_new_station, event)
+		return event
 
 # End of class PotReader
 
@@ -185,6 +194,9 @@ class PotReader(object):
 TunerPotReader
 
 This extends PotReader.
+
+The dial layout lives in a service.dial.DialGeometry, so every tuning
+query is a table lookup by pot value.
 """
 class TunerPotReader(PotReader):
 
@@ -210,6 +222,11 @@ class TunerPotReader(PotReader):
 	"""
 	freq_list = []
 
+	"""
+	The compiled dial (see service.dial)
+	"""
+	dial = None
+
 	"""
 	The current tuning
 	"""
@@ -226,46 +243,64 @@ class TunerPotReader(PotReader):
 	cutoff_bottom = 0
 	cutoff_top = 1023
 
-	def __init__(self, pin, num_stations):
-		super(TunerPotReader, self).__init__(pin)
+	def __init__(self, pin, num_stations, adc = None, options = None):
+		super(TunerPotReader, self).__init__(pin, adc, options)
 
 		self.pot_pin = pin
 
-		self.num_stations = num_stations
+		self.set_stations(num_stations)
+
 
+	def set_stations(self, num_stations):
+		"""
+		Lay out the dial for 'num_stations' stations.
+		The tables are only rebuilt if the station count or
+		GAP_FACTOR has changed.
 		"""
-		We setup our dial with each station's tuning in an interval of radius
-		elf.cfg_st_radius, separated by a gap of size self.cfg_st_gap.
+		self.num_stations = num_stations
+		self.dial = dial.geometry(num_stations,
+					self.options.fetch('GAP_FACTOR'),
+					self.cutoff_bottom,
+					self.cutoff_top,
+					self.options.fetch('DETUNE_CURVE'))
+
+		self.cfg_st_radius = self.dial.radius
+		self.cfg_st_gap = self.dial.gap
+		self.freq_list = self.dial.freq_list
+
+		if self.filters:
+			self.filters.set_edges(self.dial.edges())
 
-		For three stations, the dial will be separated as:
-			.5g r1r g r2r g r3r .5g,
-		where g marks an untuned gap, and r is a tuned radius.
-		So then
-			num_gaps = num_st,
-			num_radii = 2 * num_st.
 
-		The gaps will be of length
-			len_gaps = GAP_FACTOR * len_radii.
+	def set_filters(self, spec):
+		"""
+		As PotReader.set_filters(), with any hysteresis
+		held around the station edges.
+		"""
+		super(TunerPotReader, self).set_filters(spec)
+		self.filters.set_edges(self.dial.edges())
 
-		We solve then
-			(max_pot - min_pot) = num_gaps * len_gaps + num_radii * len_radii
-			(max_pot - min_pot) = num_st * len_radii * GAP_FACTOR + num_st * len_radii * 2
-			len_radii = (max_pot - min_pot) / (num_st * (GAP_FACTOR + 2))
 
-		We then calculate our dial frequencies as starting at .5g + r, and
-		increasing by two radii and a gap:
-			.5g r1
-			.5g r1r g r2
-			.5g r1r g r2r g r3
+	def retune(self):
 		"""
-		num_st = self.num_stations
-		self.cfg_st_radius = (self.cutoff_top - self.cutoff_bottom) / (num_st * (self.options.fetch('GAP_FACTOR') + 2))
-		self.cfg_st_gap = self.cfg_st_radius * self.options.fetch('GAP_FACTOR')
+		Forget the current tuning and station, so the next read
+		is treated as a fresh tuning (eg. after set_stations()).
+		"""
+		self.tuning = -1
+		self.SID = -1
+
 
-		for t in range(0, self.num_stations, 1):
-			fr = self.cutoff_bottom + (0.5 * self.cfg_st_gap + self.cfg_st_radius) + \
-							t * (2 * self.cfg_st_radius + self.cfg_st_gap)
-			self.freq_list.append(int(fr))
+	def refresh(self, current_sid = -1):
+		"""
+		Re-evaluate the current tuning (eg. after set_stations()).
+		'current_sid' is the station already playing, so staying tuned
+		to it isn't reported as a new station.
+		Returns a PotEvent as update() does.
+		"""
+		tuning = self.tuning
+		self.tuning = -1
+		self.SID = current_sid
+		return self.update(tuning)
 
 
 	def get_closest_freqs(self):
@@ -273,21 +308,7 @@ class TunerPotReader(PotReader):
 		Return the two station frequencies closest to
 		the current tuning.
 		"""
-		# We temporarily insert the current tuning to sort the list
-		# and pick out the left-most and right-most frequencies.
-		self.freq_list.append(self.tuning)
-		self.freq_list.sort()
-		idx = self.freq_list.index(self.tuning)
-		if (idx == 0):
-			st_L = 0
-		else:
-			st_L = self.freq_list[idx-1]
-		if (idx == len(self.freq_list) - 1):
-			st_R = 1023
-		else:
-			st_R = self.freq_list[idx+1]
-		self.freq_list.remove(self.tuning)
-		return (st_L,st_R)
+		return self.dial.closest_freqs(self.tuning)
 
 
 	def tuned_to(self):
@@ -295,54 +316,47 @@ class TunerPotReader(PotReader):
 		Returns the station the radio is tuned to.
 		If no station is tuned, then returns -1 and sets self.SID to -1.
 		""" 
-		(st_L, st_R) = self.get_closest_freqs()
-
-		dist_L = self.tuning - st_L
-		dist_R = st_R - self.tuning
-
-		if (dist_L == dist_R):
-			self.SID = -1
-			return -1 
-
-		dist_closest = min(dist_L, dist_R)
-		if (dist_closest > self.cfg_st_radius):
+		fr = self.dial.tuned_to(self.tuning)
+		if fr == -1:
 			self.SID = -1
-			return -1
-		else:
-			if (dist_closest == dist_L) and (st_L != 0):
-				return st_L
-			elif (dist_closest == dist_R) and (st_R != 1023):
-				return st_R
-			else:
-				self.SID = -1
-				return -1
+		return fr
 
 
 	def is_tuned(self):
 		"""
 		Returns a bool to indicate if we're tuned to a station or not.
 		"""
-		return (self.tuned_to() != -1)
+		return (self.dial.station_at(self.tuning) != -1)
+
+
+	def attenuation(self):
+		"""
+		Returns the volume percentage (0 - 100) let through
+		at the current tuning.
+		"""
+		return self.dial.attenuation[dial.clamp(self.tuning)]
 
 
 	def update(self, tuning):
 		"""
 		Updates the tuning.
-		If the radio is tuned to a station, raises a PotChange exception
+		Returns a PotEvent if the tuning moved; 'is_new_station' is set
+		when the radio has just tuned into a station.
 		"""
+		if tuning == self.tuning:
+			return None
 
 		self.tuning = tuning
 
-		if self.is_tuned():
-			new_station_id = self.freq_list.index(self.tuned_to())
-
+		new_station_id = self.dial.station_at(tuning)
+		if new_station_id == -1:
+			self.SID = -1
+		elif new_station_id != self.SID:
 			# New station
-			if new_station_id != self.SID:
-				self.SID = new_station_id
-				raise PotChange(is_new_station = True)
-
+			self.SID = new_station_id
+			return PotEvent(self, tuning, True)
 
-		raise PotChange(is_new_station = False)
+		return PotEvent(self, tuning)
 
 # End of class TunerKnob
 
@@ -357,7 +371,8 @@ set by tuning distance.
 
 The pot volume is still stored as-read even if the cap limits it.
 
-This uses the default PotReader init-function: __init__(self, pin).
+The volume is set through a service.mixer.Mixer; by default the one
+named by the MIXER_BACKEND option.
 """
 class VolumePotReader(PotReader):
 	"""
@@ -371,6 +386,40 @@ class VolumePotReader(PotReader):
 	"""
 	volume_cap = 0
 
+	"""
+	The Mixer that volumize() sets
+	"""
+	mixer = None
+
+	"""
+	Maps pot values to mixer percentages (see service.dial.volume_table)
+	"""
+	taper = None
+
+	def __init__(self, pin, adc = None, mixer = None, options = None):
+		super(VolumePotReader, self).__init__(pin, adc, options)
+
+		if mixer is None:
+			mixer = MX.open_mixer(self.options)
+		self.mixer = mixer
+
+		self.set_taper(self.options.fetch('VOL_TAPER'))
+
+
+	def set_taper(self, taper):
+		"""
+		Map pot values to the mixer through 'taper' (a VOL_TAPER
+		choice); the volume isn't set again until the next volumize().
+		"""
+		self.taper = dial.volume_table(taper)
+
+
+	def percent(self, volume):
+		"""
+		Returns the mixer percentage for a pot volume.
+		"""
+		return self.taper[dial.clamp(volume)]
+
 
 	def get_volume(self):
 		"""
@@ -383,19 +432,45 @@ class VolumePotReader(PotReader):
 		"""
 		Updates internal volume variable, and sets volume.
 		"""
-		if (int(round(volume/10.24)) != int(round(self.volume/10.24))):
+		if self.percent(volume) != self.percent(self.volume):
 			self.volume = volume + 5
 			self.volumize(self.get_volume())
-			raise PotChange
+			return PotEvent(self, volume)
+		return None
 
 
-	def volumize(self, volume):
+	def volumize(self, volume, ramp = 0):
 		"""
-		Sets OS volume
+		Sets OS volume, gliding there over 'ramp' seconds if it's given
 		"""
-		set_volume = int(round(volume / 10.24))
-		set_vol_cmd = 'sudo amixer cset numid=1 -- {volume}% > /dev/null' . format(volume = set_volume)
-		os.system(set_vol_cmd)
+		if ramp > 0:
+			self.mixer.ramp(self.percent(volume), ramp)
+		else:
+			self.mixer.set_volume(self.percent(volume))
 
 # End of class VolumeKnob
 
+
+def feed_pot(reader, pot_read):
+	"""
+	Feeds an already-sampled value through 'reader'.
+	Returns the PotEvent, or None if nothing changed.
+	"""
+	try:
+		return reader.read_pot(pot_read)
+	except PotChange as pot_notif:
+		return pot_notif.event
+
+
+def read_pots(*readers):
+	"""
+	Samples every reader's pot in one ADC transaction, then feeds each
+	value through its reader's read_pot().
+
+	All readers must share the same adc. Returns the PotEvent from
+	each reader, in the same order as 'readers' (None if no change).
+	"""
+	adc = readers[0].adc
+	vals = adc.read_channels([r.pot_pin for r in readers])
+
+	return [feed_pot(r, val) for (r, val) in zip(readers, vals)]
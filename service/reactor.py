@@ -0,0 +1,181 @@
+import heapq, itertools, logging, queue, time
+
+"""
+Timer
+
+A callback scheduled on a Reactor. Keep it to cancel() it later.
+"""
+class Timer(object):
+	__slots__ = ('when', 'interval', 'func', 'args', 'cancelled')
+
+	def __init__(self, when, interval, func, args):
+		self.when = when
+		self.interval = interval
+		self.func = func
+		self.args = args
+		self.cancelled = False
+
+	def cancel(self):
+		self.cancelled = True
+
+# End of class Timer
+
+
+"""
+Reactor
+
+A single event loop for the radio.
+
+Event sources (the pot sampler, the web server, MPD watchers...) post
+tuples of (kind, args...) onto one queue from any thread; handlers for
+each kind run on the reactor's thread. Timers run at monotonic
+deadlines. Between events and deadlines the loop blocks, so an idle
+radio uses no CPU and an event is handled as soon as it arrives.
+A handler or timer that raises is logged, and the loop carries on.
+
+	reactor.on('pot', on_pot)
+	reactor.call_later(10, power_off)
+	reactor.run()
+"""
+class Reactor(object):
+
+	def __init__(self, clock = time.monotonic):
+		self.queue = queue.Queue()
+		self.clock = clock
+
+		self._handlers = {'wakeup': []}
+		self._timers = []
+		self._seq = itertools.count()
+		self._stopped = False
+
+
+	def on(self, kind, func):
+		"""
+		Call 'func(*args)' for every event of this kind.
+		"""
+		self._handlers.setdefault(kind, []).append(func)
+
+
+	def post(self, kind, *args):
+		"""
+		Queue an event. Safe to call from any thread.
+		"""
+		self.queue.put((kind,) + args)
+
+
+	def call_at(self, when, func, *args):
+		"""
+		Run 'func(*args)' at monotonic time 'when'.
+		"""
+		timer = Timer(when, 0, func, args)
+		heapq.heappush(self._timers, (when, next(self._seq), timer))
+		return timer
+
+
+	def call_later(self, delay, func, *args):
+		return self.call_at(self.clock() + delay, func, *args)
+
+
+	def call_every(self, interval, func, *args):
+		"""
+		Run 'func(*args)' every 'interval' seconds until cancelled.
+		"""
+		timer = Timer(self.clock() + interval, interval, func, args)
+		heapq.heappush(self._timers, (timer.when, next(self._seq), timer))
+		return timer
+
+
+	def next_deadline(self):
+		"""
+		The time of the next live timer, or None.
+		"""
+		while self._timers and self._timers[0][2].cancelled:
+			heapq.heappop(self._timers)
+		if self._timers:
+			return self._timers[0][0]
+		return None
+
+
+	def dispatch(self, item):
+		kind = item[0]
+		handlers = self._handlers.get(kind)
+		if handlers is None:
+			logging.debug("[ Reactor ] Unhandled event: " + str(kind))
+			return
+		for func in handlers:
+			try:
+				func(*item[1:])
+			except Exception:
+				# One bad event mustn't stop the radio's only control loop
+				logging.exception("[ Reactor ] Handler for '" + str(kind) + "' event failed")
+
+
+	def run_timers(self):
+		"""
+		Run every timer that is due.
+		"""
+		now = self.clock()
+		while True:
+			deadline = self.next_deadline()
+			if deadline is None or deadline > now:
+				return
+			(when, seq, timer) = heapq.heappop(self._timers)
+			if timer.interval:
+				timer.when = when + timer.interval
+				if timer.when <= now:
+					timer.when = now + timer.interval
+				heapq.heappush(self._timers, (timer.when, next(self._seq), timer))
+			try:
+				timer.func(*timer.args)
+			except Exception:
+				logging.exception("[ Reactor ] Timer " + getattr(timer.func, '__qualname__', repr(timer.func)) + " failed")
+
+
+	def run_once(self):
+		"""
+		Wait for one event (or the next deadline) and handle it.
+		"""
+		deadline = self.next_deadline()
+		if deadline is None:
+			timeout = None
+		else:
+			timeout = max(0, deadline - self.clock())
+
+		try:
+			item = self.queue.get(timeout = timeout)
+		except queue.Empty:
+			item = None
+
+		if item is not None:
+			self.dispatch(item)
+		self.run_timers()
+
+
+	def run_pending(self):
+		"""
+		Handle every event already queued, without waiting.
+		Returns False once stop() has been called.
+		"""
+		while True:
+			try:
+				item = self.queue.get_nowait()
+			except queue.Empty:
+				break
+			self.dispatch(item)
+		return not self._stopped
+
+
+	def run(self):
+		self._stopped = False
+		while not self._stopped:
+			self.run_once()
+
+
+	def stop(self):
+		"""
+		Stop run() once the current event is handled.
+		"""
+		self._stopped = True
+		self.post('wakeup')
+
+# End of class Reactor
@@ -0,0 +1,58 @@
+from array import array
+
+"""
+Ring buffers of samples, for the pot sampler (service.sampler) and
+filters (service.filters).
+"""
+
+
+"""
+RingBuffer
+
+A fixed-size, preallocated buffer of ADC samples (0 - 65535) for one
+channel. Keeps a running sum so the mean is O(1).
+"""
+class RingBuffer(object):
+
+	def __init__(self, size):
+		self.size = max(1, int(size))
+		self.buf = array('H', [0]) * self.size
+		self.pos = 0
+		self.count = 0
+		self.total = 0
+
+	def push(self, val):
+		"""
+		Store a sample, overwriting the oldest one when full.
+		Returns the sample overwritten, or None.
+		"""
+		old = None
+		if self.count == self.size:
+			old = self.buf[self.pos]
+			self.total -= old
+		else:
+			self.count += 1
+		self.buf[self.pos] = val
+		self.total += val
+		self.pos += 1
+		if self.pos == self.size:
+			self.pos = 0
+		return old
+
+	def mean(self):
+		if self.count == 0:
+			return 0
+		return self.total // self.count
+
+	def latest(self):
+		return self.buf[self.pos - 1]
+
+	def values(self):
+		"""
+		Returns the stored samples, oldest first.
+		"""
+		if self.count < self.size:
+			return self.buf[:self.count].tolist()
+		return (self.buf[self.pos:] + self.buf[:self.pos]).tolist()
+
+# End of class RingBuffer
@@ -0,0 +1,280 @@
+import logging, multiprocessing, queue, signal, struct, time
+
+from . import service
+from .ringbuffer import RingBuffer
+
+''' Backoff of a SharedPotBlock reader while the block is being
+written, in seconds: the first wait, and the longest. '''
+READ_RETRY_MIN = 0.00005
+READ_RETRY_MAX = 0.01
+
+"""
+PotSampler
+
+A service thread that samples a set of ADC channels at a fixed rate.
+
+Each sample goes into that channel's RingBuffer. When the buffered mean
+moves by at least 'threshold' ticks from the last value published, a
+('pot', channel, value, timestamp) tuple is put on 'event_queue'
+(eg. a service.reactor.Reactor's queue).
+
+Timestamps come from time.monotonic().
+
+Commands (through the service queue):
+	'set_rate', hz
+	'quit'
+"""
+class PotSampler(service.Service):
+
+	''' Samples per second, per channel. '''
+	rate = 50
+
+	''' Minimum change in ticks before an event is published. '''
+	threshold = 2
+
+	def __init__(self, queue, event_queue, adc, channels, rate = 50, buffer_len = 8, threshold = 2):
+		self.event_queue = event_queue
+		self.adc = adc
+		self.channels = list(channels)
+		self.rate = rate
+		self.threshold = threshold
+
+		self.buffers = dict((ch, RingBuffer(buffer_len)) for ch in self.channels)
+
+		''' The last value published for each channel. '''
+		self.published = dict((ch, -1) for ch in self.channels)
+
+		super().__init__(queue)
+		self.daemon = True
+
+
+	def run(self):
+		"""
+		Sample on a fixed schedule, handling commands in between.
+		"""
+		next_t = time.monotonic()
+		while True:
+			try:
+				item = self.queue.get(timeout = max(0, next_t - time.monotonic()))
+				if not self.dispatch(item):
+					break
+			except queue.Empty:
+				pass
+
+			now = time.monotonic()
+			if now < next_t:
+				continue
+
+			self.sample(now)
+
+			next_t += 1.0 / self.rate
+			if next_t < now:
+				# We fell behind; don't try to catch up with a burst.
+				next_t = now + 1.0 / self.rate
+
+
+	def sample(self, now):
+		"""
+		Read every channel once and publish meaningful changes.
+		"""
+		vals = self.adc.read_channels(self.channels)
+		for (ch, val) in zip(self.channels, vals):
+			if val < 0:
+				continue
+			buf = self.buffers[ch]
+			buf.push(val)
+			mean = buf.mean()
+			if abs(mean - self.published[ch]) >= self.threshold:
+				self.published[ch] = mean
+				self.event_queue.put(('pot', ch, mean, now))
+
+
+	def set_rate(self, hz):
+		"""
+		Change the sampling rate.
+		"""
+		if hz > 0:
+			self.rate = hz
+			logging.debug("[ Sampler ] Rate set to " + str(hz) + " Hz")
+
+
+	def latest(self, channel):
+		"""
+		The most recent raw sample for 'channel'.
+		"""
+		return self.buffers[channel].latest()
+
+
+	def history(self, channel):
+		"""
+		The buffered raw samples for 'channel', oldest first.
+		"""
+		return self.buffers[channel].values()
+
+# End of class PotSampler
+
+
+"""
+SharedPotBlock
+
+A small shared-memory block holding the latest value of each channel,
+written by one process and read lock-free by another.
+
+Layout: sequence (uint64), timestamp (float64), one uint16 per channel.
+The writer makes the sequence odd while it writes; readers retry if the
+sequence was odd or changed under them (a seqlock), sleeping a little
+longer each time, so a writer that's slow (or gone) isn't spun on.
+
+The block is a RawArray of 'ctx' (a multiprocessing context), so it
+can be passed to a process that context starts.
+"""
+class SharedPotBlock(object):
+
+	SEQ = struct.Struct('<Q')
+
+	def __init__(self, num_channels, ctx = multiprocessing):
+		body = struct.Struct('<d' + str(num_channels) + 'H')
+		self._attach(num_channels, ctx.RawArray('B', self.SEQ.size + body.size), 0)
+
+	def _attach(self, num_channels, shm, seq):
+		self.num_channels = num_channels
+		self.body = struct.Struct('<d' + str(num_channels) + 'H')
+		self.shm = shm
+		self.map = memoryview(shm)
+		self.seq = seq
+
+	def __getstate__(self):
+		return (self.num_channels, self.shm, self.seq)
+
+	def __setstate__(self, state):
+		self._attach(*state)
+
+	def write(self, timestamp, vals):
+		"""
+		Publish a new set of values (writer side only).
+		"""
+		self.SEQ.pack_into(self.map, 0, self.seq + 1)
+		self.body.pack_into(self.map, self.SEQ.size, timestamp, *vals)
+		self.seq += 2
+		self.SEQ.pack_into(self.map, 0, self.seq)
+
+	def read(self):
+		"""
+		Returns (seq, timestamp, [values]) from a consistent snapshot.
+		"""
+		delay = READ_RETRY_MIN
+		while True:
+			seq = self.SEQ.unpack_from(self.map, 0)[0]
+			if not seq & 1:
+				data = self.body.unpack_from(self.map, self.SEQ.size)
+				if self.SEQ.unpack_from(self.map, 0)[0] == seq:
+					return (seq, data[0], list(data[1:]))
+			time.sleep(delay)
+			delay = min(READ_RETRY_MAX, delay * 2)
+
+	def close(self):
+		self.map.release()
+
+# End of class SharedPotBlock
+
+
+def _sample_process(block, stop, adc, channels, rate, buffer_len):
+	"""
+	Body of the sampling process: read the ADC on a fixed schedule
+	and publish the buffered means to 'block'.
+	'rate' is a shared multiprocessing.Value, in Hz.
+	"""
+	# Ctrl-C reaches the whole process group; the radio stops this process itself
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+	buffers = [RingBuffer(buffer_len) for ch in channels]
+	next_t = time.monotonic()
+	while not stop.is_set():
+		period = 1.0 / rate.value
+		now = time.monotonic()
+		if now < next_t:
+			time.sleep(next_t - now)
+			now = time.monotonic()
+
+		vals = adc.read_channels(channels)
+		for (buf, val) in zip(buffers, vals):
+			if val >= 0:
+				buf.push(val)
+		block.write(now, [buf.mean() for buf in buffers])
+
+		next_t += period
+		if next_t < now:
+			next_t = now + period
+
+	# Close this process's own ADC, writing out any trace it's recording
+	adc.close()
+
+
+"""
+ProcessSampler
+
+A PotSampler whose ADC reads happen in a separate process, so
+sampling isn't held up by the GIL or the main loop's work.
+
+The process is started with 'forkserver', not forked from the radio
+(by then it has threads of its own, whose locks a fork would copy in
+whatever state they were), so 'adc' is pickled: the process opens an
+ADC of its own with the same settings (see service.adc), and an ADC
+trace being recorded carries on from the process.
+
+The child process writes its buffered means into a SharedPotBlock; this
+thread only polls that block and publishes events just like PotSampler.
+"""
+class ProcessSampler(PotSampler):
+
+	def __init__(self, queue, event_queue, adc, channels, rate = 50, buffer_len = 8, threshold = 2):
+		super().__init__(queue, event_queue, adc, channels, rate, buffer_len, threshold)
+
+		ctx = multiprocessing.get_context('forkserver')
+		self.block = SharedPotBlock(len(self.channels), ctx)
+		self.last_seq = 0
+
+		self.stop_event = ctx.Event()
+		self.proc_rate = ctx.Value('d', rate, lock = False)
+		self.proc = ctx.Process(target = _sample_process,
+					args = (self.block, self.stop_event, adc, self.channels, self.proc_rate, buffer_len))
+		self.proc.daemon = True
+
+
+	def run(self):
+		self.proc.start()
+		logging.debug("[ Sampler ] Sampling process started (pid " + str(self.proc.pid) + ")")
+		try:
+			super().run()
+		finally:
+			self.stop_event.set()
+			self.proc.join(1)
+			if self.proc.is_alive():
+				self.proc.terminate()
+
+
+	def sample(self, now):
+		"""
+		Pick up the latest values from the sampling process.
+		"""
+		(seq, timestamp, vals) = self.block.read()
+		if seq == self.last_seq:
+			return
+		self.last_seq = seq
+
+		for (ch, val) in zip(self.channels, vals):
+			self.buffers[ch].push(val)
+			if abs(val - self.published[ch]) >= self.threshold:
+				self.published[ch] = val
+				self.event_queue.put(('pot', ch, val, timestamp))
+
+
+	def set_rate(self, hz):
+		"""
+		Change the sampling rate of both the process and this thread.
+		"""
+		if hz > 0:
+			self.proc_rate.value = hz
+		super().set_rate(hz)
+
+# End of class ProcessSampler
@@ -15,32 +15,41 @@ class Service(threading.Thread):
 	def run(self):
 		while True:
 			item = self.queue.get()
-			if type(item) is str:
-				cmd = item
-				args = None
-			elif type(item) is list:
-				cmd = item.pop(0)
-				if len(item) > 1:
-					args = item
-				elif len(item) == 1:
-					args = item[0]
-				else:
-					args = None
+			if not self.dispatch(item):
+				break
+
+	def dispatch(self, item):
+		"""
+		Run a queued command on this service.
+		Returns False when the service should stop.
+		"""
+		if type(item) is str:
+			cmd = item
+			args = None
+		elif type(item) is list:
+			cmd = item.pop(0)
+			if len(item) > 1:
+				args = item
+			elif len(item) == 1:
+				args = item[0]
 			else:
-				continue
+				args = None
+		else:
+			return True
 
-			if cmd == self.quit_cmd:
-				break
+		if cmd == self.quit_cmd:
+			return False
+
+		try:
+			call = getattr(self, cmd)
+			if callable(call):
+				if args is None:
+					call()
+				else:
+					call(args)
+		except AttributeError:
+			pass
 
-			try:
-				call = getattr(self, cmd)
-				if callable(call):
-					if args is None:
-						call()
-					else:
-						call(args)
-			except AttributeError:
-				pass
-
-			self.queue.task_done()
+		self.queue.task_done()
+		return True
 			
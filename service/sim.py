@@ -0,0 +1,339 @@
+import bisect, collections, random, sys, types
+
+"""
+Simulation support.
+
+Stand-ins for the radio's hardware and servers, all driven by a
+VirtualClock, so the control loop can run hours of listening in
+seconds and give the same result every time for the same seed:
+
+	VirtualClock      time that only moves when told to
+	ScriptedKnob      a knob following a list of (time, value) points
+	ListenerKnob      a knob turned by a (seeded) random listener
+	SimADC            an ADC backend reading knob models at clock time
+	fake_gpio()       an RPi.GPIO module that records what's done to it
+	fake_mpd()        an mpd module whose clients are in-process servers
+
+install() puts the fake modules into sys.modules; it must be called
+before anything imports RPi.GPIO or mpd (eg. radio.rmpd).
+"""
+
+
+"""
+VirtualClock
+
+Call it for the time, like time.monotonic.
+"""
+class VirtualClock(object):
+
+	def __init__(self, start = 0.0):
+		self.now = start
+
+	def __call__(self):
+		return self.now
+
+	def advance(self, secs):
+		self.now += secs
+
+	def advance_to(self, t):
+		if t > self.now:
+			self.now = t
+
+# End of class VirtualClock
+
+
+"""
+ScriptedKnob
+
+Moves in straight lines between (time, value) points, and holds the
+last value after the script ends.
+"""
+class ScriptedKnob(object):
+
+	def __init__(self, points):
+		self.points = sorted(points)
+		self.times = [p[0] for p in self.points]
+
+	def value(self, t):
+		i = bisect.bisect_right(self.times, t)
+		if i == 0:
+			return self.points[0][1]
+		if i == len(self.points):
+			return self.points[-1][1]
+		(t0, v0) = self.points[i - 1]
+		(t1, v1) = self.points[i]
+		return v0 + (v1 - v0) * (t - t0) / (t1 - t0)
+
+# End of class ScriptedKnob
+
+
+"""
+ListenerKnob
+
+A listener who leaves the knob on one of 'targets' for a while
+(exponentially distributed, 'mean_dwell' seconds), then turns it to
+another target at between 'min_speed' and 'max_speed' ticks/s.
+Sometimes ('scan' of the time) they sweep the whole dial first.
+
+The script is generated as the clock reaches it, so runs of any
+length are cheap.
+"""
+class ListenerKnob(ScriptedKnob):
+
+	def __init__(self, targets, seed = 0, mean_dwell = 600.0, min_speed = 100.0, max_speed = 1500.0, scan = 0.1):
+		self.targets = list(targets)
+		self.rand = random.Random(seed)
+		self.mean_dwell = mean_dwell
+		self.min_speed = min_speed
+		self.max_speed = max_speed
+		self.scan = scan
+		super(ListenerKnob, self).__init__([(0.0, self.rand.choice(self.targets))])
+
+
+	def _move(self, t, v, to):
+		speed = self.rand.uniform(self.min_speed, self.max_speed)
+		t += abs(to - v) / speed
+		self.points.append((t, to))
+		self.times.append(t)
+		return t
+
+
+	def _extend(self):
+		(t, v) = self.points[-1]
+		t += self.rand.expovariate(1.0 / self.mean_dwell)
+		self.points.append((t, v))
+		self.times.append(t)
+		if self.rand.random() < self.scan:
+			end = 1023 if self.rand.random() < 0.5 else 0
+			t = self._move(t, v, end)
+			v = end
+		self._move(t, v, self.rand.choice(self.targets))
+
+
+	def value(self, t):
+		while self.times[-1] <= t:
+			self._extend()
+		return super(ListenerKnob, self).value(t)
+
+# End of class ListenerKnob
+
+
+"""
+SimADC
+
+An ADC backend (see service.adc) that reads {channel: knob} models at
+the clock's time, with a little seeded noise.
+"""
+class SimADC(object):
+
+	name = 'sim'
+	oversample = 1
+
+	def __init__(self, clock, knobs, noise = 2, seed = 0):
+		self.clock = clock
+		self.knobs = dict(knobs)
+		self.noise = noise
+		self.rand = random.Random(seed)
+		self.reads = 0
+
+	def read_channels(self, channels):
+		self.reads += 1
+		t = self.clock()
+		vals = []
+		for ch in channels:
+			knob = self.knobs.get(ch)
+			if knob is None:
+				vals.append(512)
+				continue
+			v = int(round(knob.value(t))) + self.rand.randint(-self.noise, self.noise)
+			vals.append(max(0, min(1023, v)))
+		return vals
+
+	def read(self, channel):
+		return self.read_channels((channel,))[0]
+
+	def close(self):
+		pass
+
+# End of class SimADC
+
+
+def fake_gpio():
+	"""
+	Returns a stand-in RPi.GPIO module. Pin levels and PWM duty cycles
+	are kept in its 'pins' dict.
+	"""
+	gpio = types.ModuleType('RPi.GPIO')
+	gpio.BCM = 11
+	gpio.BOARD = 10
+	gpio.OUT = 0
+	gpio.IN = 1
+	gpio.HIGH = True
+	gpio.LOW = False
+	gpio.pins = {}
+
+	gpio.setmode = lambda mode: None
+	gpio.setwarnings = lambda flag: None
+	gpio.cleanup = lambda *args: gpio.pins.clear()
+	gpio.setup = lambda pin, mode, **kw: gpio.pins.setdefault(pin, False)
+	gpio.output = lambda pin, val: gpio.pins.__setitem__(pin, val)
+	gpio.input = lambda pin: gpio.pins.get(pin, False)
+
+	class PWM(object):
+		def __init__(self, pin, freq):
+			self.pin = pin
+			self.freq = freq
+		def start(self, dc):
+			gpio.pins[self.pin] = dc
+		def ChangeDutyCycle(self, dc):
+			gpio.pins[self.pin] = dc
+		def ChangeFrequency(self, freq):
+			self.freq = freq
+		def stop(self):
+			gpio.pins[self.pin] = 0
+
+	gpio.PWM = PWM
+	return gpio
+
+
+def fake_mpd(clock, rtt = 0.002, load_time = 0.05, start_time = 0.2):
+	"""
+	Returns a stand-in mpd module. Each MPDClient is its own little
+	in-process server; every round trip costs the module's 'rtt'
+	seconds of virtual time ('load_time' for one with a 'load'), and
+	is counted in 'round_trips'. A command list is one round trip.
+	Commands are counted in its 'commands' Counter. After 'play',
+	status() only reports an audio format once 'start_time' has
+	passed (buffering).
+	"""
+	mpd = types.ModuleType('mpd')
+	mpd.commands = collections.Counter()
+	mpd.round_trips = 0
+	mpd.rtt = rtt
+	mpd.load_time = load_time
+	mpd.start_time = start_time
+
+	class MPDError(Exception):
+		pass
+	class CommandError(MPDError):
+		pass
+	class ConnectionError(MPDError):
+		pass
+
+	mpd.MPDError = MPDError
+	mpd.CommandError = CommandError
+	mpd.ConnectionError = ConnectionError
+
+	class MPDClient(object):
+
+		def __init__(self):
+			self.playlist = None
+			self.state = 'stop'
+			self.output_on = True
+			self.volume = 100
+			self.rand = 0
+			self.started = 0.0
+			self.cmd_list = None
+
+		def _cmd(self, name, cost = None):
+			mpd.commands[name] += 1
+			cost = mpd.rtt if cost is None else cost
+			if self.cmd_list is not None:
+				self.cmd_list.append(cost - mpd.rtt)
+				return
+			mpd.round_trips += 1
+			clock.advance(cost)
+
+		def command_list_ok_begin(self):
+			self.cmd_list = []
+
+		def command_list_end(self):
+			work = self.cmd_list
+			self.cmd_list = None
+			mpd.round_trips += 1
+			clock.advance(mpd.rtt + sum(work))
+			return [None] * len(work)
+
+		def connect(self, host, port):
+			self._cmd('connect')
+
+		def disconnect(self):
+			self._cmd('disconnect')
+
+		def status(self):
+			self._cmd('status')
+			status = {'state': self.state,
+				'volume': str(self.volume),
+				'random': str(self.rand),
+				'playlistlength': '1' if self.playlist else '0'}
+			if self.state == 'play' and clock() >= self.started:
+				status['audio'] = '44100:16:2'
+			return status
+
+		def currentsong(self):
+			self._cmd('currentsong')
+			if self.playlist is None:
+				return {}
+			return {'file': self.playlist, 'title': self.playlist}
+
+		def outputs(self):
+			self._cmd('outputs')
+			return [{'outputid': '0', 'outputname': 'sim', 'outputenabled': '1' if self.output_on else '0'}]
+
+		def enableoutput(self, oid):
+			self._cmd('enableoutput')
+			self.output_on = True
+
+		def disableoutput(self, oid):
+			self._cmd('disableoutput')
+			self.output_on = False
+
+		def clear(self):
+			self._cmd('clear')
+			self.playlist = None
+			self.state = 'stop'
+
+		def load(self, name):
+			self._cmd('load', mpd.load_time)
+			self.playlist = name
+
+		def play(self, pos = 0):
+			self._cmd('play')
+			if self.playlist is not None:
+				self.state = 'play'
+				self.started = clock() + mpd.start_time
+
+		def pause(self, flag = 1):
+			self._cmd('pause')
+			if self.state == 'play':
+				self.state = 'pause'
+
+		def random(self, flag):
+			self._cmd('random')
+			self.rand = int(flag)
+
+		def setvol(self, vol):
+			self._cmd('setvol')
+			self.volume = int(vol)
+
+		def seekcur(self, secs):
+			self._cmd('seekcur')
+
+	mpd.MPDClient = MPDClient
+	return mpd
+
+
+def install(clock, rtt = 0.002, load_time = 0.05):
+	"""
+	Put fake RPi.GPIO and mpd modules into sys.modules.
+	Returns (gpio, mpd).
+	"""
+	gpio = fake_gpio()
+	rpi = types.ModuleType('RPi')
+	rpi.GPIO = gpio
+	sys.modules['RPi'] = rpi
+	sys.modules['RPi.GPIO'] = gpio
+
+	mpd = fake_mpd(clock, rtt, load_time)
+	sys.modules['mpd'] = mpd
+	return (gpio, mpd)
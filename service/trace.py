@@ -0,0 +1,235 @@
+import mmap, struct, time
+
+"""
+ADC traces.
+
+A trace file is a small header followed by fixed-size records, one per
+channel conversion:
+
+	header:  'RTRC', version (uint16), record size (uint16)
+	record:  seconds since start (float64), channel (uint16), value (uint16)
+
+All little-endian, so a trace can be memory-mapped and unpacked in place.
+"""
+
+MAGIC = b'RTRC'
+VERSION = 1
+
+HEADER = struct.Struct('<4sHH')
+RECORD = struct.Struct('<dHH')
+
+
+"""
+RecordingADC
+
+Wraps any ADC backend (see service.adc) and writes every conversion
+it returns to a trace file.
+
+Given 'start' (the monotonic time of an existing trace's start), it
+carries on writing the trace at 'path' instead of starting a new one.
+That's how it pickles, after writing out what it holds, so a sampling
+process takes the recording over from where it was.
+"""
+class RecordingADC(object):
+
+	def __init__(self, adc, path, start = None):
+		self.adc = adc
+		self.name = adc.name + '+rec'
+		self.oversample = adc.oversample
+		self.path = path
+
+		if start is None:
+			self.f = open(path, 'wb')
+			self.f.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+			self.start = time.monotonic()
+		else:
+			self.f = open(path, 'ab')
+			self.start = start
+
+
+	def __reduce__(self):
+		self.f.flush()
+		return (RecordingADC, (self.adc, self.path, self.start))
+
+
+	def read_channels(self, channels):
+		vals = self.adc.read_channels(channels)
+		t = time.monotonic() - self.start
+		pack = RECORD.pack
+		self.f.write(b''.join(pack(t, ch, val) for (ch, val) in zip(channels, vals) if val >= 0))
+		return vals
+
+
+	def read(self, channel):
+		return self.read_channels((channel,))[0]
+
+
+	def close(self):
+		self.f.close()
+		self.adc.close()
+
+# End of class RecordingADC
+
+
+"""
+TraceReader
+
+Memory-maps a trace file for reading.
+Records are (time, channel, value) tuples.
+"""
+class TraceReader(object):
+
+	def __init__(self, path):
+		self.f = open(path, 'rb')
+		head = self.f.read(HEADER.size)
+		try:
+			(magic, version, rec_size) = HEADER.unpack(head)
+		except struct.error:
+			raise ValueError("Not a trace file: " + str(path))
+		if magic != MAGIC or version != VERSION or rec_size != RECORD.size:
+			raise ValueError("Not a v" + str(VERSION) + " trace file: " + str(path))
+
+		size = self.f.seek(0, 2)
+		self.count = (size - HEADER.size) // RECORD.size
+		if self.count > 0:
+			self.map = mmap.mmap(self.f.fileno(), 0, access = mmap.ACCESS_READ)
+		else:
+			self.map = b''
+
+
+	def __len__(self):
+		return self.count
+
+
+	def __getitem__(self, i):
+		if i < 0:
+			i += self.count
+		if i < 0 or i >= self.count:
+			raise IndexError("trace record out of range")
+		return RECORD.unpack_from(self.map, HEADER.size + i * RECORD.size)
+
+
+	def __iter__(self):
+		if self.count == 0:
+			return iter(())
+		end = HEADER.size + self.count * RECORD.size
+		return RECORD.iter_unpack(memoryview(self.map)[HEADER.size:end])
+
+
+	def duration(self):
+		if self.count == 0:
+			return 0.0
+		return self[-1][0]
+
+
+	def close(self):
+		if self.count > 0:
+			self.map.close()
+		self.f.close()
+
+# End of class TraceReader
+
+
+"""
+ReplayADC
+
+An ADC backend that plays back a trace file.
+
+With 'realtime' set, read_channels() returns the values as they were at
+the same time since the replay started. Otherwise each call steps to the
+next recorded read, as fast as it is called.
+
+Once the trace runs out, the last values are held and 'done' is set
+(or, with 'loop' set, the replay starts over).
+"""
+class ReplayADC(object):
+
+	name = 'replay'
+	oversample = 1
+
+	def __init__(self, path, realtime = False, loop = False):
+		self.trace = TraceReader(path)
+		self.realtime = realtime
+		self.loop = loop
+		self.rewind()
+
+
+	def rewind(self):
+		self.pos = 0
+		self.values = {}
+		''' Trace time of the last record applied. '''
+		self.time = 0
+		self.done = (len(self.trace) == 0)
+		self.start = time.monotonic()
+
+
+	def _advance_to(self, t):
+		"""
+		Apply every record up to time 't'.
+		"""
+		trace = self.trace
+		n = len(trace)
+		while self.pos < n:
+			(rec_t, ch, val) = trace[self.pos]
+			if rec_t > t:
+				return
+			self.values[ch] = val
+			self.time = rec_t
+			self.pos += 1
+
+		if self.loop and n > 0:
+			self.rewind()
+		else:
+			self.done = True
+
+
+	def next_due(self):
+		"""
+		The monotonic time the next record is due at, in realtime
+		replays; None if there isn't one.
+		"""
+		if self.done or self.pos >= len(self.trace):
+			return None
+		return self.start + self.trace[self.pos][0]
+
+
+	def read_channels(self, channels):
+		if not self.done:
+			if self.realtime:
+				self._advance_to(time.monotonic() - self.start)
+			else:
+				# Step to the end of the next recorded read
+				self._advance_to(self.trace[self.pos][0])
+		return [self.values.get(ch, 512) for ch in channels]
+
+
+	def read(self, channel):
+		return self.read_channels((channel,))[0]
+
+
+	def close(self):
+		self.trace.close()
+
+# End of class ReplayADC
+
+
+def replay(path, readers, realtime = False):
+	"""
+	Drive 'readers' (PotReaders) from a trace until it runs out.
+	Yields the list of PotEvents (or None) from each step. With
+	'realtime' set, each step waits until the next record is due.
+	"""
+	from . import pots
+
+	adc = ReplayADC(path, realtime)
+	for r in readers:
+		r.adc = adc
+	try:
+		while not adc.done:
+			if realtime:
+				due = adc.next_due()
+				if due is not None:
+					time.sleep(max(0, due - time.monotonic()))
+			yield pots.read_pots(*readers)
+	finally:
+		adc.close()
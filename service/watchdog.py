@@ -0,0 +1,243 @@
+import logging, sys, threading, time, traceback
+
+"""
+Stall watchdog.
+
+Code on the radio's main thread marks what it's doing as named phases:
+
+	with watchdog.phase('mpd_switch'):
+		str_man.activate_stream(station_id)
+
+A background thread sleeps until the first budget of the open phases
+runs out (for as long as it takes, with none open) and, when a phase
+has run past its budget, logs a warning with the stack of the thread
+that's stuck in it. Every phase is also timed, for stats().
+
+With 'degrade' on, a phase that has stalled recently reports itself as
+degraded(), so optional work (eg. web updates) can be skipped for a
+while and the knobs stay responsive.
+"""
+
+''' How long a stalled phase stays degraded, in seconds. '''
+DEGRADE_HOLD = 30.0
+
+
+def parse_budgets(spec):
+	"""
+	Parse 'name=ms,name=ms,...' into {name: seconds}.
+	"""
+	budgets = {}
+	for item in str(spec).split(','):
+		if '=' not in item:
+			continue
+		(name, ms) = item.split('=', 1)
+		try:
+			budgets[name.strip()] = float(ms) / 1000.0
+		except ValueError:
+			logging.error("[ Watchdog ] Bad budget: " + item)
+	return budgets
+
+
+"""
+PhaseStats
+
+Timings for one phase name.
+"""
+class PhaseStats(object):
+	__slots__ = ('count', 'total', 'worst', 'overruns', 'stalls')
+
+	def __init__(self):
+		self.count = 0
+		self.total = 0.0
+		self.worst = 0.0
+		self.overruns = 0
+		self.stalls = 0
+
+# End of class PhaseStats
+
+
+"""
+Phase
+
+The context manager returned by Watchdog.phase().
+"""
+class Phase(object):
+	__slots__ = ('watchdog', 'name', 'prev')
+
+	def __init__(self, watchdog, name):
+		self.watchdog = watchdog
+		self.name = name
+		self.prev = None
+
+	def __enter__(self):
+		self.prev = self.watchdog.enter(self.name)
+		return self
+
+	def __exit__(self, *exc):
+		self.watchdog.leave(self.prev)
+		return False
+
+# End of class Phase
+
+
+"""
+Watchdog
+
+'budgets' is {phase name: seconds}; phases without a budget are only
+timed. The checking thread runs between start() and close().
+"""
+class Watchdog(object):
+
+	def __init__(self, budgets, degrade = False, clock = time.monotonic):
+		self.budgets = dict(budgets)
+		self.degrade = degrade
+		self.clock = clock
+
+		''' {thread ident: (name, start)} for each thread's open phase. '''
+		self._open = {}
+		self._reported = set()
+		self._stalled_at = {}
+		self._stats = {}
+
+		''' Wakes the checking thread when a phase with a budget opens. '''
+		self._cond = threading.Condition()
+		self._quit = threading.Event()
+		self._thread = None
+
+
+	def phase(self, name):
+		return Phase(self, name)
+
+
+	def enter(self, name):
+		"""
+		Open a phase on this thread; returns what to pass to leave().
+		"""
+		ident = threading.get_ident()
+		prev = self._open.get(ident)
+		self._open[ident] = (name, self.clock())
+		if self._thread is not None and name in self.budgets:
+			with self._cond:
+				self._cond.notify()
+		return prev
+
+
+	def leave(self, prev):
+		"""
+		Close this thread's open phase, going back to 'prev'.
+		"""
+		ident = threading.get_ident()
+		(name, start) = self._open[ident]
+		elapsed = self.clock() - start
+		if prev is None:
+			del self._open[ident]
+		else:
+			self._open[ident] = prev
+
+		stats = self._stats.get(name)
+		if stats is None:
+			stats = self._stats[name] = PhaseStats()
+		stats.count += 1
+		stats.total += elapsed
+		if elapsed > stats.worst:
+			stats.worst = elapsed
+		budget = self.budgets.get(name)
+		if budget is not None and elapsed > budget:
+			stats.overruns += 1
+			logging.debug("[ Watchdog ] {} took {:.0f} ms (budget {:.0f} ms)".format(
+					name, 1000 * elapsed, 1000 * budget))
+
+
+	def check(self):
+		"""
+		Report every open phase that is over budget (once per stall).
+		"""
+		now = self.clock()
+		for (ident, (name, start)) in list(self._open.items()):
+			budget = self.budgets.get(name)
+			if budget is None or now - start <= budget:
+				continue
+			key = (ident, name, start)
+			if key in self._reported:
+				continue
+			self._reported.add(key)
+			self._stalled_at[name] = now
+
+			stats = self._stats.get(name)
+			if stats is None:
+				stats = self._stats[name] = PhaseStats()
+			stats.stalls += 1
+
+			frame = sys._current_frames().get(ident)
+			stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+			logging.warning("[ Watchdog ] {} stalled for {:.0f} ms (budget {:.0f} ms):\n{}".format(
+					name, 1000 * (now - start), 1000 * budget, stack))
+
+		# Forget stalls that have ended
+		self._reported = set(k for k in self._reported if self._open.get(k[0]) == (k[1], k[2]))
+
+
+	def degraded(self, name):
+		"""
+		True if degrading is on and phase 'name' stalled recently.
+		"""
+		if not self.degrade or name not in self._stalled_at:
+			return False
+		return self.clock() - self._stalled_at[name] < DEGRADE_HOLD
+
+
+	def stats(self):
+		"""
+		{phase name: PhaseStats}
+		"""
+		return dict(self._stats)
+
+
+	def report(self):
+		lines = ["{:<14} {:>7} {:>9} {:>9} {:>8} {:>6}".format('phase', 'count', 'mean ms', 'worst ms', 'overrun', 'stall')]
+		for (name, s) in sorted(self._stats.items()):
+			lines.append("{:<14} {:>7} {:>9.1f} {:>9.1f} {:>8} {:>6}".format(
+					name, s.count, 1000 * s.total / max(1, s.count), 1000 * s.worst, s.overruns, s.stalls))
+		return '\n'.join(lines)
+
+
+	def _deadline(self):
+		"""
+		When the first open phase that hasn't stalled yet will be over
+		budget, or None.
+		"""
+		deadline = None
+		for (ident, (name, start)) in list(self._open.items()):
+			budget = self.budgets.get(name)
+			if budget is None or (ident, name, start) in self._reported:
+				continue
+			if deadline is None or start + budget < deadline:
+				deadline = start + budget
+		return deadline
+
+
+	def _run(self):
+		while not self._quit.is_set():
+			with self._cond:
+				deadline = self._deadline()
+				if deadline is None:
+					self._cond.wait()
+				elif deadline > self.clock():
+					self._cond.wait(deadline - self.clock())
+			self.check()
+
+
+	def start(self):
+		self._thread = threading.Thread(target = self._run, name = 'watchdog')
+		self._thread.daemon = True
+		self._thread.start()
+
+
+	def close(self):
+		self._quit.set()
+		with self._cond:
+			self._cond.notify()
+		if self._thread is not None:
+			self._thread.join(1)
+
+# End of class Watchdog
@@ -71,6 +71,12 @@ class StoppableServer(http.server.HTTPServer):
 	"""
 	_keepalive = True
 
+	"""
+	Called with an event name (eg. 'config_changed') when a
+	request changes something the radio should know about.
+	"""
+	notify = None
+
 	"""
 	Handle requests while _keepalive is True.
 	"""
@@ -104,15 +110,17 @@ class RadioWebServer(service.Service):
 	"""
 	server = False
 
-	def __init__(self, queue, host, port):
+	def __init__(self, queue, host, port, notify = None):
 		"""
 		Start a server in a thread.
+		'notify' is passed on to the StoppableServer.
 		"""
 		self.host = host
 		self.port = port
 
 		try:
 			self.server = StoppableServer((self.host, self.port), CustomHandler)
+			self.server.notify = notify
 			self.server_t = threading.Thread(target=self.server.serve_until_shutdown)
 			self.server_t.daemon = True
 			self.server_t.start()
@@ -153,7 +161,7 @@ class RadioWebServer(service.Service):
 			except TypeError:
 				data = emptydata
 
-			total_secs = int(data['elapsed'])
+			total_secs = int(float(data['elapsed']))
 			hours = total_secs // 3600
 			mins = (total_secs - 3600*hours)//60
 			secs = total_secs - 3600*hours - mins*60
@@ -179,6 +187,8 @@ class RadioWebServer(service.Service):
 			target.close()
 		except IOError as e:
 			logging.error("[ WWW ] Can't open index.html for write: [" + str(e) + "]")
+		except (ValueError, TypeError) as e:
+			logging.error("[ WWW ] Bad now-playing data: " + str(e))
 
 #End of RadioWebServer
 
@@ -239,6 +249,9 @@ class CustomHandler(http.server.BaseHTTPRequestHandler):
 			except sqlite3.OperationalError as e:
 				html += html_panel("DB Error", "Could not save data: " + str(e), 'panel-danger')
 
+		if self.server.notify is not None:
+			self.server.notify('config_changed')
+
 		self.do_GET(posted_message = html)
 
 	def do_GET(self, posted_message = False):
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Radio simulation
+
+Runs the radio's control loop (the pots, sweep coalescing, preloading,
+MPD switching, the shutdown timer...) against simulated knobs and MPD
+servers in virtual time, so hours of listening take seconds and runs
+with the same seed are identical. See service.sim. The MPD servers
+are driven one after the other (time is shared), so switches cost the
+sum of the servers' round trips, not the longest.
+
+	simulate.py [--hours H] [--seed N] [--rtt MS] [--load MS] [--start MS] [--servers N] [--policy P] [--no-governor]
+
+No root, GPIO, ALSA or MPD needed; run from the top of the repo (the
+options and playlists come from config.db). At the end it prints the
+MPD commands sent, the station switches made and avoided, the preload
+hit rate, the switch latency (from the tuner reaching a station to it
+playing, in virtual time), the CPU used per simulated hour, and the
+service.latency histograms.
+
+With NOW_PLAYING 'idle' the now-playing watcher isn't run: it has a
+connection of its own, off the control loop. SimNowPlaying stands in
+for it, reading the simulated servers as MPD would report them, so a
+switch is timed to when its server starts playing audio. With 'poll',
+the queries made after each switch are counted, and switches are only
+timed as far as the mpd_switch phase.
+"""
+
+import argparse, logging, queue, sys, time
+
+"""
+The fakes have to be in place before anything imports RPi.GPIO or mpd.
+"""
+import service.sim
+clock = service.sim.VirtualClock()
+(gpio, mpd) = service.sim.install(clock)
+
+import service.governor
+import service.latency
+import service.mixer
+import service.option_loader
+import service.pots
+import service.reactor
+import service.sampler
+import radio.controller
+import radio.nowplaying
+import radio.placement
+import radio.rmpd
+import radio.stations
+
+
+"""
+SimNowPlaying
+
+A NowPlayingWatcher without its thread or connection: check() looks at
+the active server directly (no commands are counted) and publishes a
+record when what it would report has changed.
+"""
+class SimNowPlaying(radio.nowplaying.NowPlayingWatcher):
+
+	def __init__(self, str_man):
+		super().__init__(None, 0, lambda: str_man.active_server, clock)
+		self.str_man = str_man
+
+
+	def _report(self):
+		svr = self.str_man.servers[self.str_man.active_server]
+		song = {}
+		if svr.playlist is not None:
+			song = {'file': svr.playlist, 'title': svr.playlist}
+		status = {'state': svr.state}
+		if svr.state == 'play' and clock() >= svr.started:
+			status['audio'] = '44100:16:2'
+		return (svr, song, status)
+
+
+	def next_change(self):
+		"""
+		When the active server will start playing audio, or None.
+		"""
+		(svr, song, status) = self._report()
+		if svr.state == 'play' and 'audio' not in status:
+			return svr.started
+		return None
+
+
+	def check(self):
+		(svr, song, status) = self._report()
+		record = self.record
+		server = self.str_man.active_server
+		if server != record.server or song != record.song or status != record.status:
+			self._publish(server, song, status)
+
+# End of class SimNowPlaying
+
+
+def percentile(vals, p):
+	if not vals:
+		return 0.0
+	vals = sorted(vals)
+	return vals[min(len(vals) - 1, int(p * len(vals)))]
+
+
+def simulate(args):
+	mpd.rtt = args.rtt / 1000.0
+	mpd.load_time = args.load / 1000.0
+	mpd.start_time = args.start / 1000.0
+	latency = service.latency.LatencyRecorder(clock)
+
+	opt_ldr = service.option_loader.OptionLoader('config.db')
+
+	stations = radio.stations.StationCatalogue('config.db', opt_ldr.fetch('STATION_BANK_SIZE'))
+	bank_sel = radio.stations.BankSelector(
+			stations.num_banks(),
+			opt_ldr.fetch('STATION_BANK'),
+			opt_ldr.fetch('BANK_DWELL'),
+			opt_ldr.fetch('BANK_EDGE'))
+	bank_set = stations.bank(bank_sel.bank)
+
+	adc = service.sim.SimADC(clock, {}, seed = args.seed)
+	tuner_knob = service.pots.TunerPotReader(opt_ldr.fetch('TUNE_POT_ADC'), len(bank_set), adc, opt_ldr)
+	tuner_knob.set_filters(opt_ldr.fetch('TUNE_POT_FILTERS'))
+	vol_knob = service.pots.VolumePotReader(opt_ldr.fetch('VOL_POT_ADC'), adc, service.mixer.NullMixer(), opt_ldr)
+	vol_knob.set_filters(opt_ldr.fetch('VOL_POT_FILTERS'))
+
+	adc.knobs[tuner_knob.pot_pin] = service.sim.ListenerKnob(tuner_knob.freq_list, args.seed, args.dwell)
+	adc.knobs[vol_knob.pot_pin] = service.sim.ListenerKnob(range(400, 901, 50), args.seed + 1, 4 * args.dwell, scan = 0)
+
+	str_man = radio.rmpd.StreamManager(
+			opt_ldr.fetch('MPD_HOST'),
+			opt_ldr.fetch('MPD_PORT'),
+			args.servers or opt_ldr.fetch('MPD_NUM_SERVERS'),
+			latency,
+			parallel = False,
+			policy = args.policy or opt_ldr.fetch('MPD_PLACEMENT'),
+			pins = radio.placement.parse_pins(opt_ldr.fetch('MPD_PINS')))
+	str_man.set_loader(stations.stream)
+	str_man.connect()
+
+	now_playing = None
+	if opt_ldr.fetch('NOW_PLAYING') == 'idle':
+		now_playing = SimNowPlaying(str_man)
+
+	reactor = service.reactor.Reactor(clock)
+	governor = service.governor.IdleGovernor(reactor, [
+			('active', 0),
+			('idle', opt_ldr.fetch('IDLE_AFTER')),
+			('sleep', opt_ldr.fetch('SLEEP_AFTER'))])
+	ctl = radio.controller.RadioController(
+			reactor,
+			opt_ldr,
+			vol_knob,
+			tuner_knob,
+			str_man,
+			stations,
+			bank_sel,
+			service.option_loader.ConfigWatcher('config.db'),
+			queue.Queue(),
+			queue.Queue(),
+			governor = governor,
+			latency = latency,
+			now_playing = now_playing)
+
+	sampler = service.sampler.PotSampler(
+			queue.Queue(),
+			reactor.queue,
+			adc,
+			[vol_knob.pot_pin, tuner_knob.pot_pin],
+			opt_ldr.fetch('SAMPLE_RATE'),
+			opt_ldr.fetch('SAMPLE_BUFFER_LEN'),
+			opt_ldr.fetch('SAMPLE_THRESHOLD'))
+
+	sample_rates = {
+		'active': opt_ldr.fetch('SAMPLE_RATE'),
+		'idle': opt_ldr.fetch('IDLE_SAMPLE_RATE'),
+		'sleep': opt_ldr.fetch('SLEEP_SAMPLE_RATE'),
+		}
+	if not args.no_governor:
+		governor.on_change(lambda state: sampler.set_rate(sample_rates[state]))
+
+	"""
+	Switch latency: from the tuner entering a station to it playing.
+	"""
+	entered = {}
+	latencies = []
+
+	def on_tuner(event):
+		if event.is_new_station:
+			entered[stations.station_id(bank_sel.bank, tuner_knob.SID)] = clock()
+	tuner_knob.add_callback(on_tuner)
+
+	change_station = ctl.change_station
+	def timed_change_station(station_id):
+		change_station(station_id)
+		if station_id in entered:
+			latencies.append(clock() - entered.pop(station_id))
+	ctl.change_station = timed_change_station
+
+	"""
+	Run.
+	"""
+	end = args.hours * 3600.0
+	wall_start = time.perf_counter()
+	cpu_start = time.process_time()
+
+	tuner_knob.read_pot()
+	vol_knob.read_pot()
+	ctl.start()
+
+	next_sample = clock()
+	while clock() < end:
+		deadline = reactor.next_deadline()
+		if deadline is None or deadline > next_sample:
+			deadline = next_sample
+		if now_playing is not None:
+			started = now_playing.next_change()
+			if started is not None and started < deadline:
+				deadline = started
+		clock.advance_to(deadline)
+
+		if clock() >= next_sample:
+			sampler.sample(clock())
+			next_sample += 1.0 / sampler.rate
+			if next_sample < clock():
+				# MPD took longer than a sample period; skip, as the sampler would
+				next_sample = clock() + 1.0 / sampler.rate
+
+		if now_playing is not None:
+			now_playing.check()
+		if not reactor.run_pending():
+			print("Powered off after {:.0f}s".format(clock()))
+			break
+		reactor.run_timers()
+
+	wall = time.perf_counter() - wall_start
+	cpu = time.process_time() - cpu_start
+	hours = clock() / 3600.0
+
+	"""
+	Report.
+	"""
+	total = sum(mpd.commands.values())
+	print("Simulated {:.2f} h in {:.1f} s ({:.0f}x), seed {}".format(hours, wall, clock() / max(wall, 1e-9), args.seed))
+	print("CPU: {:.2f} s per simulated hour".format(cpu / max(hours, 1e-9)))
+	print("ADC reads: {}".format(adc.reads))
+	print("MPD round trips: {} ({:.0f} per hour)".format(mpd.round_trips, mpd.round_trips / max(hours, 1e-9)))
+	print("MPD commands: {} ({:.0f} per hour)".format(total, total / max(hours, 1e-9)))
+	for (cmd, n) in mpd.commands.most_common():
+		print("  {:<14} {:>8}".format(cmd, n))
+	print("Stations tuned: {}, switches: {}, avoided: {}".format(
+			ctl.sweep.passed, ctl.sweep.activated, ctl.sweep.avoided))
+	print("Preload hit rate: {:.0%} ({} hits, {} misses)".format(
+			str_man.hit_rate(), str_man.hits, str_man.misses))
+	print("Switch latency (ms): mean {:.0f}, p50 {:.0f}, p95 {:.0f}, max {:.0f}".format(
+			1000 * sum(latencies) / max(1, len(latencies)),
+			1000 * percentile(latencies, 0.5),
+			1000 * percentile(latencies, 0.95),
+			1000 * max(latencies or [0])))
+	print("Time per power state:\n" + governor.report())
+	print("Latency:\n" + latency.report())
+	return 0
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Simulate the radio in virtual time.")
+	parser.add_argument('--hours', type = float, default = 1.0, help = "simulated hours to run")
+	parser.add_argument('--seed', type = int, default = 0, help = "seed for the listener and noise")
+	parser.add_argument('--dwell', type = float, default = 300.0, help = "mean seconds on a station")
+	parser.add_argument('--rtt', type = float, default = 2.0, help = "MPD round trip, ms")
+	parser.add_argument('--load', type = float, default = 50.0, help = "MPD playlist load, ms")
+	parser.add_argument('--start', type = float, default = 200.0, help = "MPD buffering before audio starts, ms")
+	parser.add_argument('--servers', type = int, default = 0, help = "MPD servers (default MPD_NUM_SERVERS)")
+	parser.add_argument('--policy', choices = sorted(radio.placement.POLICIES), help = "server placement (default MPD_PLACEMENT)")
+	parser.add_argument('--no-governor', action = 'store_true', help = "sample at full rate even when idle")
+	parser.add_argument('--debug', action = 'store_true', help = "log at DEBUG level")
+	args = parser.parse_args()
+
+	logging.basicConfig(level = logging.DEBUG if args.debug else logging.WARNING)
+	sys.exit(simulate(args))
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the ADC backends.
+
+Reports samples per second (one sample = one channel conversion) for
+the bit-bang and spidev backends, reading both knobs at once.
+Run on the Pi, as root, from the top of the repo.
+"""
+
+import sys
+import time
+
+import service.adc as ADC
+import service.option_loader as OL
+opt_ldr = OL.OptionLoader('config.db')
+
+channels = [opt_ldr.fetch('VOL_POT_ADC'), opt_ldr.fetch('TUNE_POT_ADC')]
+secs = 2.0
+
+def bench(adc):
+	count = 0
+	start = time.monotonic()
+	while time.monotonic() - start < secs:
+		adc.read_channels(channels)
+		count += 1
+	elapsed = time.monotonic() - start
+	rate = count * len(channels) * adc.oversample / elapsed
+	print("{:>8} x{:<3} {:>10.0f} samples/s".format(adc.name, adc.oversample, rate))
+
+for oversample in (1, 4):
+	bench(ADC.BitBangADC(opt_ldr.fetch('SPICLK'),
+						opt_ldr.fetch('SPIMOSI'),
+						opt_ldr.fetch('SPIMISO'),
+						opt_ldr.fetch('SPICS'),
+						oversample))
+	try:
+		adc = ADC.SpiADC(opt_ldr.fetch('SPI_BUS'),
+						opt_ldr.fetch('SPI_DEVICE'),
+						opt_ldr.fetch('SPI_SPEED_HZ'),
+						oversample)
+	except (ImportError, IOError, OSError) as e:
+		print("     spi  unavailable: " + str(e))
+		continue
+	bench(adc)
+	adc.close()
+
+sys.exit(0)
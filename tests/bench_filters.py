@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the pot filters.
+
+Reports the cost per sample of each filter, and of a few chains,
+on a noisy tuning sweep. No hardware is touched; run from the top
+of the repo.
+"""
+
+import random
+import time
+
+import service.filters as FLT
+import service.option_loader as OL
+opt_ldr = OL.OptionLoader('config.db')
+
+random.seed(1)
+n = 100000
+trace = [max(0, min(1023, (i // 50) % 1024 + random.randint(-3, 3))) for i in range(n)]
+
+def bench(label, flt):
+	start = time.perf_counter()
+	for val in trace:
+		flt.process(val)
+	elapsed = time.perf_counter() - start
+	print("{:<28} {:8.2f} us/sample".format(label, 1e6 * elapsed / n))
+
+for name in ('ema', 'median', 'hysteresis', 'deadband'):
+	bench(name, FLT.build_filter(name, opt_ldr))
+
+bench('hysteresis (12 edges)', FLT.HysteresisFilter(4, range(40, 1024, 85)))
+
+for spec in ('median,ema', 'median,ema,deadband', 'median,hysteresis,deadband'):
+	bench(spec, FLT.build_chain(spec, opt_ldr))
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the volume mixer backends.
+
+For each backend, fires volume changes as fast as possible for a couple
+of seconds and reports how many were requested and how many actually
+reached the mixer (the rest were coalesced). The old per-change
+'os.system(sudo amixer ...)' is timed for comparison.
+
+Run on the Pi, from the top of the repo.
+"""
+
+import os
+import time
+
+import service.mixer as MX
+import service.option_loader as OL
+opt_ldr = OL.OptionLoader('config.db')
+
+secs = 2.0
+
+def bench(mixer):
+	start = time.monotonic()
+	i = 0
+	while time.monotonic() - start < secs:
+		mixer.set_volume(40 + i % 20)
+		i += 1
+	# Let the worker drain its last request
+	time.sleep(0.2)
+	elapsed = time.monotonic() - start
+	print("{:>8}: {:>10.0f} requests/s, {:>8.0f} applied/s".format(
+			mixer.name, mixer.requested / elapsed, mixer.applied / elapsed))
+	mixer.close()
+
+bench(MX.NullMixer())
+
+try:
+	bench(MX.AmixerMixer(opt_ldr.fetch('MIXER_CONTROL')))
+except OSError as e:
+	print("  amixer: unavailable: " + str(e))
+
+try:
+	import radio.rmpd as rmpd
+	str_man = rmpd.StreamManager(opt_ldr.fetch('MPD_HOST'), opt_ldr.fetch('MPD_PORT'), 1)
+	bench(MX.MPDMixer(str_man))
+except Exception as e:
+	print("     mpd: unavailable: " + str(e))
+
+count = 0
+start = time.monotonic()
+while time.monotonic() - start < secs:
+	os.system('sudo amixer cset {} -- {}% > /dev/null'.format(opt_ldr.fetch('MIXER_CONTROL'), 40 + count % 20))
+	count += 1
+print("{:>8}: {:>10.0f} requests/s".format('system', count / (time.monotonic() - start)))
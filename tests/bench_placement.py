@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the server placement policies (see radio.placement).
+
+Plays one tuning session through a StreamManager for each policy and
+number of servers, preloading as the controller does, and reports the
+warm-switch hit rate (switches to a stream that was already loaded).
+
+	bench_placement.py [trace.bin] [--hours H] [--seed N] [--dwell S] [--stations N] [--pins 1,2,...]
+
+With a trace (recorded with the ADC_TRACE option) the session is the
+recorded one; otherwise a simulated listener (see service.sim) turns
+the dial for 'hours', mostly between a few favourite stations, which
+are also the pins for the 'pinned' policy unless --pins is given. The
+dial has as many stations as config.db, or --stations.
+Switches are coalesced with TUNE_SETTLE, as on the radio.
+
+No hardware or MPD is touched; run from the top of the repo.
+"""
+
+import argparse, random, sqlite3, time
+
+import service.sim
+clock = service.sim.VirtualClock()
+(gpio, mpd) = service.sim.install(clock)
+
+import radio.placement as placement
+import radio.rmpd as rmpd
+import radio.tuning as tuning
+import service.option_loader as OL
+import service.pots as pots
+import service.trace as trace
+opt_ldr = OL.OptionLoader('config.db')
+
+SERVERS = (2, 4, 8, 16)
+
+parser = argparse.ArgumentParser(description = "Benchmark the server placement policies.")
+parser.add_argument('trace', nargs = '?', help = "ADC trace to replay")
+parser.add_argument('--hours', type = float, default = 8.0, help = "simulated hours, without a trace")
+parser.add_argument('--seed', type = int, default = 0, help = "seed for the simulated listener")
+parser.add_argument('--dwell', type = float, default = 120.0, help = "mean seconds on a station")
+parser.add_argument('--stations', type = int, default = 0, help = "stations on the dial, without a trace")
+parser.add_argument('--pins', default = None, help = "favourite station ids, for 'pinned'")
+args = parser.parse_args()
+
+con = sqlite3.connect('config.db')
+with con:
+	num_stations = con.execute("SELECT COUNT(*) FROM playlists").fetchone()[0]
+if args.stations > 0 and not args.trace:
+	num_stations = args.stations
+
+
+def steps():
+	"""
+	Yields (time, tuner, event) for each read of the session.
+	"""
+	if args.trace:
+		tuner = pots.TunerPotReader(opt_ldr.fetch('TUNE_POT_ADC'), num_stations, adc = object())
+		tuner.set_filters(opt_ldr.fetch('TUNE_POT_FILTERS'))
+		for (event,) in trace.replay(args.trace, [tuner]):
+			yield (tuner.adc.time, tuner, event)
+		return
+
+	adc = service.sim.SimADC(clock, {}, seed = args.seed)
+	tuner = pots.TunerPotReader(opt_ldr.fetch('TUNE_POT_ADC'), num_stations, adc, opt_ldr)
+	tuner.set_filters(opt_ldr.fetch('TUNE_POT_FILTERS'))
+	targets = list(tuner.freq_list)
+	# About half the listener's picks are one of their favourites
+	targets += [tuner.freq_list[s] for s in favourites] * max(1, len(targets) // len(favourites))
+	adc.knobs[tuner.pot_pin] = service.sim.ListenerKnob(targets, args.seed, args.dwell)
+	period = 1.0 / opt_ldr.fetch('SAMPLE_RATE')
+	while clock() < args.hours * 3600.0:
+		clock.advance(period)
+		yield (clock(), tuner, tuner.read_pot())
+
+
+def session():
+	"""
+	The switches made: a list of (station, the other stations most
+	likely to be tuned next, best first).
+	"""
+	sweep = tuning.SweepCoalescer(opt_ldr.fetch('TUNE_SETTLE'), opt_ldr.fetch('SWEEP_VELOCITY'))
+	predictor = tuning.PreloadPredictor(opt_ldr.fetch('PRELOAD_HORIZON'))
+	switches = []
+	for (now, tuner, event) in steps():
+		if event is not None:
+			predictor.update(tuner.tuning, now)
+			sid = sweep.update(tuner.tuning, tuner.SID, now)
+		else:
+			sid = sweep.poll(now)
+		if sid is not None and sid >= 0:
+			switches.append((sid, predictor.rank(tuner.freq_list, num_stations, sid, now)))
+	return switches
+
+
+def play(switches, policy, num_servers, pins):
+	str_man = rmpd.StreamManager(opt_ldr.fetch('MPD_HOST'), opt_ldr.fetch('MPD_PORT'),
+			num_servers, parallel = False, policy = policy, pins = pins)
+	for s in range(num_stations):
+		str_man.register_stream(str(s), 'station' + str(s), stream_id = s)
+	str_man.connect()
+	count = min(num_servers - 1, opt_ldr.fetch('PRELOAD_COUNT'))
+	start = time.perf_counter()
+	for (sid, ranked) in switches:
+		str_man.activate_stream(sid)
+		str_man.prefetch(ranked[:count])
+	elapsed = time.perf_counter() - start
+	str_man.close()
+	return (str_man.hit_rate(), elapsed / max(1, len(switches)))
+
+
+favourites = list(range(num_stations))
+if num_stations > 4:
+	favourites = random.Random(args.seed).sample(favourites, 4)
+pins = favourites if args.pins is None else placement.parse_pins(args.pins)
+
+switches = session()
+print("{} stations, {} switches, pins {}, PRELOAD_COUNT {}".format(
+		num_stations, len(switches), sorted(pins), opt_ldr.fetch('PRELOAD_COUNT')))
+print("{:<10}".format('hit rate') + ''.join("{:>9}".format(str(n) + ' svrs') for n in SERVERS) + "{:>12}".format('us/switch'))
+for policy in sorted(placement.POLICIES):
+	results = [play(switches, policy, n, pins) for n in SERVERS]
+	print("{:<10}".format(policy) + ''.join("{:>9.0%}".format(rate) for (rate, secs) in results)
+			+ "{:>12.0f}".format(1e6 * max(secs for (rate, secs) in results)))
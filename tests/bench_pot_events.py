@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+"""
+Micro-benchmark: returned PotEvents vs. raised PotChange exceptions.
+
+Feeds a tuning sweep through a TunerPotReader in both modes.
+No hardware is touched; run from the top of the repo.
+"""
+
+import time
+
+import service.pots as pots
+import service.option_loader as OL
+opt_ldr = OL.OptionLoader('config.db')
+
+class SweepADC(object):
+	name = 'sweep'
+	oversample = 1
+	pos = 0
+
+	def read(self, channel):
+		self.pos = (self.pos + 1) % 1024
+		return self.pos
+
+	def read_channels(self, channels):
+		return [self.read(ch) for ch in channels]
+
+n = 200000
+adc = SweepADC()
+knob = pots.TunerPotReader(opt_ldr.fetch('TUNE_POT_ADC'), 6, adc)
+
+knob.raise_changes = False
+start = time.perf_counter()
+for i in range(n):
+	event = knob.read_pot()
+	if event is not None:
+		is_new = event.is_new_station
+t_return = time.perf_counter() - start
+
+knob.raise_changes = True
+start = time.perf_counter()
+for i in range(n):
+	try:
+		knob.read_pot()
+	except pots.PotChange as pot_notif:
+		is_new = pot_notif.is_new_station
+t_raise = time.perf_counter() - start
+
+print("return: {:8.2f} us/read".format(1e6 * t_return / n))
+print("raise:  {:8.2f} us/read".format(1e6 * t_raise / n))
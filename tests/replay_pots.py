@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+"""
+Replay an ADC trace (recorded with the ADC_TRACE option) through the
+tuning knob, printing each station change, and how many of them would
+have switched MPD once sweeps are coalesced (TUNE_SETTLE).
+
+	replay_pots.py trace.bin [--realtime]
+
+No hardware is touched; run from the top of the repo.
+"""
+
+import sqlite3
+import sys
+import time
+
+import radio.tuning as tuning
+import service.pots as pots
+import service.trace as trace
+import service.option_loader as OL
+opt_ldr = OL.OptionLoader('config.db')
+
+path = sys.argv[1]
+realtime = '--realtime' in sys.argv
+
+con = sqlite3.connect('config.db')
+with con:
+	num_stations = con.execute("SELECT COUNT(*) FROM playlists").fetchone()[0]
+
+tuner = pots.TunerPotReader(opt_ldr.fetch('TUNE_POT_ADC'), num_stations, adc = object())
+tuner.set_filters(opt_ldr.fetch('TUNE_POT_FILTERS'))
+sweep = tuning.SweepCoalescer(opt_ldr.fetch('TUNE_SETTLE'), opt_ldr.fetch('SWEEP_VELOCITY'))
+
+steps = 0
+changes = 0
+start = time.perf_counter()
+for (event,) in trace.replay(path, [tuner], realtime):
+	steps += 1
+	now = tuner.adc.time
+	if event is not None:
+		if event.is_new_station:
+			changes += 1
+			print("{:>8} tuned to station {} at {}".format(steps, tuner.SID, tuner.tuning))
+		sid = sweep.update(tuner.tuning, tuner.SID, now)
+	else:
+		sid = sweep.poll(now)
+	if sid is not None:
+		print("{:>8} would play station {}".format(steps, sid))
+sweep.poll(float('inf'))
+elapsed = time.perf_counter() - start
+
+print("{} reads, {} station changes in {:.3f}s".format(steps, changes, elapsed))
+print("{} switches after coalescing, {} avoided".format(sweep.activated, sweep.avoided))
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+"""
+Checks radio.tuning.PreloadPredictor's ranking while the knob sweeps,
+and once it has come to rest after a sweep.
+
+No hardware needed; run from the top of the repo.
+"""
+
+import radio.tuning as tuning
+
+freq_list = list(range(0, 1000, 100))
+predictor = tuning.PreloadPredictor(horizon = 1.0)
+
+# Sweep up the dial at 500 ticks a second, stopping at 400 (slot 4)
+now = 0.0
+for tick in range(0, 401, 10):
+	now = tick / 500.0
+	predictor.update(tick, now)
+
+moving = predictor.rank(freq_list, 2, exclude = 4, now = now)
+print("Sweeping:", moving)
+assert moving[0] > 4, "a moving knob should rank the stations ahead first"
+
+# The knob rests; no more updates come
+rested = predictor.rank(freq_list, 2, exclude = 4, now = now + 1.0)
+print("At rest:", rested)
+assert sorted(rested) == [3, 5], "a knob at rest should rank its neighbours"
+
+# A new sweep down, after the rest, ranks the stations below
+for tick in range(400, 199, -10):
+	now += 0.02
+	predictor.update(tick, now)
+down = predictor.rank(freq_list, 2, exclude = 2, now = now)
+print("Sweeping back:", down)
+assert down[0] < 2, "a knob moving down should rank the stations below first"
+
+print("OK")